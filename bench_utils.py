@@ -0,0 +1,320 @@
+import datetime
+import os
+import sys
+import time
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+import matplotlib.pyplot as plt
+import utils
+from utils import prepare_session, get_key_ideas, session_frame, DETECTOR_DEPENDENCIES
+from session_utils import SessionContext, run_detectors
+from viz_utils import plot, to_plot, colors, column_to_use, function_to_use
+
+METHODS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),'all_possible_methods.txt')
+
+# The columns of the raw iLab export, in the same order as df_gaps.txt (without the columns prepare_session adds).
+EXPORT_COLUMNS = ['Row ID','login name','condition1','condition2','student1','student2','student 3','class',
+                  'Session Id','time first action','time last action','Time','Time Taken','Problem Name',
+                  'Step Name','Attempt At Step','Outcome','Selection','Graph #',
+                  'Method_Recognized_1_Copied','Method_Recognized_2_Copied','Action','Input','Next_Input',
+                  'Feedback Text','CF(Method1)','CF(Method2)','CF(advice)','CF(new1)','CF(new2)']+\
+                 ['CF(step{0}_{1})'.format(side,step) for side in [1,2] for step in range(1,9)]+\
+                 ['Unnamed: 46','Unnamed: 47','Unnamed: 48','Input.1','Next_Input.1']
+
+# Student actions and how often they show up in real sessions (counted in df_gaps.txt).
+SELECTIONS = {'function1':18,'use1':18,'function2':18,'pointsSelection1':14,'use2':12,'operator1_1':12,
+              'deleteAll1':12,'deleteAll2':11,'pointsSelection2':7,'operator2_1':6,'button1_2':6,'button2_3':6,
+              'button2_2':6,'submit':5,'evaluation':5,'checkIntuition':5,'button1_4':4,'button2_7':4,
+              'fakeDone':3,'intuition':2,'delete1':1,'delete2':1}
+
+# Feedback given by the tutor, with the chance it is given on a row.
+FEEDBACK = {'Good. Click Done to continue.':0.01,
+            'Then please go back to Part 2: Design and revise your method.':0.02,
+            'It looks like you need to work on Part 3: Evaluation right now. Please work on that instead.':0.01}
+
+def load_methods(path=METHODS_PATH):
+    '''Reads the raw method strings the tutor can log, one per line.'''
+    with open(path) as f:
+        return [line.rstrip('\n') for line in f if line.strip()]
+
+def _random_case(rng):
+    #a side of a contrasting case is 5 sorted numbers from 0 to 9, logged as 1 "3" "5" "7" "9"
+    values = sorted(rng.choice(10,5,replace=False))
+    return ' '.join([str(values[0])]+['"{0}"'.format(v) for v in values[1:]])
+
+def generate_session(sessionid, rows=200, cases=2, methods=None, rng=None, incorrect=0.05):
+    '''Makes up the log of one session in the schema of the raw export (see df_gaps.txt).
+
+    Args:
+        sessionid (str): The Session Id to log.
+        rows (int): Number of logged rows.
+        cases (int): Number of contrasting cases the session goes through, in equal blocks of rows.
+        methods (list): Raw method strings to draw from, defaults to all_possible_methods.txt.
+        rng (numpy RandomState): Random generator, so logs can be made again.
+        incorrect (float): Share of rows with an INCORRECT outcome, which prepare_session drops.
+
+    Returns:
+        A Pandas dataframe with one row per logged action.
+    '''
+    if rng is None:
+        rng = np.random.RandomState(0)
+    if methods is None:
+        methods = load_methods()
+    df = pd.DataFrame(index=range(rows),columns=EXPORT_COLUMNS,dtype=object)
+    df['Row ID'] = ['ID{0}'.format(i) for i in range(rows)]
+    df['login name'] = sessionid
+    df['Session Id'] = sessionid
+    df['Problem Name'] = 'trampoline'
+    df['Attempt At Step'] = 1.0
+
+    #times are logged as minutes and seconds, and go back to 00:00 every hour.
+    #fix_times can only undo one such wrap, so the gaps between actions shrink as rows grow to keep sessions under about 50 minutes
+    seconds = rng.randint(0,3600)+np.cumsum(rng.randint(1,max(2,6000//rows),rows))
+    df['Time'] = [datetime.time(0,(s%3600)//60,s%60) for s in seconds]
+
+    weights = np.array(list(SELECTIONS.values()),dtype=float)
+    df['Selection'] = rng.choice(list(SELECTIONS.keys()),rows,p=weights/weights.sum())
+    df['Action'] = np.where(df['Selection'].str.match('use|delete|button'),'ButtonPressed','UpdateComboBox')
+    df['Step Name'] = df['Selection']+' '+df['Action']
+    df['Outcome'] = np.where(rng.rand(rows) < incorrect,'INCORRECT','CORRECT')
+    df['Method_Recognized_1_Copied'] = rng.choice(methods,rows)
+    df['Method_Recognized_2_Copied'] = rng.choice(methods,rows)
+
+    feedback = pd.Series(np.nan,index=df.index,dtype=object)
+    draws = rng.rand(rows)
+    for text,chance in FEEDBACK.items():
+        feedback[(draws < chance) & feedback.isnull()] = text
+        draws = rng.rand(rows)
+    df['Feedback Text'] = feedback
+
+    block = np.arange(rows)*cases//rows
+    for side in ['CF(new1)','CF(new2)']:
+        values = [_random_case(rng) for i in range(cases)]
+        df[side] = [values[b] for b in block]
+    #the tutor says when a new case starts
+    starts = np.flatnonzero(np.diff(block))+1
+    df.loc[starts,'Feedback Text'] = 'Now try working on this new example starting from part 1, prediction.'
+    return df
+
+def generate_log(sessions=10, rows=200, cases=2, seed=0, methods=None):
+    '''Makes up a whole export with many sessions, one after the other.
+
+    Args:
+        sessions (int): Number of sessions.
+        rows (int): Number of logged rows per session.
+        cases (int): Number of contrasting cases per session.
+        seed (int): Seed of the random generator, the same seed gives the same log.
+        methods (list): Raw method strings to draw from, defaults to all_possible_methods.txt.
+
+    Returns:
+        A Pandas dataframe like the one read from 'all data v3.xlsx'.
+    '''
+    rng = np.random.RandomState(seed)
+    if methods is None:
+        methods = load_methods()
+    log = pd.concat([generate_session('S-{0}-{1}'.format(seed,i),rows,cases,methods,rng) for i in range(sessions)],
+                    ignore_index=True)
+    return log
+
+def write_log(df, path):
+    '''Writes a generated log as a csv file like df_gaps.txt.'''
+    df.to_csv(path)
+
+def _timed(function, *args):
+    start = time.time()
+    result = function(*args)
+    return result, time.time()-start
+
+def run_benchmarks(sizes=((1,200,2),(5,500,4),(10,1000,8)), seed=0, draw=True):
+    '''Times each step of the analysis on generated logs of several sizes, so we can tell when one gets slower.
+    Every session of every size is timed separately.
+
+    Args:
+        sizes (list): (sessions, rows per session, cases per session) of each log to generate.
+        seed (int): Seed of the random generator.
+        draw (bool): Also time plot, which draws a whole matplotlib figure per session.
+
+    Returns:
+        A dataframe with the sessions, rows and cases of the log, the step timed and the seconds it took, per session.
+    '''
+    results = []
+    for sessions,rows,cases in sizes:
+        log = generate_log(sessions,rows,cases,seed)
+        for sessionid in log['Session Id'].unique():
+            size = (sessions,rows,cases,sessionid)
+            df, seconds = _timed(prepare_session,log,sessionid)
+            results.append(size+('prepare_session',seconds))
+            for action,function in function_to_use.items():
+                results.append(size+(action,_timed(function,df)[1]))
+            results.append(size+('get_key_ideas',_timed(get_key_ideas,df)[1]))
+            if draw:
+                fig, seconds = _timed(plot,df,to_plot,colors,column_to_use,function_to_use)
+                plt.close('all')
+                results.append(size+('plot',seconds))
+    return pd.DataFrame(results,columns=['sessions','rows','cases','session','step','seconds'])
+
+def summarize_benchmarks(results):
+    '''Gives the mean seconds of each step per log size, one column per size.'''
+    return results.pivot_table(index='step',columns=['sessions','rows','cases'],values='seconds',aggfunc='mean')
+
+# The interval helpers timed by the Profiler, on top of the detectors.
+PROFILED_HELPERS = ['action_usage','merge_usage','intersect_usage','clean_coords']
+
+# Modules whose names are pointed to the timed functions while profiling.
+PROFILED_MODULES = ['utils','session_utils','viz_utils','stream_utils','bench_utils']
+
+class Profiler(object):
+    '''Times the detectors and the interval helpers they use, to find which one makes a session slow.
+
+    Nothing is changed until the profiler is entered with a with statement, so it costs nothing when it is off.
+    Inside the with statement, action_usage, merge_usage, intersect_usage, clean_coords and every detector
+    of function_to_use are replaced (in every module that uses them) by a version that records:
+    the wall time of each call (including the calls it makes), the rows it scanned and, for action_usage, the column and pattern.
+
+    For example:
+        profiler = Profiler()
+        with profiler:
+            for sessionid,df in sessions.items():
+                with profiler.session(sessionid):
+                    plot(df,to_plot,colors,column_to_use,function_to_use)
+        profiler.table()
+        profiler.slowest_patterns()
+
+    Args:
+        detectors (list): The detectors to time, defaults to the ones of function_to_use and their dependencies.
+        helpers (list): The names of the utils functions to time.
+    '''
+    def __init__(self, detectors=None, helpers=PROFILED_HELPERS):
+        if detectors is None:
+            detectors = list(function_to_use.values())+[d for ds in DETECTOR_DEPENDENCIES.values() for d in ds]
+        self.detectors = list(dict((d.__name__,d) for d in detectors).values())
+        self.helpers = [getattr(utils,name) for name in helpers]
+        self.current = 'unlabeled'
+        self.records = [] #(session, function, kind, column, pattern, seconds, rows)
+        self.patched = []
+
+    @contextmanager
+    def session(self, sessionid):
+        '''Labels all calls made inside the with statement as belonging to a session.'''
+        previous = self.current
+        self.current = sessionid
+        try:
+            yield self
+        finally:
+            self.current = previous
+
+    def _wrap(self, function, kind):
+        profiler = self
+        def timed(*args):
+            start = time.time()
+            try:
+                return function(*args)
+            finally:
+                seconds = time.time()-start
+                if kind == 'detector' or function.__name__ == 'action_usage':
+                    rows = len(session_frame(args[0]))
+                else:
+                    #helpers may be handed iterators, which we can't count without using them up
+                    rows = sum(len(arg) for arg in args if hasattr(arg,'__len__'))
+                column,pattern = args[1:3] if function.__name__ == 'action_usage' else (None,None)
+                profiler.records.append((profiler.current,function.__name__,kind,column,pattern,seconds,rows))
+        timed.__name__ = function.__name__
+        timed.__doc__ = function.__doc__
+        return timed
+
+    def __enter__(self):
+        wrappers = dict((id(f),self._wrap(f,'detector')) for f in self.detectors)
+        wrappers.update((id(f),self._wrap(f,'helper')) for f in self.helpers)
+        originals = dict((id(f),f) for f in self.detectors+self.helpers)
+        def swap(function):
+            return wrappers.get(id(function),function)
+        for name in PROFILED_MODULES:
+            module = sys.modules.get(name)
+            if module is None:
+                continue
+            for attribute,value in list(vars(module).items()):
+                if id(value) in originals and value is originals[id(value)]:
+                    self.patched.append((module,attribute,value))
+                    setattr(module,attribute,swap(value))
+        #the detector tables are shared by every module (and used as default arguments), so they are changed in place
+        self.saved = (dict(function_to_use),dict(DETECTOR_DEPENDENCIES))
+        for action,detector in list(function_to_use.items()):
+            function_to_use[action] = swap(detector)
+        dependencies = dict((swap(d),[swap(x) for x in ds]) for d,ds in DETECTOR_DEPENDENCIES.items())
+        DETECTOR_DEPENDENCIES.clear()
+        DETECTOR_DEPENDENCIES.update(dependencies)
+        return self
+
+    def __exit__(self, *exc):
+        for module,attribute,value in self.patched:
+            setattr(module,attribute,value)
+        self.patched = []
+        function_to_use.clear()
+        function_to_use.update(self.saved[0])
+        DETECTOR_DEPENDENCIES.clear()
+        DETECTOR_DEPENDENCIES.update(self.saved[1])
+        return False
+
+    def calls(self):
+        '''Every recorded call, as a dataframe with the session, function, kind, column, pattern, seconds and rows scanned.'''
+        return pd.DataFrame(self.records,columns=['session','function','kind','column','pattern','seconds','rows'])
+
+    def table(self, per_session=True):
+        '''Sums up the calls of each function, per session or across the whole run.
+
+        Returns:
+            A dataframe with the session (when per_session), kind, function, calls, seconds (in total),
+            slowest (seconds of the slowest call) and rows (scanned in total) of each function, slowest first.
+        '''
+        calls = self.calls()
+        by = (['session'] if per_session else [])+['kind','function']
+        groups = calls.groupby(by,sort=False)
+        table = pd.DataFrame({'calls': groups['seconds'].size(),
+                              'seconds': groups['seconds'].sum(),
+                              'slowest': groups['seconds'].max(),
+                              'rows': groups['rows'].sum()},columns=['calls','seconds','slowest','rows']).reset_index()
+        return table.sort_values('seconds',ascending=False).reset_index(drop=True)
+
+    def slowest_patterns(self, n=10, per_session=False):
+        '''The patterns action_usage spent the most time scanning for.
+
+        Returns:
+            A dataframe with the session (when per_session), column, pattern, calls, seconds (in total)
+            and rows (scanned in total) of the n slowest patterns, slowest first.
+        '''
+        calls = self.calls()
+        calls = calls[calls['function'] == 'action_usage']
+        by = (['session'] if per_session else [])+['column','pattern']
+        groups = calls.groupby(by,sort=False)
+        table = pd.DataFrame({'calls': groups['seconds'].size(),
+                              'seconds': groups['seconds'].sum(),
+                              'rows': groups['rows'].sum()},columns=['calls','seconds','rows']).reset_index()
+        return table.sort_values('seconds',ascending=False).head(n).reset_index(drop=True)
+
+    def clear(self):
+        '''Forgets all recorded calls.'''
+        self.records = []
+
+def profile_sessions(sessions, function_to_use=function_to_use, profiler=None):
+    '''Runs every detector of function_to_use on each session under a Profiler,
+    through a SessionContext like plot does (see session_utils.run_detectors).
+
+    Args:
+        sessions (dict): Prepared sessions, session id -> dataframe (ex: prepare_all_sessions(df_all)).
+        function_to_use (dict): The detectors to run.
+        profiler (Profiler): Where to record, a new one by default.
+
+    Returns:
+        The profiler, see Profiler.table and Profiler.slowest_patterns.
+    '''
+    if profiler is None:
+        profiler = Profiler()
+    with profiler:
+        for sessionid,df in sessions.items():
+            with profiler.session(sessionid):
+                run_detectors(SessionContext(df),function_to_use)
+    return profiler
+
+if __name__ == '__main__':
+    print(summarize_benchmarks(run_benchmarks()).to_string())
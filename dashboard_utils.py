@@ -0,0 +1,190 @@
+import json
+import os
+import re
+try:
+    from html import escape
+except ImportError:
+    #python 2
+    from cgi import escape
+from viz_utils import timeline_data, to_plot, colors, column_to_use, function_to_use
+
+# The page of the dashboard. The list of sessions is written in it, and the timeline of a session is only
+# loaded (as a small script calling loadSession) when it is picked, so opening the page stays fast
+# however many sessions there are. Scripts are used rather than JSON files because browsers refuse to
+# fetch files next to a page opened from the disk.
+DASHBOARD_TEMPLATE = '''<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>__TITLE__</title>
+<style>
+body { font-family: sans-serif; margin: 0; display: flex; height: 100vh; }
+#sessions { width: 320px; overflow-y: auto; border-right: 1px solid #ccc; }
+#sessions input { width: 95%; margin: 6px; }
+#sessions div { padding: 4px 8px; cursor: pointer; font-size: 13px; }
+#sessions div:hover, #sessions div.selected { background: #e0e0e0; }
+#main { flex: 1; overflow: auto; padding: 10px; }
+</style>
+</head>
+<body>
+<div id="sessions"><input id="filter" placeholder="filter sessions"></div>
+<div id="main"><h2 id="heading">Pick a session</h2><canvas id="timeline" width="1400" height="700"></canvas></div>
+<script>
+var INDEX = __INDEX__;
+var COLORS = __COLORS__;
+var DATA_DIR = __DATA_DIR__;
+var cache = {};
+var current = null;
+
+function loadSession(data) {
+  cache[data.file] = data;
+  if (current === data.file) { draw(data); }
+}
+
+function show(entry, item) {
+  var items = document.querySelectorAll('#sessions div');
+  for (var i = 0; i < items.length; i++) { items[i].className = ''; }
+  item.className = 'selected';
+  current = entry.file;
+  document.getElementById('heading').textContent = entry.title;
+  if (cache[entry.file]) { draw(cache[entry.file]); return; }
+  var script = document.createElement('script');
+  script.src = DATA_DIR + '/' + entry.file;
+  document.body.appendChild(script);
+}
+
+function draw(data) {
+  var canvas = document.getElementById('timeline');
+  var ctx = canvas.getContext('2d');
+  var left = 190, bottom = 40, top = 10, right = 20;
+  var width = canvas.width - left - right, height = canvas.height - top - bottom;
+  var rows = data.actions.length * data.spacing;
+  var maxTime = Math.max(data.max_time, 60);
+  function x(t) { return left + t / maxTime * width; }
+  function y(v) { return top + height - v / rows * height; }
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  ctx.font = '13px sans-serif';
+  data.case_points.forEach(function (points) {
+    ctx.fillStyle = 'darkgrey';
+    for (var i = 0; i < points[0].length; i++) {
+      ctx.beginPath(); ctx.arc(x(points[0][i]), y(points[1][i]), 2.5, 0, 2 * Math.PI); ctx.fill();
+    }
+  });
+  data.rows.forEach(function (row) {
+    var action = row[0], pos = row[1], coords = row[2];
+    ctx.fillStyle = COLORS[action] || 'grey';
+    for (var i = 0; i < coords.length; i += 2) {
+      ctx.fillRect(x(coords[i]), y(pos + data.spacing), Math.max(x(coords[i] + coords[i + 1]) - x(coords[i]), 1), y(pos) - y(pos + data.spacing));
+    }
+    ctx.fillStyle = 'black'; ctx.textAlign = 'right'; ctx.textBaseline = 'middle';
+    ctx.fillText(action.charAt(0).toUpperCase() + action.slice(1), left - 8, y(pos + data.spacing / 2));
+  });
+  ctx.fillStyle = 'white';
+  for (var i = 0; i < data.new_cases.length; i += 2) {
+    ctx.fillRect(x(data.new_cases[i]), y(rows), Math.max(x(data.new_cases[i] + data.new_cases[i + 1]) - x(data.new_cases[i]), 1), y(0) - y(rows));
+  }
+  if (data.case_row !== null) {
+    ctx.fillStyle = 'black'; ctx.textAlign = 'right';
+    data.solutions.forEach(function (s) { ctx.fillText(s[1], x(s[0] - 5), y(data.case_row + data.spacing / 2)); });
+  }
+  ctx.strokeStyle = 'black'; ctx.fillStyle = 'black'; ctx.textAlign = 'center'; ctx.textBaseline = 'top';
+  for (var t = 0; t < maxTime; t += 60) {
+    ctx.beginPath(); ctx.moveTo(x(t), y(0)); ctx.lineTo(x(t), y(0) + 4); ctx.stroke();
+    if (t % 300 === 0) { ctx.fillText(String(t / 60), x(t), y(0) + 6); }
+  }
+  ctx.fillText('minutes in activity', left + width / 2, y(0) + 22);
+}
+
+var list = document.getElementById('sessions');
+INDEX.forEach(function (entry) {
+  var item = document.createElement('div');
+  item.textContent = entry.title;
+  item.onclick = function () { show(entry, item); };
+  list.appendChild(item);
+});
+document.getElementById('filter').oninput = function () {
+  var text = this.value.toLowerCase();
+  var items = document.querySelectorAll('#sessions div');
+  for (var i = 0; i < items.length; i++) {
+    items[i].style.display = items[i].textContent.toLowerCase().indexOf(text) >= 0 ? '' : 'none';
+  }
+};
+</script>
+</body>
+</html>
+'''
+
+# The placeholders of DASHBOARD_TEMPLATE, filled in by export_dashboard.
+TEMPLATE_PLACEHOLDER = re.compile('__(TITLE|INDEX|COLORS|DATA_DIR)__')
+
+def _script_json(value):
+    #a '</' in a string would end the script element early (ex: a title with '</script>'), '<\/' reads the same in javascript
+    return json.dumps(value).replace('</','<\\/')
+
+def _flat(coords, digits=1):
+    #[(start,duration),...] -> [start,duration,start,duration,...] rounded, which is about half the size in JSON
+    return [round(float(v),digits) for pair in coords for v in pair]
+
+def timeline_payload(data, digits=1):
+    '''Turns the output of timeline_data into plain lists and numbers that can be written as JSON.
+
+    Args:
+        data (dict): The timeline of a session, as given by timeline_data.
+        digits (int): Decimals kept for times and positions.
+
+    Returns:
+        A dictionary with the same keys as timeline_data, with every list of coordinates flattened.
+    '''
+    return {'actions': list(data['actions']),
+            'spacing': data['spacing'],
+            'rows': [[action,pos,_flat(coords,digits)] for action,pos,coords in data['rows']],
+            'case_points': [[[round(float(v),digits) for v in X],[round(float(v),digits) for v in Y]]
+                            for X,Y in data['case_points']],
+            'case_row': data['case_row'],
+            'solutions': [[round(float(t),digits),label] for t,label in data['solutions']],
+            'new_cases': _flat(data['new_cases'],digits),
+            'max_time': round(float(data['max_time']),digits)}
+
+def export_dashboard(sessions, path, titles=None, to_plot=to_plot, colors=colors, column_to_use=column_to_use,
+                     function_to_use=function_to_use):
+    '''Writes a static HTML page showing the timeline of each session, drawn by the browser.
+    The intervals of each session are computed once and written to a small script in a folder next to the page,
+    which the page only loads when the session is picked. Adding a session adds a few kilobytes.
+
+    Args:
+        sessions (dict or list): Prepared sessions, session id -> dataframe (ex: prepare_all_sessions(df_all)) or a list of (session id, dataframe).
+        path (str): Where to write the page, ex: 'viz_all_pairs_activities.html'.
+        titles (dict): Optional title of each session id, ex: 'Trampoline - Alice - L-10f11766:120ecd4f63a:-8000'.
+        to_plot, colors, column_to_use, function_to_use: Same as for plot.
+
+    Returns:
+        The paths of the page and of the session scripts that were written.
+    '''
+    if isinstance(sessions, dict):
+        sessions = list(sessions.items())
+    data_dir = os.path.splitext(os.path.basename(path))[0]+'_data'
+    folder = os.path.join(os.path.dirname(os.path.abspath(path)), data_dir)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    index = []
+    written = []
+    for i,(sessionid,df) in enumerate(sessions):
+        name = 'session-{0:05d}.js'.format(i)
+        payload = timeline_payload(timeline_data(df,to_plot,column_to_use,function_to_use))
+        payload['file'] = name
+        payload['session'] = str(sessionid)
+        with open(os.path.join(folder,name),'w') as f:
+            f.write('loadSession('+json.dumps(payload,separators=(',',':'))+');\n')
+        written.append(os.path.join(folder,name))
+        title = titles[sessionid] if titles is not None else str(sessionid)
+        index.append({'file': name, 'title': title})
+
+    values = {'TITLE': escape(os.path.splitext(os.path.basename(path))[0],True),
+              'INDEX': _script_json(index),
+              'COLORS': _script_json(dict((action,colors[action]) for action in to_plot if action in colors)),
+              'DATA_DIR': _script_json(data_dir)}
+    #all in one pass, so a placeholder written in a title is left as it is
+    page = TEMPLATE_PLACEHOLDER.sub(lambda match: values[match.group(1)], DASHBOARD_TEMPLATE)
+    with open(path,'w') as f:
+        f.write(page)
+    return [path]+written
@@ -0,0 +1,633 @@
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import re
+import sys
+import types
+import zlib
+import pandas as pd
+from utils import STRING_TYPES, PIPELINE_COLUMNS, INTERVAL_SOURCE_COLUMNS, session_patterns, case_patterns, SESSION_COLUMNS, get_key_ideas, get_key_ideas_batch, split_sessions, prepare_session_rows
+from session_utils import SessionContext, schedule_detectors, interval_table
+
+EXPORT_PATH = 'all data v3.xlsx'
+EXPORT_SHEET = 'iLab data.txt'
+
+def export_fingerprint(path):
+    '''Describes the state of the source workbook so we can tell when the cache is stale.
+
+    Args:
+        path (str): Path to the raw iLab export.
+
+    Returns:
+        A dictionary with the size and modification time of the file.
+    '''
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime}
+
+def cache_paths(path, sheet, cache_dir=None):
+    '''Gives the location of the cached table and of its metadata file for a given workbook sheet.
+
+    Args:
+        path (str): Path to the raw iLab export.
+        sheet (str): Name of the sheet holding the logs.
+        cache_dir (str): Folder for the cache. Defaults to the folder of the workbook.
+
+    Returns:
+        (table_path, meta_path) where table_path has no extension yet, since it depends on the format used.
+    '''
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(path))
+    name = os.path.basename(path).replace(' ','_')+'.'+sheet.replace(' ','_')+'.cache'
+    base = os.path.join(cache_dir, name)
+    return base, base+'.json'
+
+def _write_table(df, base):
+    #Parquet keeps the cache columnar so we can read only a few columns back.
+    #If no parquet engine is installed (or a column has mixed types it refuses), we fall back to a pickle.
+    try:
+        df.to_parquet(base+'.parquet')
+        return 'parquet'
+    except (ImportError, ValueError, TypeError):
+        if os.path.exists(base+'.parquet'):
+            os.remove(base+'.parquet')
+        df.to_pickle(base+'.pkl')
+        return 'pickle'
+
+def _read_table(base, fmt, columns=None):
+    if fmt == 'parquet':
+        return pd.read_parquet(base+'.parquet', columns=columns)
+    df = pd.read_pickle(base+'.pkl')
+    if columns is not None:
+        df = df[columns]
+    return df
+
+def build_export_cache(path=EXPORT_PATH, sheet=EXPORT_SHEET, cache_dir=None):
+    '''Parses the workbook once and stores the whole sheet as a columnar cache.
+
+    Args:
+        path (str): Path to the raw iLab export.
+        sheet (str): Name of the sheet holding the logs.
+        cache_dir (str): Folder for the cache, created if needed. Defaults to the folder of the workbook.
+
+    Returns:
+        The metadata describing the cache that was written.
+    '''
+    df = pd.read_excel(path, sheet, index_col=None, na_values=['NA'])
+    base, meta_path = cache_paths(path, sheet, cache_dir)
+    if not os.path.isdir(os.path.dirname(base)):
+        os.makedirs(os.path.dirname(base))
+    meta = {'source': os.path.abspath(path),
+            'sheet': sheet,
+            'fingerprint': export_fingerprint(path),
+            'format': _write_table(df, base),
+            'columns': [str(c) for c in df.columns]}
+    with open(meta_path,'w') as f:
+        json.dump(meta, f)
+    return meta
+
+def cache_is_fresh(path=EXPORT_PATH, sheet=EXPORT_SHEET, cache_dir=None):
+    '''Checks that a cache exists for the workbook and that the workbook hasn't changed since it was built.'''
+    base, meta_path = cache_paths(path, sheet, cache_dir)
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        meta = json.load(f)
+    extension = '.parquet' if meta['format'] == 'parquet' else '.pkl'
+    return meta['fingerprint'] == export_fingerprint(path) and os.path.exists(base+extension)
+
+def load_export(path=EXPORT_PATH, sheet=EXPORT_SHEET, columns=PIPELINE_COLUMNS, cache_dir=None, rebuild=False):
+    '''Loads the raw iLab export through the on-disk cache.
+    The workbook is only parsed when there is no cache yet or when the workbook changed since the cache was built.
+    This replaces pd.read_excel('all data v3.xlsx', 'iLab data.txt', index_col=None, na_values=['NA']) in the notebooks.
+
+    Args:
+        path (str): Path to the raw iLab export.
+        sheet (str): Name of the sheet holding the logs.
+        columns (list): Columns to load. By default only the ones used by the pipeline, use None to load them all.
+        cache_dir (str): Folder for the cache. Defaults to the folder of the workbook.
+        rebuild (bool): Force the workbook to be parsed again.
+
+    Returns:
+        A Pandas dataframe with the requested columns of the export.
+    '''
+    if rebuild or not cache_is_fresh(path, sheet, cache_dir):
+        build_export_cache(path, sheet, cache_dir)
+    base, meta_path = cache_paths(path, sheet, cache_dir)
+    with open(meta_path) as f:
+        meta = json.load(f)
+    if columns is not None:
+        columns = list(columns)
+    return _read_table(base, meta['format'], columns)
+
+def session_digest(df, columns=SESSION_COLUMNS):
+    '''Hashes the prepared rows of a session, so we can tell when a session has changed.
+    Only the columns the detectors read are hashed, and compact sessions hash like the full ones they came from
+    as long as their times are stored with the same dtype.
+
+    Args:
+        df (Pandas dataframe): A prepared session.
+        columns (list): The columns to hash.
+
+    Returns:
+        A hexadecimal string.
+    '''
+    columns = [column for column in columns if column in df.columns]
+    digest = hashlib.sha1(json.dumps(columns).encode('utf-8'))
+    for column in columns:
+        values = df[column]
+        if str(values.dtype) == 'category':
+            values = values.astype(object)
+        digest.update(pd.util.hash_pandas_object(values, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def _code_names(code):
+    #the global names a function reads, including the ones read in its comprehensions and inner functions
+    names = list(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names.extend(_code_names(const))
+    return names
+
+# The folder of this repo, the functions and classes of its modules are followed when fingerprinting a detector.
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def _is_project(value, module):
+    #defined next to the function reading it (ex: in the same notebook) or in one of the modules of this repo
+    if value.__module__ == module:
+        return True
+    path = getattr(sys.modules.get(value.__module__), '__file__', None)
+    return path is not None and os.path.dirname(os.path.abspath(path)) == PROJECT_DIR
+
+def _is_data(value):
+    #constants whose repr is the same in every process (a dict of functions would show their addresses)
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(_is_data(v) for v in value)
+    if isinstance(value, dict):
+        return all(_is_data(k) and _is_data(v) for k,v in value.items())
+    return isinstance(value, STRING_TYPES+(bytes, int, float, bool)) or value is None
+
+def _describe(function):
+    if isinstance(function, type):
+        #the methods and class attributes are described on their own, reading the source of a whole class is slow
+        return 'class '+function.__name__+repr(tuple(base.__name__ for base in function.__bases__))
+    try:
+        return inspect.getsource(function)
+    except (IOError, TypeError):
+        #functions typed in a notebook don't always have their source around, their bytecode will do
+        code = function.__code__
+        return repr((code.co_code, code.co_consts))
+
+# Functions that only list the patterns a session scans for up front. What a detector finds for a pattern
+# doesn't depend on the other patterns scanned with it, so the regexes they read are not followed.
+SCAN_HINTS = (session_patterns, case_patterns)
+
+def detector_dependencies(detector, classes=(SessionContext,), skip=SCAN_HINTS):
+    '''Finds everything the result of a detector depends on: the functions it calls, the functions they call
+    and so on, in this repo's modules or in the notebook the detector was defined in (ex: the detectors it depends on,
+    action_usage and merge_usage), the classes of the session objects it is run on with their methods, and the
+    constants all of these read (ex: REGEX_SINGLE_VALUE_FIRST). Unlike detector_fingerprint, no source is read so this is quick.
+
+    Args:
+        detector (function): A detector, ex: single_value_usage.
+        classes (list): The session classes the detector is run on, whose methods it calls (ex: PatternMatcher.usage).
+        skip (list): Functions not to follow.
+
+    Returns:
+        (code, constants) where code lists the functions and classes found and constants the (name, value) of the constants.
+    '''
+    code = []
+    constants = []
+    seen = set(skip)
+    todo = [detector]+list(classes)
+    while todo:
+        function = todo.pop()
+        if function in seen:
+            continue
+        seen.add(function)
+        code.append(function)
+        if isinstance(function, type):
+            todo.extend(base for base in function.__bases__ if _is_project(base, function.__module__))
+            for name,value in sorted(vars(function).items()):
+                if isinstance(value, types.FunctionType):
+                    #skipping the methods namedtuple writes for us
+                    if _is_project(value, function.__module__):
+                        todo.append(value)
+                elif not name.startswith('__') and _is_data(value):
+                    constants.append((function.__name__+'.'+name, value))
+            continue
+        for name in sorted(set(_code_names(function.__code__))):
+            if name not in function.__globals__:
+                continue
+            value = function.__globals__[name]
+            if isinstance(value, (types.FunctionType, type)):
+                if _is_project(value, function.__module__):
+                    todo.append(value)
+            elif hasattr(value, 'pattern') and hasattr(value, 'flags'):
+                #a compiled regex
+                constants.append((name, (value.pattern, value.flags)))
+            elif _is_data(value):
+                constants.append((name, value))
+    return code, constants
+
+def detector_fingerprint(detector, classes=(SessionContext,)):
+    '''Describes the version of a detector: its source, the source of everything it depends on
+    and the value of the constants they read (see detector_dependencies).
+    Changing any of them, or redefining the detector in a notebook, gives a new fingerprint.
+
+    Args:
+        detector (function): A detector, ex: single_value_usage.
+        classes (list): The session classes the detector is run on.
+
+    Returns:
+        A hexadecimal string.
+    '''
+    digest = hashlib.sha1()
+    code, constants = detector_dependencies(detector, classes)
+    for function in code:
+        digest.update(_describe(function).encode('utf-8'))
+    for name,value in constants:
+        if isinstance(value, (set, frozenset)):
+            #the order of a set changes from one process to the next
+            value = sorted(value, key=repr)
+        digest.update((name+'='+repr(value)).encode('utf-8'))
+    return digest.hexdigest()
+
+def _code_state(code, constants):
+    #what the code found by detector_dependencies runs, to tell when it was redefined or reloaded
+    return (tuple(getattr(function, '__code__', function) for function in code), repr(constants))
+
+class ResultCache(object):
+    '''Keeps the results of detectors (and of get_key_ideas) on disk, per session.
+    A result is found again when both the prepared rows of the session and the version of the detector are unchanged
+    (see session_digest and detector_fingerprint), so after tweaking one regex only the detectors reading it run again.
+
+    For example:
+        cache = ResultCache('detector_cache')
+        usage = cache.run(df, function_to_use)
+        ideas = cache.key_ideas(df)
+
+    Args:
+        cache_dir (str): Folder holding one pickle file per cached result. Created if needed.
+    '''
+    def __init__(self, cache_dir='detector_cache'):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.fingerprints = {} #function -> (code state, fingerprint)
+        self.hits = 0
+        self.misses = 0
+
+    def fingerprint(self, function):
+        '''The fingerprint of a detector. Reading the source is slow, so it is only worked out again when the code
+        or the constants the detector depends on have changed since last time (ex: a regex was edited or a module reloaded).'''
+        state = _code_state(*detector_dependencies(function))
+        if function not in self.fingerprints or self.fingerprints[function][0] != state:
+            self.fingerprints[function] = (state, detector_fingerprint(function))
+        return self.fingerprints[function][1]
+
+    def path(self, digest, function):
+        '''Where the result of a function on a session is kept.'''
+        key = hashlib.sha1((digest+function.__name__+self.fingerprint(function)).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, re.sub('[^a-zA-Z0-9_]','',function.__name__)+'.'+key+'.pkl')
+
+    def get(self, digest, function):
+        '''Gives back a cached result, or None when there is none.'''
+        path = self.path(digest, function)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with open(path,'rb') as f:
+            return pickle.load(f)
+
+    def put(self, digest, function, result):
+        '''Stores a result. It is written to a temporary file first so a crash never leaves half a file behind.'''
+        path = self.path(digest, function)
+        with open(path+'.tmp','wb') as f:
+            pickle.dump(result, f, 2)
+        os.rename(path+'.tmp', path)
+
+    def run(self, df, function_to_use):
+        '''Gives the time coordinates of each row of function_to_use, like run_detectors does,
+        running only the detectors without a cached result.
+        Cached results are handed to the session, so a detector that runs again reuses the ones it depends on.
+
+        Args:
+            df (Pandas dataframe or SessionContext): A prepared session.
+            function_to_use (dict): The detector of each timeline row, ex: viz_utils.function_to_use.
+
+        Returns:
+            A dictionary with the time coordinates found for each row of function_to_use.
+        '''
+        session = df if isinstance(df, SessionContext) else SessionContext(df)
+        digest = session_digest(session.df)
+        missing = []
+        for detector in schedule_detectors(list(function_to_use.values())):
+            if detector in session.results:
+                continue
+            cached = self.get(digest, detector)
+            if cached is None:
+                missing.append(detector)
+            else:
+                session.results[detector] = cached
+        for detector in missing:
+            self.put(digest, detector, session.result(detector))
+        return dict((action, session.result(detector)) for action,detector in function_to_use.items())
+
+    def key_ideas(self, df):
+        '''Same as get_key_ideas, served from the cache when the session and get_key_ideas are unchanged.'''
+        digest = session_digest(df)
+        ideas = self.get(digest, get_key_ideas)
+        if ideas is None:
+            ideas = get_key_ideas(df)
+            self.put(digest, get_key_ideas, ideas)
+        return ideas
+
+    def clear(self):
+        '''Removes every cached result.'''
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.pkl'):
+                os.remove(os.path.join(self.cache_dir, name))
+
+def session_partition(sessionids, partitions):
+    '''Gives the partition of each session id, the same one on every machine and every run (unlike hash()).'''
+    return pd.Series([(zlib.crc32(str(sessionid).encode('utf-8')) & 0xffffffff) % partitions for sessionid in sessionids],
+                     index=getattr(sessionids,'index',None))
+
+def read_chunks(source, chunksize=100000, columns=INTERVAL_SOURCE_COLUMNS):
+    '''Reads a large export a few rows at a time.
+
+    Args:
+        source: A csv file (like df_gaps.txt), a parquet file (like the export cache of load_export)
+                or any iterable of dataframes (ex: chunks of the workbook read some other way).
+        chunksize (int): Rows per chunk for csv and parquet files.
+        columns (list): Columns to keep, None to keep them all. Defaults to the ones interval_table reads,
+                        activity and condition included.
+
+    Returns:
+        A generator of dataframes, in the order of the rows of the export.
+    '''
+    if isinstance(source, str) and source.endswith('.parquet'):
+        import pyarrow.parquet as pq
+        chunks = (batch.to_pandas() for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize))
+    elif isinstance(source, str):
+        chunks = pd.read_csv(source, chunksize=chunksize, dtype=object, na_values=['NA'])
+    else:
+        chunks = source
+    for chunk in chunks:
+        if columns is not None:
+            chunk = chunk[[column for column in columns if column in chunk.columns]]
+        yield chunk
+
+def partition_export(source, spill_dir, partitions=64, chunksize=100000, columns=INTERVAL_SOURCE_COLUMNS):
+    '''Splits an export too large for memory into partition files on disk, by session.
+    Every row of a session goes to the same partition file, and rows are appended in the order they were read,
+    so each session keeps its rows in time order. Only one chunk is in memory at a time.
+
+    Args:
+        source: The export, see read_chunks.
+        spill_dir (str): Folder for the partition files (part-00000.csv, ...). Created if needed.
+        partitions (int): Number of partition files. More partitions means less memory when processing them.
+        chunksize (int): Rows read at a time.
+        columns (list): Columns to keep, None to keep them all. Defaults to the ones interval_table reads,
+                        so process_partitions can fill in the activity and condition of each session.
+
+    Returns:
+        The paths of the partition files that were written, in order.
+    '''
+    if not os.path.isdir(spill_dir):
+        os.makedirs(spill_dir)
+    written = set()
+    header = None
+    for chunk in read_chunks(source, chunksize, columns):
+        if header is None:
+            header = list(chunk.columns)
+            #start from empty files, in case the folder was used before
+            for name in os.listdir(spill_dir):
+                if name.startswith('part-') and name.endswith('.csv'):
+                    os.remove(os.path.join(spill_dir, name))
+        chunk = chunk[header]
+        for part,rows in chunk.groupby(session_partition(chunk['Session Id'], partitions).values, sort=True):
+            path = os.path.join(spill_dir, 'part-{0:05d}.csv'.format(part))
+            rows.to_csv(path, mode='a', header=path not in written, index=False)
+            written.add(path)
+    return sorted(written)
+
+def iter_partition_sessions(spill_dir):
+    '''Reads the partition files one at a time and gives back the raw rows of each session in them.
+
+    Returns:
+        A generator of (session id, rows) where the rows are in the order they were logged.
+    '''
+    for name in sorted(os.listdir(spill_dir)):
+        if not (name.startswith('part-') and name.endswith('.csv')):
+            continue
+        df = pd.read_csv(os.path.join(spill_dir, name), dtype=object, na_values=['NA'])
+        for sessionid,rows in split_sessions(df).items():
+            yield sessionid, rows
+
+def iter_prepared_sessions(spill_dir):
+    '''Same as iter_partition_sessions, with each session prepared like prepare_session does.'''
+    for sessionid,rows in iter_partition_sessions(spill_dir):
+        yield sessionid, prepare_session_rows(rows)
+
+def process_partitions(spill_dir, function_to_use, column_to_use=None, activities=None, conditions=None):
+    '''Runs the detectors over every session of the partition files, one partition at a time,
+    so the memory used is bounded by the largest partition rather than by the whole export.
+
+    Args:
+        spill_dir (str): Folder with the partition files written by partition_export.
+        function_to_use (dict): The detector of each timeline row, ex: viz_utils.function_to_use.
+        column_to_use (dict): The actions found by name in a column, ex: viz_utils.column_to_use.
+        activities (dict): Optional activity of each session id, see session_utils.interval_table.
+        conditions (dict): Optional condition of each session id, see session_utils.interval_table.
+
+    Returns:
+        The interval table of all sessions (see session_utils.interval_table), sessions in partition order.
+    '''
+    tables = []
+    for sessionid,df in iter_prepared_sessions(spill_dir):
+        tables.append(interval_table([(sessionid,df)], function_to_use, column_to_use, activities, conditions))
+    if not tables:
+        return interval_table([], function_to_use, column_to_use)
+    return pd.concat(tables, ignore_index=True)
+
+# Excel can't hold more rows than this on a sheet (header included).
+EXCEL_MAX_ROWS = 1048576
+
+def _plain_frame(df):
+    #categories (see compact_session) are written as the values they stand for
+    df = df.copy()
+    for column in df.columns:
+        if str(df[column].dtype) == 'category':
+            df[column] = df[column].astype(object)
+    return df
+
+class CsvTableWriter(object):
+    '''Writes a table to a csv file a few rows at a time, the header only once.
+
+    Args:
+        path (str): The csv file to write.
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.f = open(path,'w')
+        self.columns = None
+        self.header_written = False
+        self.rows = 0
+
+    def write(self, df):
+        '''Appends the rows of a dataframe. Every dataframe must have the columns of the first one.'''
+        if self.columns is None:
+            self.columns = list(df.columns)
+        #the header goes with the first dataframe, even when it has no rows
+        df[self.columns].to_csv(self.f, header=not self.header_written, index=False)
+        self.header_written = True
+        self.rows += len(df)
+
+    def close(self):
+        self.f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+class ParquetTableWriter(CsvTableWriter):
+    '''Writes a table to a parquet file a few rows at a time, each write becoming a row group. Needs pyarrow.
+    Text columns are always stored as strings, so a first dataframe with an empty column doesn't fix its type.
+
+    Args:
+        path (str): The parquet file to write.
+    '''
+    def __init__(self, path):
+        import pyarrow
+        self.pa = pyarrow
+        self.path = path
+        self.writer = None
+        self.columns = None
+        self.rows = 0
+
+    def write(self, df):
+        '''Appends the rows of a dataframe. Every dataframe must have the columns of the first one.'''
+        import pyarrow.parquet as pq
+        df = _plain_frame(df)
+        if self.writer is None:
+            self.columns = list(df.columns)
+            fields = []
+            for column in self.columns:
+                if df[column].dtype == object or str(df[column].dtype) in ['str','string']:
+                    fields.append(self.pa.field(str(column), self.pa.string()))
+                else:
+                    fields.append(self.pa.field(str(column), self.pa.from_numpy_dtype(df[column].dtype)))
+            self.schema = self.pa.schema(fields)
+            self.writer = pq.ParquetWriter(self.path, self.schema)
+        df = df[self.columns]
+        for field in self.schema:
+            if field.type == self.pa.string():
+                df[field.name] = df[field.name].map(str, na_action='ignore')
+        self.writer.write_table(self.pa.Table.from_pandas(df, schema=self.schema, preserve_index=False))
+        self.rows += len(df)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+class ExcelTableWriter(CsvTableWriter):
+    '''Writes a table to an xlsx file a few rows at a time, with xlsxwriter's constant memory mode
+    (rows are flushed to disk as soon as they are written). Needs xlsxwriter.
+    When a sheet is full, the table goes on in a new sheet with the same header, ex: 'Sheet1 (2)'.
+
+    Args:
+        path (str): The xlsx file to write.
+        sheet (str): Name of the first sheet.
+    '''
+    def __init__(self, path, sheet='Sheet1'):
+        import xlsxwriter
+        self.path = path
+        self.sheet = sheet
+        self.workbook = xlsxwriter.Workbook(path, {'constant_memory': True, 'nan_inf_to_errors': True})
+        self.worksheet = None
+        self.sheets = 0
+        self.row = 0
+        self.columns = None
+        self.rows = 0
+
+    def _new_sheet(self):
+        self.sheets += 1
+        name = self.sheet if self.sheets == 1 else '{0} ({1})'.format(self.sheet,self.sheets)
+        self.worksheet = self.workbook.add_worksheet(name)
+        self.worksheet.write_row(0, 0, [str(column) for column in self.columns])
+        self.row = 1
+
+    def write(self, df):
+        '''Appends the rows of a dataframe. Every dataframe must have the columns of the first one.'''
+        if self.columns is None:
+            self.columns = list(df.columns)
+        df = _plain_frame(df)[self.columns]
+        for values in df.itertuples(index=False):
+            if self.worksheet is None or self.row == EXCEL_MAX_ROWS:
+                self._new_sheet()
+            #missing values are left as empty cells
+            self.worksheet.write_row(self.row, 0, [None if pd.isnull(v) else v for v in values])
+            self.row += 1
+        self.rows += len(df)
+
+    def close(self):
+        if self.worksheet is None and self.columns is not None:
+            self._new_sheet()
+        self.workbook.close()
+
+def table_writer(path, **kwargs):
+    '''Gives the writer for a file, chosen by its extension: .csv (or .txt), .parquet or .xlsx.'''
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        return ParquetTableWriter(path, **kwargs)
+    if extension == '.xlsx':
+        return ExcelTableWriter(path, **kwargs)
+    if extension in ['.csv','.txt']:
+        return CsvTableWriter(path, **kwargs)
+    raise ValueError('Unknown table format: '+path)
+
+def export_key_ideas(sessions, path, pseudonyms=None):
+    '''Writes the tried methods of many sessions (the get_key_ideas table with session and pseudonym columns)
+    to a csv, parquet or xlsx file one session at a time, so the whole table is never held in memory.
+    This replaces building mega_df and writing it through pd.ExcelWriter.
+
+    Args:
+        sessions: Prepared sessions, as a dictionary of session id -> dataframe
+                  or any iterable of (session id, dataframe), ex: iter_prepared_sessions(spill_dir).
+        path (str): The file to write, see table_writer.
+        pseudonyms (dict): Optional pseudonym of each session id.
+
+    Returns:
+        The number of rows written.
+    '''
+    if isinstance(sessions, dict):
+        sessions = sessions.items()
+    with table_writer(path) as writer:
+        for sessionid,df in sessions:
+            writer.write(get_key_ideas_batch([(sessionid,df)],pseudonyms))
+    return writer.rows
+
+def export_sessions(sessions, path, columns=SESSION_COLUMNS):
+    '''Writes prepared sessions one after the other to a csv, parquet or xlsx file, one session at a time.
+
+    Args:
+        sessions: Prepared sessions, as a dictionary of session id -> dataframe or any iterable of (session id, dataframe).
+        path (str): The file to write, see table_writer.
+        columns (list): The columns to write, None for all of them. Every session must have them.
+
+    Returns:
+        The number of rows written.
+    '''
+    if isinstance(sessions, dict):
+        sessions = sessions.items()
+    with table_writer(path) as writer:
+        for sessionid,df in sessions:
+            writer.write(df if columns is None else df[columns])
+    return writer.rows
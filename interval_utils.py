@@ -0,0 +1,308 @@
+import numpy as np
+import pandas as pd
+
+class IntervalSet(object):
+    '''A set of time intervals kept as sorted numpy arrays of start and end times.
+    Overlapping or touching intervals are merged together, the same way clean_coords merges coordinates,
+    so the set always holds disjoint intervals sorted by start time.
+
+    It can be built from and turned back into the (start_time, duration) coordinates used everywhere else,
+    so it can replace merge_usage, intersect_usage and clean_coords one function at a time.
+
+    Args:
+        starts (list): Start times of the intervals.
+        ends (list): End times of the intervals.
+
+    For example:
+        x = IntervalSet.from_coords([(0,1),(2,3),(10,3)])
+        y = IntervalSet.from_coords([(0,2),(3,1),(9,2),(12,2)])
+        (x | y).to_coords() -> [(0.0, 5.0), (9.0, 5.0)]
+        (x & y).to_coords() -> [(0.0, 1.0), (3.0, 1.0), (10.0, 1.0), (12.0, 1.0)]
+    '''
+    def __init__(self, starts=(), ends=()):
+        starts = np.asarray(starts, dtype=float).ravel()
+        ends = np.asarray(ends, dtype=float).ravel()
+        if starts.shape != ends.shape:
+            raise ValueError('Need as many start times as end times: {0} and {1}'.format(len(starts),len(ends)))
+        self.starts, self.ends = _normalize(starts, ends)
+
+    @classmethod
+    def from_coords(cls, coords):
+        '''Builds the set from a list of coordinates in the format (start_time, duration).'''
+        coords = np.asarray(list(coords), dtype=float).reshape(-1,2)
+        return cls(coords[:,0], coords[:,0]+coords[:,1])
+
+    def to_coords(self):
+        '''Gives back the intervals as a sorted list of coordinates in the format (start_time, duration).'''
+        return list(zip(self.starts.tolist(), (self.ends-self.starts).tolist()))
+
+    def union(self, other):
+        '''All times covered by either set.'''
+        return IntervalSet(np.concatenate([self.starts,other.starts]), np.concatenate([self.ends,other.ends]))
+
+    def intersection(self, other):
+        '''All times covered by both sets.'''
+        return _combine(self, other, lambda a,b: a & b)
+
+    def difference(self, other):
+        '''All times covered by this set but not by the other.'''
+        return _combine(self, other, lambda a,b: a & ~b)
+
+    def coverage(self):
+        '''Total length of time covered by the set.'''
+        return float(np.sum(self.ends-self.starts))
+
+    __or__ = union
+    __and__ = intersection
+    __sub__ = difference
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return iter(self.to_coords())
+
+    def __eq__(self, other):
+        return (isinstance(other, IntervalSet) and np.array_equal(self.starts,other.starts)
+                and np.array_equal(self.ends,other.ends))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return 'IntervalSet({0})'.format(self.to_coords())
+
+def _normalize(starts, ends):
+    #sort by start time and merge each interval into the previous one when it starts before the previous ones end
+    if len(starts) == 0:
+        return starts, ends
+    order = np.lexsort((ends, starts))
+    starts, ends = starts[order], ends[order]
+    reach = np.maximum.accumulate(ends)
+    first = np.concatenate([[True], starts[1:] > reach[:-1]])
+    first_idx = np.flatnonzero(first)
+    return starts[first_idx], np.maximum.reduceat(ends, first_idx)
+
+def _combine(x, y, keep):
+    #sweep over all boundaries of both sets, counting whether we are inside x and inside y,
+    #and keep the pieces in between boundaries where keep(inside_x,inside_y) holds
+    positions = np.concatenate([x.starts, x.ends, y.starts, y.ends])
+    in_x = np.concatenate([np.ones(len(x)), -np.ones(len(x)), np.zeros(2*len(y))])
+    in_y = np.concatenate([np.zeros(2*len(x)), np.ones(len(y)), -np.ones(len(y))])
+    order = np.argsort(positions, kind='mergesort')
+    positions = positions[order]
+    inside = keep(np.cumsum(in_x[order]) > 0, np.cumsum(in_y[order]) > 0)[:-1]
+    starts, ends = positions[:-1], positions[1:]
+    pieces = inside & (ends > starts)
+    return IntervalSet(starts[pieces], ends[pieces])
+
+def merge_intervals(table, keys=('session','detector')):
+    '''Merges overlapping or touching intervals of a long interval table within each group of keys,
+    the same way IntervalSet does, for all groups at once.
+
+    Args:
+        table (Pandas dataframe): One interval per row, with start and duration columns (see session_utils.interval_table).
+        keys (list): The columns that make up a group, ex: ('session','detector').
+
+    Returns:
+        A dataframe with the key columns, start and duration, sorted by keys and start.
+    '''
+    keys = list(keys)
+    table = table.sort_values(keys+['start'], kind='mergesort')
+    if len(table) == 0:
+        return table[keys+['start','duration']].reset_index(drop=True)
+    starts = table['start'].values.astype(float)
+    ends = starts+table['duration'].values
+    group = table.groupby(keys, sort=False).ngroup().values
+    #how far the intervals before each one reach within its group
+    reach = pd.Series(ends).groupby(group).cummax().values
+    new_group = np.concatenate([[True], group[1:] != group[:-1]])
+    new_block = new_group | np.concatenate([[True], starts[1:] > reach[:-1]])
+    block = np.cumsum(new_block)-1
+    merged = table[keys][new_block].reset_index(drop=True)
+    merged['start'] = starts[new_block]
+    merged['duration'] = np.maximum.reduceat(ends, np.flatnonzero(new_block))-merged['start'].values
+    return merged
+
+def usage_summary(table, by=('detector',)):
+    '''Sums up how much each strategy was used and how early, per group of sessions.
+    Overlapping intervals of the same session are only counted once.
+
+    Args:
+        table (Pandas dataframe): The long interval table (see session_utils.interval_table).
+        by (list): The columns to group by, ex: ('detector',) or ('activity','detector') or ('condition','detector').
+
+    Returns:
+        A dataframe indexed by the by columns with:
+            sessions: number of sessions where it was used
+            total_time: seconds of use summed over these sessions
+            mean_time: mean seconds of use per session using it
+            first_use_mean, first_use_median: when it was first used, in seconds from the start of the session
+
+    Raises:
+        ValueError: When a by column is not in the table or is missing for some intervals, since they would be left out
+                    (ex: activity and condition are empty when the sessions didn't have the columns they are read from).
+    '''
+    by = list(by)
+    for column in by:
+        if column not in table.columns:
+            raise ValueError('Cannot group by a column the interval table does not have: '+column)
+        missing = table[column].isnull()
+        if missing.any():
+            raise ValueError('No {0} for {1} of the {2} sessions, pass them to interval_table'.format(
+                column, table.loc[missing,'session'].nunique(), table['session'].nunique()))
+    keys = ['session']+[column for column in by if column != 'session']
+    per_session = merge_intervals(table, keys)
+    groups = per_session.groupby(keys)
+    per_session = pd.DataFrame({'time': groups['duration'].sum(), 'first_use': groups['start'].min()}).reset_index()
+    groups = per_session.groupby(by)
+    return pd.DataFrame({'sessions': groups['time'].size(),
+                         'total_time': groups['time'].sum(),
+                         'mean_time': groups['time'].mean(),
+                         'first_use_mean': groups['first_use'].mean(),
+                         'first_use_median': groups['first_use'].median()},
+                        columns=['sessions','total_time','mean_time','first_use_mean','first_use_median'])
+
+class IntervalIndex(object):
+    '''Answers questions about the intervals of many sessions at once, without running the detectors again.
+    ex: which sessions used Range within the first 5 minutes of a case, or who used Central tendency and Count gaps at the same time.
+
+    The intervals of each detector are merged within each session (see merge_intervals) and kept as numpy arrays
+    sorted by session then start time. Times are shifted by session so that the intervals of different sessions
+    never overlap, which lets every query be a couple of binary searches (searchsorted) over one array per detector.
+
+    For example:
+        index = IntervalIndex(interval_table(sessions, function_to_use, column_to_use))
+        index.overlapping('Range', 0, 300)
+        index.near_case_start('Range', 300)
+        index.co_occurrence('Central tendency', 'Count gaps')
+
+    Args:
+        table (Pandas dataframe): The long interval table, see session_utils.interval_table.
+    '''
+    def __init__(self, table):
+        merged = merge_intervals(table, ('session','detector'))
+        #activity and condition are the same for a whole session
+        details = table.drop_duplicates('session').set_index('session')
+        for column in ['activity','condition']:
+            if column in table.columns:
+                merged[column] = merged['session'].map(details[column]).values
+        self.table = merged[[column for column in table.columns if column in merged.columns]]
+        codes,self.sessions = pd.factorize(merged['session'])
+        starts = merged['start'].values.astype(float)
+        ends = starts+merged['duration'].values
+        #each session gets its own stretch of time, longer than any session, so that sessions never overlap
+        self.origin = starts.min() if len(starts) else 0.0
+        self.length = ends.max()-self.origin if len(starts) else 0.0
+        self.span = self.length*2+1
+        self.codes = codes
+        self.detectors = {}
+        keys = codes*self.span+(starts-self.origin)
+        for detector in pd.unique(merged['detector']):
+            rows = np.flatnonzero(merged['detector'].values == detector)
+            order = rows[np.argsort(keys[rows], kind='mergesort')]
+            self.detectors[detector] = (order, keys[order], keys[order]+(ends[order]-starts[order]))
+
+    def _key(self, sessions, times):
+        #every interval lies between 0 and length in the stretch of its session, so clamping times to it
+        #doesn't change what a window overlaps, but keeps windows (ex: open-ended ones) from reaching into the next sessions
+        codes = self.sessions.get_indexer(sessions)
+        return codes, codes*self.span+np.clip(np.asarray(times,dtype=float)-self.origin, 0, self.length+1)
+
+    def _windows(self, start, end, sessions=None):
+        #the same time window in each session
+        if sessions is None:
+            sessions = self.sessions
+        sessions = np.asarray(sessions, dtype=object)
+        return sessions, np.full(len(sessions), float(start)), np.full(len(sessions), float(end))
+
+    def _overlaps(self, detector, sessions, starts, ends):
+        #every (window, interval) pair where the interval of the detector overlaps the window of the same session
+        if detector not in self.detectors:
+            return np.zeros(0,dtype=int), np.zeros(0,dtype=int)
+        order,keys,key_ends = self.detectors[detector]
+        codes,low = self._key(sessions, starts)
+        codes,high = self._key(sessions, ends)
+        known = codes >= 0
+        longest = (key_ends-keys).max() if len(keys) else 0.0
+        #intervals that overlap a window start at most the longest duration before it, and before it ends
+        first = np.searchsorted(keys, low-longest, 'left')
+        last = np.searchsorted(keys, high, 'left')
+        counts = np.where(known, np.maximum(last-first,0), 0)
+        window = np.repeat(np.arange(len(low)), counts)
+        position = np.repeat(first-np.cumsum(counts)+counts, counts)+np.arange(counts.sum())
+        #a point-like interval (no duration) overlaps when it falls inside the window
+        keep = (key_ends[position] > low[window]) | (keys[position] >= low[window])
+        return window[keep], order[position[keep]]
+
+    def overlapping(self, detector, start, end, sessions=None):
+        '''The intervals of a detector that overlap a time window (in seconds from the start of each session).
+
+        Args:
+            detector (str): The timeline row, ex: 'Range'.
+            start, end (float): The time window, ex: 0 and 300 for the first 5 minutes.
+            sessions (list): Only look in these sessions, defaults to all of them.
+
+        Returns:
+            A dataframe of intervals like the interval table, sorted by session and start.
+        '''
+        window,rows = self._overlaps(detector, *self._windows(start, end, sessions))
+        return self.table.iloc[np.sort(rows)].reset_index(drop=True)
+
+    def containing(self, detector, start, end, sessions=None):
+        '''The intervals of a detector that cover a whole time window, ex: still using Range from 5 to 10 minutes.'''
+        table = self.overlapping(detector, start, end, sessions)
+        return table[(table['start'] <= start) & (table['start']+table['duration'] >= end)].reset_index(drop=True)
+
+    def within(self, detector, start, end, sessions=None):
+        '''The intervals of a detector that start and end inside a time window.'''
+        table = self.overlapping(detector, start, end, sessions)
+        return table[(table['start'] >= start) & (table['start']+table['duration'] <= end)].reset_index(drop=True)
+
+    def sessions_using(self, detector, start=None, end=None):
+        '''The sessions where a detector found something, optionally only within a time window.'''
+        if start is None:
+            table = self.table[self.table['detector'] == detector]
+        else:
+            table = self.overlapping(detector, start, end if end is not None else np.inf)
+        return list(pd.unique(table['session']))
+
+    def near_case_start(self, detector, seconds, case_detector='Cases'):
+        '''The intervals of a detector overlapping the first seconds of any case of their session,
+        ex: near_case_start('Range', 300) for Range used within 5 minutes of a new case.
+        Cases start where the intervals of case_detector start.
+
+        Returns:
+            A dataframe of intervals like the interval table, with the case_start they are close to.
+        '''
+        cases = self.table[self.table['detector'] == case_detector]
+        window,rows = self._overlaps(detector, cases['session'].values, cases['start'].values, cases['start'].values+seconds)
+        table = self.table.iloc[rows].reset_index(drop=True)
+        table['case_start'] = cases['start'].values[window]
+        return table.sort_values(['session','start','case_start'], kind='mergesort').reset_index(drop=True)
+
+    def co_occurrence(self, detector, other, min_overlap=0.0):
+        '''The times when two detectors found something at the same time in the same session,
+        ex: co_occurrence('Central tendency', 'Count gaps').
+
+        Args:
+            detector, other (str): The two timeline rows.
+            min_overlap (float): Only keep times shared for longer than this many seconds.
+
+        Returns:
+            A dataframe with the session, start and duration of each stretch of time both were used.
+        '''
+        if other not in self.detectors:
+            return pd.DataFrame(columns=['session','start','duration'])
+        order,keys,key_ends = self.detectors[other]
+        others = self.table.iloc[order]
+        window,rows = self._overlaps(detector, others['session'].values, others['start'].values,
+                                     others['start'].values+others['duration'].values)
+        mine = self.table.iloc[rows]
+        theirs = others.iloc[window]
+        starts = np.maximum(mine['start'].values, theirs['start'].values)
+        ends = np.minimum(mine['start'].values+mine['duration'].values, theirs['start'].values+theirs['duration'].values)
+        shared = pd.DataFrame({'session': mine['session'].values, 'start': starts, 'duration': ends-starts},
+                              columns=['session','start','duration'])
+        shared = shared[shared['duration'] > min_overlap]
+        return shared.sort_values(['session','start'], kind='mergesort').reset_index(drop=True)
@@ -0,0 +1,172 @@
+import json
+import os
+import time
+from multiprocessing import Pool
+import numpy as np
+import pandas as pd
+from utils import INTERVAL_SOURCE_COLUMNS, prepare_session_rows, get_key_ideas_batch, times_to_timedelta
+from session_utils import interval_table
+from viz_utils import function_to_use, column_to_use
+
+def share_export(df, folder, columns=INTERVAL_SOURCE_COLUMNS):
+    '''Writes the export as memory-mapped numpy columns, so worker processes can all read it without copying it.
+    Rows are grouped by session (keeping the order they were logged in within each session),
+    so a session is just a range of rows that workers are told about by its start and stop. Rows without a Session Id are left out.
+    Text columns are stored as integer codes plus their distinct values, and Time as microseconds since midnight.
+
+    Args:
+        df (Pandas dataframe): The raw export with all sessions.
+        folder (str): Where to write the columns. Created if needed.
+        columns (list): Columns to keep, defaults to the ones interval_table reads (utils.INTERVAL_SOURCE_COLUMNS). None keeps them all.
+
+    Returns:
+        A SharedExport reading the folder.
+    '''
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    if columns is not None:
+        df = df[[column for column in columns if column in df.columns]]
+    #rows without a session can't be analyzed, and sorted first they would shift the rows of every session
+    df = df[df['Session Id'].notnull()]
+    codes,sessionids = pd.factorize(df['Session Id'])
+    #codes follow the order sessions first show up in, and a stable sort keeps the rows of a session in order
+    order = np.argsort(codes, kind='mergesort')
+    counts = np.bincount(codes, minlength=len(sessionids))
+    stops = np.cumsum(counts)
+    meta = {'columns': [], 'sessions': [[str(s),int(stop-count),int(stop)] for s,count,stop in zip(sessionids,counts,stops)]}
+    for i,column in enumerate(df.columns):
+        values = df[column].iloc[order]
+        name = 'column-{0:03d}'.format(i)
+        if column == 'Time':
+            deltas = times_to_timedelta(values)
+            np.save(os.path.join(folder,name+'.npy'), deltas.view(np.int64))
+            meta['columns'].append({'name': column, 'file': name, 'kind': 'time'})
+        else:
+            column_codes,uniques = pd.factorize(values)
+            np.save(os.path.join(folder,name+'.npy'), column_codes.astype(np.int32))
+            with open(os.path.join(folder,name+'.json'),'w') as f:
+                json.dump([_plain(v) for v in uniques], f)
+            meta['columns'].append({'name': column, 'file': name, 'kind': 'codes'})
+    with open(os.path.join(folder,'export.json'),'w') as f:
+        json.dump(meta, f)
+    return SharedExport(folder)
+
+def _plain(value):
+    #numpy numbers can't be written as JSON
+    return value.item() if hasattr(value,'item') else value
+
+class SharedExport(object):
+    '''Reads an export written by share_export. The columns are memory-mapped,
+    so opening it is instant and only the rows asked for are read from the disk (once, by all processes).
+
+    Args:
+        folder (str): The folder written by share_export.
+    '''
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder,'export.json')) as f:
+            meta = json.load(f)
+        self.sessions = [(sessionid,start,stop) for sessionid,start,stop in meta['sessions']]
+        #session id -> (start, stop), to find the rows of a session without going through all of them
+        self.ranges = dict((sessionid,(start,stop)) for sessionid,start,stop in self.sessions)
+        self.columns = []
+        for column in meta['columns']:
+            data = np.load(os.path.join(folder,column['file']+'.npy'), mmap_mode='r')
+            uniques = None
+            if column['kind'] == 'codes':
+                with open(os.path.join(folder,column['file']+'.json')) as f:
+                    #one more value at the end for the code -1 of missing values
+                    uniques = np.array(json.load(f)+[np.nan], dtype=object)
+            self.columns.append((column['name'],data,uniques))
+
+    def rows(self, start, stop):
+        '''The raw rows from start to stop, as a dataframe like the export (Time as timedelta64).'''
+        frame = {}
+        for name,data,uniques in self.columns:
+            values = np.asarray(data[start:stop])
+            if uniques is None:
+                frame[name] = values.view('timedelta64[us]')
+            else:
+                frame[name] = uniques[values]
+        return pd.DataFrame(frame, columns=[name for name,data,uniques in self.columns], index=np.arange(start,stop))
+
+    def session_rows(self, sessionid):
+        '''The raw rows of one session.'''
+        if sessionid not in self.ranges:
+            raise KeyError('No such session in the shared export: '+str(sessionid))
+        start,stop = self.ranges[sessionid]
+        return self.rows(start,stop)
+
+_worker_export = None
+_worker_settings = None
+
+def _init_analysis_worker(folder, settings):
+    #each worker maps the columns once and reuses them for all its sessions
+    global _worker_export, _worker_settings
+    _worker_export = SharedExport(folder)
+    _worker_settings = settings
+
+def _analyze_session(task):
+    position,sessionid,start,stop = task
+    function_to_use,column_to_use,activities,conditions = _worker_settings
+    began = time.time()
+    df = prepare_session_rows(_worker_export.rows(start,stop))
+    intervals = interval_table([(sessionid,df)],function_to_use,column_to_use,activities,conditions)
+    ideas = get_key_ideas_batch([(sessionid,df)])
+    return position,os.getpid(),stop-start,time.time()-began,intervals,ideas
+
+def analyze_sessions(shared, sessionids=None, processes=None, function_to_use=function_to_use,
+                     column_to_use=column_to_use, activities=None, conditions=None, progress=None):
+    '''Prepares sessions, runs every detector and finds the key ideas, spreading the sessions over worker processes.
+    Workers read the rows of their sessions from the memory-mapped export, so only a session's
+    start and stop rows are sent to them, never the export itself.
+    The tables come back in the order of sessionids whatever order the workers finish in.
+
+    Args:
+        shared (SharedExport): The export, see share_export.
+        sessionids (list): The sessions to analyze, defaults to all of them in the order of the export.
+        processes (int): Number of worker processes. Defaults to the number of cpus, use 1 to do everything in this process.
+        function_to_use, column_to_use: The detectors and actions to look for, same as for plot.
+        activities (dict): Optional activity of each session id, see session_utils.interval_table.
+        conditions (dict): Optional condition of each session id, see session_utils.interval_table.
+        progress (function): Called as progress(worker, sessions done by that worker, sessions done, total) after each session.
+
+    Returns:
+        (intervals, ideas, workers) where intervals is the interval table (see session_utils.interval_table),
+        ideas is the tried methods table (see get_key_ideas_batch)
+        and workers gives the sessions, rows and seconds spent by each worker process.
+    '''
+    if sessionids is None:
+        sessionids = [sessionid for sessionid,start,stop in shared.sessions]
+    tasks = [(position,sessionid)+shared.ranges[sessionid] for position,sessionid in enumerate(sessionids)]
+    settings = (function_to_use,column_to_use,activities,conditions)
+    if processes == 1:
+        _init_analysis_worker(shared.folder,settings)
+        pool = None
+        results = (_analyze_session(task) for task in tasks)
+    else:
+        pool = Pool(processes,initializer=_init_analysis_worker,initargs=(shared.folder,settings))
+        #sessions are handed out one at a time as workers free up, long sessions don't hold up the others
+        results = pool.imap_unordered(_analyze_session,tasks)
+    intervals = [None]*len(tasks)
+    ideas = [None]*len(tasks)
+    workers = {}
+    try:
+        for done,(position,worker,rows,seconds,session_intervals,session_ideas) in enumerate(results):
+            intervals[position] = session_intervals
+            ideas[position] = session_ideas
+            stats = workers.setdefault(worker,[0,0,0.0])
+            stats[0] += 1
+            stats[1] += rows
+            stats[2] += seconds
+            if progress is not None:
+                progress(worker,stats[0],done+1,len(tasks))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    workers = pd.DataFrame([[worker]+stats for worker,stats in sorted(workers.items())],
+                           columns=['worker','sessions','rows','seconds'])
+    if not tasks:
+        return interval_table([],function_to_use,column_to_use),get_key_ideas_batch([]),workers
+    return pd.concat(intervals,ignore_index=True),pd.concat(ideas,ignore_index=True),workers
@@ -0,0 +1,496 @@
+from collections import namedtuple
+import re
+import numpy as np
+import pandas as pd
+from utils import STRING_TYPES, DETECTOR_DEPENDENCIES, detector_patterns, session_patterns, case_patterns, find_cases, case_side, action_usage
+
+class PatternMatcher(object):
+    '''Looks for all the detector patterns of a session in one go.
+    The patterns are registered up front and every column is scanned once for all of them,
+    giving a boolean hit matrix (rows x patterns) that the detectors read from instead of
+    running str.contains over the session again for every pattern.
+
+    Since methods repeat a lot within a session, each distinct value of a column is only matched once
+    and the result is spread back to all the rows holding that value.
+
+    A PatternMatcher can be given to any detector in place of the prepared dataframe:
+    action_usage reads from the hit matrix and session_frame gives back the dataframe.
+    The helpers of utils (all_cases, case_sides, case_window, subtraction_usage and detector_result) call the
+    method of the same name on anything that isn't a dataframe. Here they do what they do on a dataframe,
+    SessionContext overrides them to reuse their results.
+
+    Args:
+        df (Pandas dataframe): The prepared dataframe of the session.
+        patterns (list): (column, pattern) pairs to register. Defaults to all the detector patterns of the session.
+    '''
+    def __init__(self, df, patterns=None):
+        self.df = df
+        self.pending = {}
+        self.hits = {}
+        self.scans = 0
+        self.times = None
+        if patterns is None:
+            patterns = detector_patterns(df)
+        self.register(patterns)
+
+    def register(self, patterns):
+        '''Adds (column, pattern) pairs to look for on the next scan.'''
+        for column,pattern in patterns:
+            if pattern in self.hits.get(column,{}):
+                continue
+            pending = self.pending.setdefault(column,[])
+            if pattern not in pending:
+                pending.append(pattern)
+
+    def scan(self):
+        '''Matches every pending pattern, going over each column once.'''
+        for column,patterns in self.pending.items():
+            codes,uniques = pd.factorize(self.df[column])
+            compiled = [re.compile(pattern) for pattern in patterns]
+            #hits for each distinct value of the column (same as str.contains(pattern,na=False))
+            matrix = np.zeros((len(uniques)+1,len(patterns)),dtype=bool)
+            for i,value in enumerate(uniques):
+                if isinstance(value,STRING_TYPES):
+                    matrix[i] = [regex.search(value) is not None for regex in compiled]
+            #missing values have code -1 which picks the last row of the matrix, always False
+            rows = matrix[codes]
+            column_hits = self.hits.setdefault(column,{})
+            for j,pattern in enumerate(patterns):
+                column_hits[pattern] = rows[:,j]
+            self.scans += 1
+        self.pending = {}
+
+    def hit(self, column, pattern):
+        '''Gives a boolean array telling which rows of the session match the pattern in that column.'''
+        if pattern not in self.hits.get(column,{}):
+            self.register([(column,pattern)])
+            self.scan()
+        return self.hits[column][pattern]
+
+    def hit_matrix(self, column):
+        '''Gives the hits of all patterns registered for a column as a dataframe of rows x patterns.'''
+        if column in self.pending:
+            self.scan()
+        hits = self.hits.get(column,{})
+        return pd.DataFrame(hits, index=self.df.index, columns=list(hits.keys()))
+
+    def usage(self, column, pattern):
+        '''Same as action_usage: the (start_time, duration) coordinates of the rows matching the pattern.'''
+        return self.coords(self.hit(column,pattern))
+
+    def coords(self, rows):
+        '''The (start_time, duration) coordinates of the rows picked by a boolean array.'''
+        if self.times is None:
+            self.times = (self.df['Time_seconds'].values,self.df['Duration'].values)
+        starts,durations = self.times
+        return list(zip(starts[rows].tolist(),durations[rows].tolist()))
+
+    def all_cases(self):
+        '''Same as utils.find_cases.'''
+        return find_cases(self)
+
+    def case_sides(self, case):
+        '''The left and right CaseSide of a case, see utils.case_sides.'''
+        return case_side(case[0]),case_side(case[1])
+
+    def case_window(self, case):
+        '''What the per-case detectors search in for a case: the whole session here (see utils.case_window).'''
+        return self
+
+    def subtraction_usage(self, column, v1, v2):
+        '''Gives None, so utils.subtraction_usage scans for the pattern.'''
+        return None
+
+    def result(self, detector):
+        '''Runs a detector on the session, see utils.detector_result.'''
+        return detector(self)
+
+# A subtraction between two numbers in a method. The lookahead lets us find overlapping ones (ex: '9 - 5 - 1')
+# and every suffix of the first number, since regex_distance patterns aren't anchored (ex: '1 \- 2' matches in '11 - 23').
+REGEX_SUBTRACTION = re.compile('(?=(\d+) - (\d+))')
+
+def subtraction_operands(method):
+    '''Lists all the (v1, v2) pairs of digit strings such that regex_distance(v1,v2) matches the method.
+
+    For example:
+        subtraction_operands('st1 11 - 23') -> set([('11','2'),('11','23'),('1','2'),('1','23')])
+    '''
+    operands = set()
+    for first,second in REGEX_SUBTRACTION.findall(method):
+        for end in range(1,len(second)+1):
+            operands.add((first,second[:end]))
+    return operands
+
+# The tokens methods are built from, ex: 'st1 Count choose... 2 3 x Sum all st2 Step1 / X'
+METHOD_TOKENS = [('step', re.compile('^st(\d+)$')),
+                 ('function', re.compile('^(Average|Sum|Count|Median)$')),
+                 ('selection', re.compile('^(all|none|choose\.\.\.)$')),
+                 ('value', re.compile('^\[?(\d+)\]?$')),
+                 ('reference', re.compile('^Step(\d+)$')),
+                 ('operator', re.compile('^([\-\+x/])$')),
+                 ('empty', re.compile('^(X|\[\])$'))]
+
+# One operand of a step: a function with its selection mode and selected values (ex: Count choose... 2 3),
+# a single value (ex: 5), a reference to the result of another step (ex: Step1) or an empty slot (X).
+MethodTerm = namedtuple('MethodTerm', ['function','selection','values','reference'])
+MethodStep = namedtuple('MethodStep', ['step','terms','operators'])
+
+def tokenize_method(method):
+    '''Splits a cleaned method into (kind, text) tokens, see METHOD_TOKENS. Unknown tokens have the kind 'other'.'''
+    tokens = []
+    for word in method.split():
+        for kind,regex in METHOD_TOKENS:
+            match = regex.match(word)
+            if match:
+                tokens.append((kind,match.group(1)))
+                break
+        else:
+            tokens.append(('other',word))
+    return tokens
+
+def parse_method(method):
+    '''Parses a cleaned method into its steps. Each step is a list of terms joined by operators:
+
+        method := step*
+        step := 'st'N term? (operator term?)*
+        term := function selection? value* | value | 'Step'N | 'X'
+
+    Args:
+        method (str): A cleaned method, ex: 'st1 Count choose... 2 3 x Sum all'.
+
+    Returns:
+        A tuple of MethodStep, ex:
+        (MethodStep(step=1, terms=(MethodTerm('Count','choose...',(2,3),None), MethodTerm('Sum','all',(),None)), operators=('x',)),)
+    '''
+    steps = []
+    step,terms,operators,term = 0,[],[],None
+    def close(term):
+        if term is not None:
+            terms.append(MethodTerm(term[0],term[1],tuple(term[2]),term[3]))
+    for kind,text in tokenize_method(method):
+        if kind == 'step':
+            close(term)
+            if terms or operators or steps or step:
+                steps.append(MethodStep(step,tuple(terms),tuple(operators)))
+            step,terms,operators,term = int(text),[],[],None
+        elif kind == 'function':
+            close(term)
+            term = [text,None,[],None]
+        elif kind == 'selection' and term is not None and term[0] is not None and term[1] is None:
+            term[1] = text
+        elif kind == 'selection':
+            close(term)
+            term = [None,text,[],None]
+        elif kind == 'value' and term is not None and term[0] is not None and term[1] != 'all':
+            term[2].append(int(text))
+        elif kind == 'value':
+            close(term)
+            term = [None,None,[int(text)],None]
+        elif kind == 'reference':
+            close(term)
+            term = [None,None,[],int(text)]
+        elif kind == 'operator':
+            close(term)
+            term = None
+            operators.append(text)
+        elif kind == 'empty' and not (term is not None and term[1] == 'choose...'):
+            #an X after choose... is a value that wasn't picked yet, otherwise it is an empty operand
+            close(term)
+            term = [None,None,[],None]
+    close(term)
+    if terms or operators or steps or step:
+        steps.append(MethodStep(step,tuple(terms),tuple(operators)))
+    return tuple(steps)
+
+def method_columns(steps):
+    #the flat, typed form of a parsed method used for the columns of parse_methods
+    terms = [term for step in steps for term in step.terms]
+    functions = tuple(term.function for term in terms if term.function is not None)
+    selections = tuple(term.selection for term in terms if term.selection is not None)
+    return {'steps': len(steps),
+            'terms': len(terms),
+            'function': functions[0] if functions else None,
+            'functions': functions,
+            'selection': selections[0] if selections else None,
+            'values': tuple(value for term in terms for value in term.values),
+            'single_values': tuple(term.values[0] for term in terms if term.function is None and len(term.values) == 1),
+            'operators': tuple(operator for step in steps for operator in step.operators),
+            'references': tuple(term.reference for term in terms if term.reference is not None),
+            'parsed': steps}
+
+METHOD_COLUMNS = ['steps','terms','function','functions','selection','values','single_values','operators','references','parsed']
+
+def parse_methods(methods):
+    '''Parses a whole column of cleaned methods into typed columns, parsing each distinct method only once.
+    Detectors can then be written as predicates over these columns instead of regexes over the strings,
+    ex: parsed['functions'].map(lambda f: 'Average' in f), or parsed['single_values'].map(len) > 0.
+
+    Args:
+        methods (Pandas series): A cleaned method column, ex: 'Cleaned method 1'.
+
+    Returns:
+        A dataframe with the same index as methods and the columns:
+            steps (int): number of steps
+            terms (int): number of operands over all steps
+            function (str): first function used, None if there is none
+            functions (tuple): all functions used, in order
+            selection (str): first selection mode used (all, none or choose...), None if there is none
+            values (tuple): all the numbers selected or typed, in order
+            single_values (tuple): the numbers used as operands on their own, like in 'Average all + 5'
+            operators (tuple): all the operators used, in order
+            references (tuple): the steps whose result is used by another step
+            parsed (tuple): the full MethodStep structure given by parse_method
+    '''
+    codes,uniques = pd.factorize(methods)
+    rows = [method_columns(parse_method(method) if isinstance(method,STRING_TYPES) else ()) for method in uniques]
+    rows.append(method_columns(())) #for missing methods, code -1
+    table = pd.DataFrame(rows, columns=METHOD_COLUMNS)
+    parsed = table.iloc[codes]
+    parsed.index = methods.index
+    return parsed
+
+class SessionContext(PatternMatcher):
+    '''Everything the detectors need to know about one session, computed once and reused.
+    On top of the pattern hits of the PatternMatcher, it keeps the case windows found by all_cases
+    and the parsed values of each case (see utils.case_side).
+
+    The per-case detectors search each case in a CaseWindow holding only the rows of that case (see case_window),
+    so by default only the patterns that don't depend on a case are scanned for over the whole session.
+
+    Give it to the detectors in place of the prepared dataframe, ex: central_tendency_usage(SessionContext(df)).
+
+    Args:
+        df (Pandas dataframe): The prepared dataframe of the session.
+        patterns (list): (column, pattern) pairs to register. Defaults to utils.session_patterns.
+    '''
+    def __init__(self, df, patterns=None):
+        if patterns is None:
+            patterns = session_patterns(df)
+        self.cases = None
+        self.windows = {}
+        self.sides = {}
+        self.results = {}
+        self.recomputed = []
+        self.reused = {}
+        self.subtractions = {}
+        self.methods = {}
+        PatternMatcher.__init__(self, df, patterns)
+
+    def all_cases(self):
+        '''Same as utils.all_cases, but the case windows are only searched for the first time.'''
+        if self.cases is None:
+            self.cases = find_cases(self)
+        return dict(self.cases)
+
+    def case_sides(self, case):
+        '''Same as utils.case_sides, but each case is only parsed once.'''
+        if case not in self.sides:
+            self.sides[case] = (case_side(case[0]),case_side(case[1]))
+        return self.sides[case]
+
+    def case_window(self, case):
+        '''Gives (once) a CaseWindow with the rows of the session logged during a case, see utils.case_window.'''
+        if case not in self.windows:
+            self.windows[case] = CaseWindow(self, case)
+        return self.windows[case]
+
+    def subtraction_index(self, column):
+        '''Builds (once) an index of all the subtractions found in a method column.
+
+        Returns:
+            A dictionary where the keys are (v1, v2) pairs of digit strings (see subtraction_operands)
+            and the values are boolean arrays of the rows where that subtraction is used.
+        '''
+        if column not in self.subtractions:
+            codes,uniques = pd.factorize(self.df[column])
+            values = {}
+            for i,method in enumerate(uniques):
+                if isinstance(method,STRING_TYPES):
+                    for operands in subtraction_operands(method):
+                        values.setdefault(operands,[]).append(i)
+            index = {}
+            for operands,value_codes in values.items():
+                #missing values have code -1 which picks the last, always False, entry
+                hits = np.zeros(len(uniques)+1,dtype=bool)
+                hits[value_codes] = True
+                index[operands] = hits[codes]
+            self.subtractions[column] = index
+        return self.subtractions[column]
+
+    def subtraction_usage(self, column, v1, v2):
+        '''Same as utils.subtraction_usage, answered from the subtraction index.
+        Gives None when the values aren't plain numbers, in which case the pattern has to be scanned for.'''
+        v1,v2 = str(v1),str(v2)
+        if not (v1.isdigit() and v2.isdigit()):
+            return None
+        rows = self.subtraction_index(column).get((v1,v2))
+        if rows is None:
+            return []
+        return self.coords(rows)
+
+    def parsed(self, column):
+        '''Gives (once) the typed columns of a cleaned method column, see parse_methods.'''
+        if column not in self.methods:
+            self.methods[column] = parse_methods(self.df[column])
+        return self.methods[column]
+
+    def result(self, detector):
+        '''Runs a detector on the session the first time it is asked for, and gives back the same result afterwards.
+        The names of the detectors that were actually run are kept in recomputed,
+        and the number of times each result was reused in reused.'''
+        if detector in self.results:
+            self.reused[detector.__name__] = self.reused.get(detector.__name__,0) + 1
+        else:
+            self.results[detector] = detector(self)
+            self.recomputed.append(detector.__name__)
+        #a copy, so callers extending or sorting it don't change what we keep
+        return list(self.results[detector])
+
+def window_rows(starts, durations, coords):
+    '''Finds the rows whose time coordinates intersect_usage(rows, [coords]) can keep, ie. the rows logged during a case.
+    Rows that only touch the case where it starts or ends are left out, since they can't overlap it.
+
+    Args:
+        starts (numpy array): Time_seconds of each row.
+        durations (numpy array): Duration of each row.
+        coords (tuple): The (start_time, duration) of the case.
+
+    Returns:
+        A boolean array of the rows to keep.
+    '''
+    start,end = coords[0],coords[0]+coords[1]
+    if len(starts) and np.all(starts[1:] >= starts[:-1]):
+        #times only go up, so the rows starting during the case are a slice we can find by binary search
+        rows = np.zeros(len(starts),dtype=bool)
+        rows[np.searchsorted(starts,start,'left'):np.searchsorted(starts,end,'left')] = True
+    else:
+        rows = (starts >= start) & (starts < end)
+    #same rules as intersect_usage: a row starting with the case is kept, and one starting before it if it overlaps
+    return rows | (starts == start) | ((starts < start) & (starts+durations > start))
+
+# The columns the per-case detectors search in, the only ones copied into a CaseWindow.
+WINDOW_COLUMNS = ['Cleaned method 1','Cleaned method 2','cases','Time_seconds','Duration']
+
+class CaseWindow(SessionContext):
+    '''The rows of a session logged during one of its cases, to search for the patterns of that case.
+    It acts like a SessionContext of its own, with that single case, and shares the parsed cases of the whole session.
+    Detectors still intersect what they find with the case (intersect_usage), so the results don't change.
+
+    Args:
+        session (SessionContext): The whole session.
+        case (tuple): The case, ex: ('1 3 5 7 9','3 4 5 6 7').
+    '''
+    def __init__(self, session, case):
+        self.session = session
+        self.case = case
+        coords = session.all_cases()[case]
+        df = session.df
+        rows = window_rows(df['Time_seconds'].values,df['Duration'].values,coords)
+        columns = [column for column in WINDOW_COLUMNS if column in df.columns]
+        SessionContext.__init__(self, df.loc[rows,columns], case_patterns(session,','.join(case)))
+        self.cases = {case: coords}
+
+    def case_sides(self, case):
+        return self.session.case_sides(case)
+
+    def case_window(self, case):
+        if case == self.case:
+            return self
+        return self.session.case_window(case)
+
+def schedule_detectors(detectors, dependencies=DETECTOR_DEPENDENCIES):
+    '''Orders detectors so that each one comes after the detectors it depends on.
+
+    Args:
+        detectors (list): The detectors we want to run.
+        dependencies (dict): The detectors each detector depends on, see utils.DETECTOR_DEPENDENCIES.
+
+    Returns:
+        A list with the detectors and all their dependencies, each once, dependencies first.
+    '''
+    ordered = []
+    visiting = set()
+    def visit(detector):
+        if detector in ordered:
+            return
+        if detector in visiting:
+            raise ValueError('Detectors depend on each other in a loop: '+detector.__name__)
+        visiting.add(detector)
+        for dependency in dependencies.get(detector,[]):
+            visit(dependency)
+        visiting.discard(detector)
+        ordered.append(detector)
+    for detector in detectors:
+        visit(detector)
+    return ordered
+
+def run_detectors(session, function_to_use, dependencies=DETECTOR_DEPENDENCIES):
+    '''Runs every detector of function_to_use on a session, each detector at most once.
+    Detectors that others depend on run first, and their results are passed on through the session.
+
+    Args:
+        session (SessionContext or Pandas dataframe): The session to run the detectors on.
+        function_to_use (dict): The detector of each timeline row, ex: viz_utils.function_to_use.
+        dependencies (dict): The detectors each detector depends on, see utils.DETECTOR_DEPENDENCIES.
+
+    Returns:
+        A dictionary with the time coordinates found for each row of function_to_use.
+        session.recomputed then lists which detectors were run.
+    '''
+    if not isinstance(session, SessionContext):
+        session = SessionContext(session)
+    for detector in schedule_detectors(list(function_to_use.values()), dependencies):
+        session.result(detector)
+    return dict((action, session.result(detector)) for action,detector in function_to_use.items())
+
+INTERVAL_COLUMNS = ['session','activity','condition','detector','start','duration']
+
+def _first_value(df, column):
+    #the value a column has for the whole session, or None when the session doesn't have that column
+    if column is None or column not in df.columns:
+        return None
+    values = df[column].dropna()
+    return values.iloc[0] if len(values) else None
+
+def interval_table(sessions, function_to_use, column_to_use=None, activities=None, conditions=None,
+                   activity_column='Problem Name', condition_column='condition1'):
+    '''Runs the detectors on many sessions and gathers all their intervals in one long table,
+    with one row per interval instead of one list of coordinates per session and timeline row.
+    See interval_utils.usage_summary to aggregate it.
+
+    Args:
+        sessions (dict or list): Prepared sessions, session id -> dataframe (ex: prepare_all_sessions(df_all)) or a list of (session id, dataframe).
+        function_to_use (dict): The detector of each timeline row, ex: viz_utils.function_to_use.
+        column_to_use (dict): The actions found by name in a column, ex: viz_utils.column_to_use.
+        activities (dict): The activity of each session id (ex: 'Trampoline'). Defaults to the activity_column of the session.
+        conditions (dict): The condition of each session id. Defaults to the condition_column of the session.
+        activity_column (str): Column holding the activity, used when activities isn't given.
+        condition_column (str): Column holding the condition, used when conditions isn't given.
+
+    Returns:
+        A dataframe with the columns session, activity, condition, detector (the timeline row), start and duration.
+    '''
+    if isinstance(sessions, dict):
+        sessions = list(sessions.items())
+    if column_to_use is None:
+        column_to_use = {}
+    columns = dict((column,[]) for column in INTERVAL_COLUMNS)
+    for sessionid,df in sessions:
+        session = df if isinstance(df, SessionContext) else SessionContext(df)
+        usage = run_detectors(session, function_to_use)
+        for action,column in column_to_use.items():
+            usage[action] = action_usage(session,column,action)
+        activity = activities[sessionid] if activities is not None else _first_value(session.df,activity_column)
+        condition = conditions[sessionid] if conditions is not None else _first_value(session.df,condition_column)
+        for action,coords in usage.items():
+            for start,duration in coords:
+                columns['session'].append(sessionid)
+                columns['activity'].append(activity)
+                columns['condition'].append(condition)
+                columns['detector'].append(action)
+                columns['start'].append(start)
+                columns['duration'].append(duration)
+    table = pd.DataFrame(columns, columns=INTERVAL_COLUMNS)
+    table['start'] = table['start'].astype(float)
+    table['duration'] = table['duration'].astype(float)
+    return table
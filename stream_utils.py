@@ -0,0 +1,161 @@
+import numpy as np
+import pandas as pd
+from utils import STRING_TYPES, METHOD_NORMALIZER, ONE_HOUR, action_usage, times_to_timedelta, timedelta_to_seconds
+from session_utils import SessionContext, run_detectors
+from viz_utils import function_to_use, column_to_use
+
+class StreamingSession(object):
+    '''Keeps one session prepared while its log rows arrive, one at a time or in small batches,
+    instead of running prepare_session over the whole session again.
+
+    Each new row only updates itself and the row before it: Time_seconds is computed from the first time of
+    the session, and the Duration of the previous row (which depends on the time of the next row) is fixed.
+    Case windows are extended as rows of the same case arrive.
+
+    Detector intervals are kept per case: once the student moved on to a new case, the detectors are run one
+    last time on the rows of the case they left and the result is kept. Refreshing the timeline then only runs
+    the detectors over the rows of the current case, however long the session already is, and only once
+    between two new rows. Rows outside of any case count as one case until a case starts.
+    Intervals of neighbouring cases that touch are therefore given as two pieces instead of being merged.
+
+    Args:
+        sessionid (str): The id of the session.
+        function_to_use (dict): The detector of each timeline row, defaults to viz_utils.function_to_use.
+        column_to_use (dict): The column of each action found by name, defaults to viz_utils.column_to_use.
+    '''
+    def __init__(self, sessionid=None, function_to_use=function_to_use, column_to_use=column_to_use):
+        self.sessionid = sessionid
+        self.function_to_use = function_to_use
+        self.column_to_use = column_to_use
+        self.rows = []
+        self.times = [] #time of day of each row, as timedelta64
+        self.time_start = None
+        self.case_windows = {} #raw case -> [first row, last row]
+        self.case_start = 0 #first row of the current case
+        self.closed = [] #detector intervals of each case the student moved on from
+        self.current = None #detector intervals of the current case, until the next row arrives
+
+    def append(self, row):
+        '''Adds one log row, in the same schema as the export (see df_gaps.txt).
+
+        Args:
+            row (dict or Pandas series): The logged row.
+
+        Returns:
+            True if the row was kept, False if it was dropped for not being a CORRECT action.
+        '''
+        row = dict(row)
+        if row.get('Outcome') != 'CORRECT':
+            return False
+        row['Cleaned method 1'] = METHOD_NORMALIZER.clean(row['Method_Recognized_1_Copied'])
+        row['Cleaned method 2'] = METHOD_NORMALIZER.clean(row['Method_Recognized_2_Copied'])
+        if isinstance(row['CF(new1)'],STRING_TYPES) and isinstance(row['CF(new2)'],STRING_TYPES):
+            row['cases'] = row['CF(new1)'].replace('"','') +','+ row['CF(new2)'].replace('"','')
+        else:
+            row['cases'] = np.nan
+
+        current = times_to_timedelta([row['Time']])[0]
+        if self.time_start is None:
+            self.time_start = current
+        row['Time_seconds'] = float(timedelta_to_seconds(_wrap(current-self.time_start)))
+        row['Timeshifted'] = None
+        row['Duration'] = 10 #last action lasts zero seconds but we need to put a dummy variable here.
+        if self.rows:
+            previous = self.rows[-1]
+            previous['Timeshifted'] = row['Time']
+            previous['Duration'] = float(timedelta_to_seconds(_wrap(current-self.times[-1])))
+
+        position = len(self.rows)
+        self.current = None
+        if self.rows and not _same_case(row['cases'],self.rows[-1]['cases']):
+            #the previous case is over and its last duration is now known
+            self.closed.append(self._detect(self.case_start,position))
+            self.case_start = position
+        self.rows.append(row)
+        self.times.append(current)
+        self.case_windows.setdefault(row['cases'],[position,position])[1] = position
+        return True
+
+    def extend(self, rows):
+        '''Adds a batch of log rows, given as a dataframe or a list of dictionaries.
+
+        Returns:
+            The number of rows kept.
+        '''
+        if isinstance(rows, pd.DataFrame):
+            rows = (row for index,row in rows.iterrows())
+        return sum(self.append(row) for row in rows)
+
+    def frame(self, start=0, stop=None):
+        '''Gives the prepared rows (from start to stop) as a dataframe, like prepare_session would.'''
+        return pd.DataFrame(self.rows[start:stop])
+
+    def all_cases(self):
+        '''Same as utils.all_cases, kept up to date as rows arrive.'''
+        coordinates = {}
+        for raw_case,(first,last) in self.case_windows.items():
+            if not isinstance(raw_case,STRING_TYPES):
+                continue
+            start = self.rows[first]['Time_seconds']
+            end = self.rows[last]['Time_seconds']+self.rows[last]['Duration']
+            coordinates[tuple(raw_case.split(','))] = (start,end-start)
+        return coordinates
+
+    def _detect(self, start, stop):
+        session = SessionContext(self.frame(start,stop))
+        intervals = run_detectors(session,self.function_to_use)
+        for action,column in self.column_to_use.items():
+            intervals[action] = action_usage(session,column,action)
+        return intervals
+
+    def intervals(self):
+        '''The intervals of every timeline row so far.
+
+        Returns:
+            A dictionary with the time coordinates of each row of function_to_use and column_to_use.
+        '''
+        parts = list(self.closed)
+        if self.case_start < len(self.rows):
+            if self.current is None:
+                self.current = self._detect(self.case_start,len(self.rows))
+            parts.append(self.current)
+        actions = list(self.function_to_use.keys())+list(self.column_to_use.keys())
+        return dict((action,sorted(coords for part in parts for coords in part[action])) for action in actions)
+
+def _same_case(case, other):
+    #rows outside of any case have NaN cases, which are never equal to each other
+    return case == other or (pd.isnull(case) and pd.isnull(other))
+
+def _wrap(delta):
+    #same as fix_time: when the clock went past the hour, we add an hour to find the duration in between
+    if delta < np.timedelta64(0,'us'):
+        return delta+ONE_HOUR
+    return delta
+
+class StreamingLog(object):
+    '''Dispatches live log rows of many sessions to a StreamingSession for each session.
+
+    Args:
+        function_to_use (dict): The detector of each timeline row, defaults to viz_utils.function_to_use.
+        column_to_use (dict): The column of each action found by name, defaults to viz_utils.column_to_use.
+    '''
+    def __init__(self, function_to_use=function_to_use, column_to_use=column_to_use):
+        self.function_to_use = function_to_use
+        self.column_to_use = column_to_use
+        self.sessions = {}
+
+    def session(self, sessionid):
+        '''Gives the StreamingSession of a session id, starting it if needed.'''
+        if sessionid not in self.sessions:
+            self.sessions[sessionid] = StreamingSession(sessionid,self.function_to_use,self.column_to_use)
+        return self.sessions[sessionid]
+
+    def append(self, row):
+        '''Adds one log row to its session. Returns True if the row was kept.'''
+        return self.session(row['Session Id']).append(row)
+
+    def extend(self, rows):
+        '''Adds a batch of log rows (a dataframe or a list of dictionaries) to their sessions. Returns the number of rows kept.'''
+        if isinstance(rows, pd.DataFrame):
+            rows = (row for index,row in rows.iterrows())
+        return sum(self.append(row) for row in rows)
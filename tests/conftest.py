@@ -0,0 +1,36 @@
+import os
+import sys
+import matplotlib
+matplotlib.use('Agg')
+import pandas as pd
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The only session logged in df_gaps.txt.
+SESSION_ID = 'L-10f11766:120ecd4f63a:-8000'
+
+@pytest.fixture(scope='session')
+def raw_export():
+    '''The sample export shipped with the repo, read like the notebooks read it.'''
+    return pd.read_csv(os.path.join(ROOT,'df_gaps.txt'), index_col=0)
+
+@pytest.fixture
+def raw(raw_export):
+    return raw_export.copy()
+
+@pytest.fixture(scope='session')
+def prepared_export(raw_export):
+    from utils import prepare_session
+    return prepare_session(raw_export.copy(), SESSION_ID)
+
+@pytest.fixture
+def prepared(prepared_export):
+    return prepared_export.copy()
+
+@pytest.fixture(scope='session')
+def generated_log():
+    '''A small made up export with a few sessions, see bench_utils.generate_log.'''
+    from bench_utils import generate_log
+    return generate_log(sessions=4, rows=150, cases=3, seed=1)
@@ -0,0 +1,59 @@
+import utils
+from utils import prepare_session, DETECTOR_DEPENDENCIES
+from session_utils import SessionContext, run_detectors
+from bench_utils import generate_log, run_benchmarks, summarize_benchmarks, Profiler, profile_sessions
+from viz_utils import function_to_use
+
+def test_generated_sessions_stay_under_an_hour():
+    log = generate_log(sessions=2,rows=2000,cases=4,seed=3)
+    for sessionid in log['Session Id'].unique():
+        df = prepare_session(log,sessionid)
+        assert df['Time_seconds'].is_monotonic_increasing
+        assert df['Time_seconds'].max() < 3600
+
+def test_detectors_on_plain_frames_match_the_session_path(generated_log):
+    for sessionid in generated_log['Session Id'].unique():
+        df = prepare_session(generated_log,sessionid)
+        expected = run_detectors(SessionContext(df),function_to_use)
+        for action,function in function_to_use.items():
+            assert function(df.copy()) == expected[action], action
+
+def test_run_benchmarks_times_every_step():
+    results = run_benchmarks(sizes=((2,120,2),),seed=0,draw=True)
+    steps = set(results['step'])
+    assert steps == set(function_to_use)|set(['prepare_session','get_key_ideas','plot'])
+    assert (results['seconds'] >= 0).all()
+    assert len(results) == 2*len(steps)
+    summary = summarize_benchmarks(results)
+    assert list(summary.columns) == [(2,120,2)]
+
+def test_profiler_records_detectors_and_helpers(prepared):
+    profiler = profile_sessions({'sample': prepared})
+    calls = profiler.calls()
+    assert set(function_to_use[action].__name__ for action in function_to_use) <= set(calls['function'])
+    assert (calls['session'] == 'sample').all()
+    table = profiler.table()
+    assert list(table.columns) == ['session','kind','function','calls','seconds','slowest','rows']
+    assert list(profiler.table(per_session=False).columns) == ['kind','function','calls','seconds','slowest','rows']
+    patterns = profiler.slowest_patterns(n=3)
+    assert list(patterns.columns) == ['column','pattern','calls','seconds','rows']
+    assert len(patterns) == 3
+    assert patterns['column'].isin(prepared.columns).all()
+
+def test_profiler_restores_the_functions_it_timed(prepared):
+    detectors = dict(function_to_use)
+    merge = utils.merge_usage
+    with Profiler():
+        assert utils.merge_usage is not merge
+        assert function_to_use['Other'] is not detectors['Other']
+    assert utils.merge_usage is merge
+    assert function_to_use == detectors
+
+def test_profiler_times_calls_given_iterators():
+    profiler = Profiler()
+    with profiler:
+        intersect = utils.intersect_usage(iter([(0,5)]),[(1,2)])
+    assert intersect == [(1,2)]
+    calls = profiler.calls()
+    assert list(calls['function']) == ['intersect_usage']
+    assert list(calls['rows']) == [1]
@@ -0,0 +1,61 @@
+import json
+import os
+from conftest import SESSION_ID
+from utils import prepare_all_sessions
+from viz_utils import timeline_data
+from dashboard_utils import export_dashboard, timeline_payload
+
+def read_payload(path):
+    with open(path) as f:
+        script = f.read()
+    assert script.startswith('loadSession(') and script.endswith(');\n')
+    return json.loads(script[len('loadSession('):-len(');\n')])
+
+def test_timeline_payload_flattens_the_coordinates(prepared):
+    data = timeline_data(prepared)
+    payload = timeline_payload(data)
+    assert json.loads(json.dumps(payload)) == payload
+    assert set(payload) == set(data)
+    for (action,pos,coords),(flat_action,flat_pos,flat) in zip(data['rows'],payload['rows']):
+        assert (flat_action,flat_pos) == (action,pos)
+        assert flat == [round(float(v),1) for pair in coords for v in pair]
+    assert len(payload['new_cases']) == 2*len(data['new_cases'])
+    assert payload['max_time'] == round(float(data['max_time']),1)
+
+def test_export_dashboard_writes_a_script_per_session(generated_log, prepared, tmpdir):
+    sessions = prepare_all_sessions(generated_log)
+    sessions[SESSION_ID] = prepared
+    path = str(tmpdir.join('dashboard.html'))
+    titles = dict((sessionid,'Session '+sessionid) for sessionid in sessions)
+    written = export_dashboard(sessions,path,titles=titles)
+    assert written[0] == path
+    assert len(written) == len(sessions)+1
+    with open(path) as f:
+        page = f.read()
+    assert '__INDEX__' not in page and '__DATA_DIR__' not in page
+    assert 'dashboard_data' in page
+    for (sessionid,df),script in zip(sessions.items(),written[1:]):
+        assert os.path.dirname(script) == str(tmpdir.join('dashboard_data'))
+        assert 'Session '+sessionid in page
+        payload = read_payload(script)
+        assert payload['session'] == sessionid
+        assert payload['file'] == os.path.basename(script)
+        assert payload['rows'] == timeline_payload(timeline_data(df))['rows']
+
+def test_export_dashboard_without_sessions(tmpdir):
+    path = str(tmpdir.join('empty.html'))
+    assert export_dashboard({},path) == [path]
+    assert os.path.isdir(str(tmpdir.join('empty_data')))
+
+def test_export_dashboard_escapes_titles(prepared, tmpdir):
+    path = str(tmpdir.join('a&b<i>.html'))
+    title = '</script><script>alert(1)</script> __INDEX__ __TITLE__'
+    export_dashboard({SESSION_ID: prepared},path,titles={SESSION_ID: title})
+    with open(path) as f:
+        page = f.read()
+    assert '<title>a&amp;b&lt;i&gt;</title>' in page
+    assert 'alert(1)</script>' not in page
+    index = [line for line in page.splitlines() if line.startswith('var INDEX = ')]
+    assert len(index) == 1
+    assert json.loads(index[0][len('var INDEX = '):-1]) == [{'file': 'session-00000.js', 'title': title}]
+    assert 'var DATA_DIR = "a&b<i>_data";' in page
@@ -0,0 +1,152 @@
+import os
+import subprocess
+import sys
+import pandas as pd
+import pytest
+from pandas.testing import assert_frame_equal
+import utils
+import session_utils
+from conftest import ROOT
+from utils import PIPELINE_COLUMNS, single_value_usage, other_usage, range_usage, prepare_all_sessions, get_key_ideas_batch
+from session_utils import SessionContext, run_detectors, interval_table
+from interval_utils import usage_summary
+from data_utils import ResultCache, detector_fingerprint, session_digest, partition_export, iter_partition_sessions, process_partitions,\
+    table_writer, export_key_ideas, load_export, cache_is_fresh
+from bench_utils import write_log
+from viz_utils import function_to_use, column_to_use
+
+def test_result_cache_matches_run_detectors(prepared, tmpdir):
+    cache = ResultCache(str(tmpdir))
+    expected = run_detectors(SessionContext(prepared),function_to_use)
+    assert cache.run(prepared,function_to_use) == expected
+    assert cache.hits == 0
+    assert cache.run(prepared,function_to_use) == expected
+    assert cache.hits == cache.misses
+
+def test_result_cache_sees_edited_constants(prepared, tmpdir, monkeypatch):
+    cache = ResultCache(str(tmpdir))
+    cache.run(prepared,function_to_use)
+    monkeypatch.setattr(utils,'REGEX_SINGLE_VALUE_FIRST',utils.REGEX_SINGLE_VALUE_FIRST+'|(?:nothing)')
+    misses = cache.misses
+    cache.run(prepared,function_to_use)
+    #only the detectors reading the regex, and the ones depending on them, run again
+    assert cache.misses-misses == 2
+    assert not cache.get(session_digest(prepared),range_usage) is None
+
+def test_fingerprint_follows_other_modules(monkeypatch):
+    before = detector_fingerprint(single_value_usage)
+    monkeypatch.setattr(session_utils,'WINDOW_COLUMNS',session_utils.WINDOW_COLUMNS+['Selection'])
+    assert detector_fingerprint(single_value_usage) != before
+    monkeypatch.undo()
+    assert detector_fingerprint(single_value_usage) == before
+    def usage(self, column, pattern):
+        return []
+    monkeypatch.setattr(session_utils.PatternMatcher,'usage',usage)
+    assert detector_fingerprint(single_value_usage) != before
+
+def test_fingerprint_is_the_same_in_every_process():
+    script = 'import utils, data_utils; print(data_utils.detector_fingerprint(utils.other_usage))'
+    output = subprocess.check_output([sys.executable,'-W','ignore','-c',script],cwd=ROOT)
+    assert output.decode('utf-8').strip() == detector_fingerprint(other_usage)
+
+def read_table(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.xlsx'):
+        return pd.read_excel(path)
+    return pd.read_csv(path)
+
+def sorted_table(table):
+    return table.sort_values(['session','detector','start'],kind='mergesort').reset_index(drop=True)
+
+@pytest.fixture
+def log_with_conditions(generated_log):
+    log = generated_log.copy()
+    log['condition1'] = log['Session Id'].map(lambda s: 'A' if s.endswith(('0','2')) else 'B')
+    return log
+
+def test_partitions_give_the_in_memory_interval_table(log_with_conditions, tmpdir):
+    path = str(tmpdir.join('export.csv'))
+    write_log(log_with_conditions,path)
+    spill_dir = str(tmpdir.join('spill'))
+    paths = partition_export(path,spill_dir,partitions=3,chunksize=100)
+    assert 1 <= len(paths) <= 3
+    found = process_partitions(spill_dir,function_to_use,column_to_use)
+    sessions = prepare_all_sessions(log_with_conditions)
+    expected = interval_table(sessions,function_to_use,column_to_use)
+    assert_frame_equal(sorted_table(found),sorted_table(expected))
+    for by in [('activity','detector'),('condition','detector')]:
+        summary = usage_summary(found,by)
+        assert len(summary) > 0
+        assert_frame_equal(summary,usage_summary(expected,by))
+
+def test_partitions_from_chunks_keep_sessions_whole(log_with_conditions, tmpdir):
+    chunks = [log_with_conditions.iloc[i:i+70] for i in range(0,len(log_with_conditions),70)]
+    spill_dir = str(tmpdir.join('spill'))
+    partition_export(chunks,spill_dir,partitions=2)
+    sessions = dict(iter_partition_sessions(spill_dir))
+    assert sorted(sessions) == sorted(log_with_conditions['Session Id'].unique())
+    for sessionid,rows in sessions.items():
+        logged = log_with_conditions[log_with_conditions['Session Id'] == sessionid]
+        assert [str(t) for t in rows['Time']] == [str(t) for t in logged['Time']]
+        assert list(rows['Problem Name']) == list(logged['Problem Name'])
+
+@pytest.mark.parametrize('extension',['.csv','.parquet','.xlsx'])
+def test_export_key_ideas_reads_back(generated_log, tmpdir, extension):
+    sessions = prepare_all_sessions(generated_log)
+    order = sorted(sessions)
+    path = str(tmpdir.join('ideas'+extension))
+    rows = export_key_ideas([(s,sessions[s]) for s in order],path)
+    expected = get_key_ideas_batch([(s,sessions[s]) for s in order])
+    assert rows == len(expected)
+    found = read_table(path)
+    assert list(found.columns) == list(expected.columns)
+    assert [str(v) for v in found['tried methods']] == [str(v) for v in expected['tried methods']]
+    assert list(found['session']) == list(expected['session'])
+
+@pytest.mark.parametrize('extension',['.csv','.parquet','.xlsx'])
+def test_table_writers_skip_empty_batches(tmpdir, extension):
+    path = str(tmpdir.join('table'+extension))
+    first = pd.DataFrame({'session': ['a','b'], 'start': [1.5,2.0]})
+    with table_writer(path) as writer:
+        writer.write(first.iloc[:0])
+        writer.write(first)
+        writer.write(first.iloc[:0])
+        writer.write(first)
+    assert writer.rows == 4
+    found = read_table(path)
+    assert list(found.columns) == ['session','start']
+    assert list(found['session']) == ['a','b','a','b']
+    assert list(found['start']) == [1.5,2.0,1.5,2.0]
+
+@pytest.fixture
+def workbook(raw, tmpdir):
+    path = str(tmpdir.join('all data v3.xlsx'))
+    raw.iloc[:50].to_excel(path,sheet_name='iLab data.txt',index=False)
+    return path
+
+def test_load_export_parses_the_workbook_once(workbook, monkeypatch):
+    expected = pd.read_excel(workbook,'iLab data.txt',index_col=None,na_values=['NA'])
+    parsed = []
+    read_excel = pd.read_excel
+    def counting(*args, **kwargs):
+        parsed.append(args)
+        return read_excel(*args, **kwargs)
+    monkeypatch.setattr(pd,'read_excel',counting)
+    assert not cache_is_fresh(workbook)
+    first = load_export(workbook)
+    assert cache_is_fresh(workbook)
+    second = load_export(workbook,columns=['Session Id','Selection'])
+    everything = load_export(workbook,columns=None)
+    assert len(parsed) == 1
+    assert list(first.columns) == PIPELINE_COLUMNS
+    assert_frame_equal(first,expected[PIPELINE_COLUMNS])
+    assert_frame_equal(second,expected[['Session Id','Selection']])
+    assert list(everything.columns) == list(expected.columns)
+
+def test_load_export_sees_a_changed_workbook(workbook, raw, tmpdir):
+    load_export(workbook,cache_dir=str(tmpdir.join('cache')))
+    raw.iloc[:20].to_excel(workbook,sheet_name='iLab data.txt',index=False)
+    os.utime(workbook,(0,0))
+    assert not cache_is_fresh(workbook,cache_dir=str(tmpdir.join('cache')))
+    assert len(load_export(workbook,cache_dir=str(tmpdir.join('cache')))) == 20
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+import pytest
+from utils import prepare_session, merge_usage, intersect_usage, clean_coords
+from session_utils import interval_table
+from interval_utils import IntervalSet, IntervalIndex, merge_intervals, usage_summary
+from viz_utils import function_to_use, column_to_use
+
+def sessions_of(log):
+    return [(sessionid,prepare_session(log,sessionid)) for sessionid in log['Session Id'].unique()]
+
+@pytest.fixture(scope='module')
+def table(generated_log):
+    return interval_table(sessions_of(generated_log),function_to_use,column_to_use)
+
+def test_interval_table_has_every_detector_result(generated_log, table):
+    assert table['activity'].eq('trampoline').all()
+    sessionid,df = sessions_of(generated_log)[0]
+    rows = table[(table['session'] == sessionid) & (table['detector'] == 'Range')]
+    assert list(zip(rows['start'],rows['duration'])) == function_to_use['Range'](df)
+
+def test_merge_intervals_matches_interval_set(table):
+    merged = merge_intervals(table)
+    for (sessionid,detector),rows in table.groupby(['session','detector']):
+        expected = IntervalSet.from_coords(list(zip(rows['start'],rows['duration']))).to_coords()
+        found = merged[(merged['session'] == sessionid) & (merged['detector'] == detector)]
+        assert list(zip(found['start'],found['duration'])) == expected
+
+def test_usage_summary_counts_overlaps_once():
+    table = pd.DataFrame({'session': ['a','a','b'], 'activity': ['x','x','x'], 'condition': [1,1,2],
+                          'detector': ['Range']*3, 'start': [0.0,5.0,20.0], 'duration': [10.0,10.0,4.0]})
+    summary = usage_summary(table,('activity','detector'))
+    assert summary.loc[('x','Range'),'sessions'] == 2
+    assert summary.loc[('x','Range'),'total_time'] == 19
+    assert summary.loc[('x','Range'),'first_use_mean'] == 10
+    assert list(usage_summary(table,('condition','detector'))['sessions']) == [1,1]
+
+def test_usage_summary_refuses_missing_group_keys(table):
+    with pytest.raises(ValueError):
+        usage_summary(table,('class','detector'))
+    blank = table.copy()
+    blank['condition'] = None
+    with pytest.raises(ValueError):
+        usage_summary(blank,('condition','detector'))
+    assert len(usage_summary(table.iloc[:0],('activity','detector'))) == 0
+
+def test_interval_set_matches_list_helpers():
+    rng = np.random.RandomState(0)
+    for trial in range(200):
+        x = [(int(s),int(d)) for s,d in zip(rng.randint(0,50,4),rng.randint(1,10,4))]
+        y = [(int(s),int(d)) for s,d in zip(rng.randint(0,50,4),rng.randint(1,10,4))]
+        union = IntervalSet.from_coords(x).union(IntervalSet.from_coords(y))
+        assert union.coverage() == IntervalSet.from_coords(merge_usage(list(x),list(y))).coverage()
+        both = IntervalSet.from_coords(x).intersection(IntervalSet.from_coords(y))
+        assert both.coverage() == IntervalSet.from_coords(intersect_usage(x,y)).coverage()
+
+def brute_overlapping(merged, detector, start, end, sessions=None):
+    rows = merged[merged['detector'] == detector]
+    if sessions is not None:
+        rows = rows[rows['session'].isin(sessions)]
+    ends = rows['start']+rows['duration']
+    keep = (rows['start'] < end) & ((ends > start) | (rows['start'] >= start))
+    return rows[keep].sort_values(['session','start'],kind='mergesort').reset_index(drop=True)
+
+WINDOWS = [(0,300),(120,121),(-50,30),(-np.inf,np.inf),(0,np.inf),(600,np.inf),(-100,-10),(10**6,10**7),(300,300)]
+
+def test_interval_index_matches_brute_force(table):
+    index = IntervalIndex(table)
+    merged = merge_intervals(table)
+    sessions = list(pd.unique(table['session']))
+    for detector in list(function_to_use)+['Nothing']:
+        for start,end in WINDOWS:
+            for some in [None,sessions[1:3]]:
+                found = index.overlapping(detector,start,end,some)
+                expected = brute_overlapping(merged,detector,start,end,some)
+                assert list(zip(found['session'],found['start'],found['duration'])) == \
+                       list(zip(expected['session'],expected['start'],expected['duration'])), (detector,start,end,some)
+
+def test_open_ended_queries_stay_in_their_session(table):
+    index = IntervalIndex(table)
+    for detector in function_to_use:
+        rows = merge_intervals(table)
+        rows = rows[rows['detector'] == detector]
+        assert index.sessions_using(detector) == list(pd.unique(rows['session']))
+        assert index.sessions_using(detector,0) == list(pd.unique(rows['session']))
+        late = rows[rows['start']+rows['duration'] > 900]
+        assert sorted(index.sessions_using(detector,900)) == sorted(pd.unique(late['session']))
+        found = index.overlapping(detector,0,np.inf)
+        assert not found.duplicated().any()
+        assert len(found) == len(rows)
+
+def test_near_case_start_and_co_occurrence(table):
+    index = IntervalIndex(table)
+    merged = merge_intervals(table)
+    cases = merged[merged['detector'] == 'Cases']
+    found = index.near_case_start('Build',60)
+    expected = []
+    for session,case_start in zip(cases['session'],cases['start']):
+        rows = brute_overlapping(merged,'Build',case_start,case_start+60,[session])
+        expected.extend((session,start,case_start) for start in rows['start'])
+    assert sorted(zip(found['session'],found['start'],found['case_start'])) == sorted(expected)
+    shared = index.co_occurrence('Build','Cases')
+    assert (shared['duration'] > 0).all()
+    for session,start,duration in zip(shared['session'],shared['start'],shared['duration']):
+        assert len(brute_overlapping(merged,'Build',start,start+duration,[session])) > 0
+
+def covered(coords):
+    #the whole seconds covered by integer coordinates
+    return set(t for start,duration in coords for t in range(start,start+duration))
+
+def int_coords(intervals):
+    return [(int(s),int(d)) for s,d in intervals.to_coords()]
+
+def test_interval_set_example():
+    x = IntervalSet.from_coords([(0,1),(2,3),(10,3)])
+    y = IntervalSet.from_coords([(0,2),(3,1),(9,2),(12,2)])
+    assert (x | y).to_coords() == [(0.0,5.0),(9.0,5.0)]
+    assert (x & y).to_coords() == [(0.0,1.0),(3.0,1.0),(10.0,1.0),(12.0,1.0)]
+    assert (x - y).to_coords() == [(2.0,1.0),(4.0,1.0),(11.0,1.0)]
+    assert len(IntervalSet()) == 0 and IntervalSet.from_coords([]).to_coords() == []
+    with pytest.raises(ValueError):
+        IntervalSet([0,1],[2])
+
+def test_interval_set_operations_by_brute_force():
+    rng = np.random.RandomState(1)
+    for trial in range(200):
+        x = [(int(s),int(d)) for s,d in zip(rng.randint(0,40,5),rng.randint(1,8,5))]
+        y = [(int(s),int(d)) for s,d in zip(rng.randint(0,40,5),rng.randint(1,8,5))]
+        a,b = IntervalSet.from_coords(x),IntervalSet.from_coords(y)
+        assert covered(int_coords(a | b)) == covered(x) | covered(y)
+        assert covered(int_coords(a & b)) == covered(x) & covered(y)
+        assert covered(int_coords(a - b)) == covered(x) - covered(y)
+        #disjoint, sorted and never touching
+        coords = (a | b).to_coords()
+        assert all(s1+d1 < s2 for (s1,d1),(s2,d2) in zip(coords,coords[1:]))
+
+def test_clean_coords_merges_like_repeated_merge_usage():
+    rng = np.random.RandomState(2)
+    for trial in range(200):
+        coords = [(int(s),int(d)) for s,d in zip(rng.randint(0,60,6),rng.randint(0,8,6))]
+        #clean_coords before IntervalSet
+        expected = sorted(set(coords))
+        while True:
+            merged = merge_usage(expected,expected)
+            if merged == expected:
+                break
+            expected = merged
+        assert clean_coords(coords) == expected
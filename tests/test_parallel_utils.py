@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from utils import prepare_all_sessions, get_key_ideas_batch, prepare_session_rows
+from session_utils import interval_table
+from parallel_utils import share_export, analyze_sessions
+from viz_utils import function_to_use, column_to_use
+
+def with_blank_sessions(log):
+    #a few rows of the export have no Session Id, scattered through it
+    blank = log.iloc[[3,40,41,200]].copy()
+    blank['Session Id'] = np.nan
+    return pd.concat([blank.iloc[:1],log.iloc[:100],blank.iloc[1:],log.iloc[100:]],ignore_index=True)
+
+def test_shared_sessions_are_the_rows_of_each_session(generated_log, tmpdir):
+    log = with_blank_sessions(generated_log)
+    shared = share_export(log,str(tmpdir))
+    assert [s for s,start,stop in shared.sessions] == list(generated_log['Session Id'].unique())
+    for sessionid,start,stop in shared.sessions:
+        rows = shared.session_rows(sessionid)
+        expected = generated_log[generated_log['Session Id'] == sessionid]
+        assert len(rows) == len(expected)
+        assert list(rows['Selection']) == list(expected['Selection'])
+        assert list(prepare_session_rows(rows)['Time_seconds']) == list(prepare_session_rows(expected)['Time_seconds'])
+    assert shared.ranges == dict((sessionid,(start,stop)) for sessionid,start,stop in shared.sessions)
+    with pytest.raises(KeyError):
+        shared.session_rows('no such session')
+
+def test_analyze_sessions_matches_the_batch_detectors(generated_log, tmpdir):
+    shared = share_export(with_blank_sessions(generated_log),str(tmpdir))
+    sessions = prepare_all_sessions(generated_log)
+    order = list(generated_log['Session Id'].unique())
+    expected = interval_table([(s,sessions[s]) for s in order],function_to_use,column_to_use)
+    ideas = get_key_ideas_batch([(s,sessions[s]) for s in order])
+    for processes in [1,2]:
+        intervals,found_ideas,workers = analyze_sessions(shared,processes=processes,column_to_use=column_to_use)
+        assert_frame_equal(intervals,expected)
+        assert_frame_equal(found_ideas,ideas)
+        assert workers['sessions'].sum() == len(order)
+
+def test_analyze_no_sessions(generated_log, tmpdir):
+    shared = share_export(generated_log,str(tmpdir))
+    intervals,ideas,workers = analyze_sessions(shared,sessionids=[],processes=1)
+    assert len(intervals) == 0 and len(ideas) == 0 and len(workers) == 0
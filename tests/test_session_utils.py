@@ -0,0 +1,215 @@
+import re
+import numpy as np
+import pytest
+import pandas as pd
+from utils import prepare_session, action_usage, intersect_usage, detector_patterns, session_patterns, case_patterns, \
+    case_usage, single_value_usage, central_tendency_usage, range_usage, distance_usage, count_gaps_usage, \
+    count_all_usage, combo_central_tendency_usage, find_cases, all_cases, case_sides, \
+    other_usage, DETECTOR_DEPENDENCIES, DETECTOR_PATTERNS, regex_distance, subtraction_usage
+from session_utils import PatternMatcher, SessionContext, CaseWindow, window_rows, schedule_detectors, run_detectors, \
+    subtraction_operands, tokenize_method, parse_method, parse_methods, MethodStep, MethodTerm, METHOD_COLUMNS
+from viz_utils import function_to_use
+
+# The detectors that search each case on its own.
+PER_CASE_DETECTORS = [single_value_usage,central_tendency_usage,range_usage,distance_usage,count_gaps_usage,
+                      count_all_usage,combo_central_tendency_usage]
+
+def generated_sessions(log):
+    return [prepare_session(log,sessionid) for sessionid in log['Session Id'].unique()]
+
+def test_pattern_matcher_scans_every_detector_pattern_by_default(prepared):
+    matcher = PatternMatcher(prepared)
+    patterns = detector_patterns(prepared)
+    matcher.scan()
+    assert matcher.pending == {}
+    assert set((column,pattern) for column in matcher.hits for pattern in matcher.hits[column]) == set(patterns)
+
+def test_detector_patterns_are_the_ones_the_detectors_search_for(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        #nothing registered up front, so every pattern a detector asks for is scanned on demand
+        matcher = PatternMatcher(df, patterns=[])
+        for detector in list(function_to_use.values())+list(DETECTOR_PATTERNS):
+            detector(matcher)
+        searched = set((column,pattern) for column in matcher.hits for pattern in matcher.hits[column])
+        #without a SessionContext the subtractions of range_usage and distance_usage are searched for too
+        subtractions = set((column,pattern) for column,pattern in searched if re.match(r'\d+ \\- \d+$',pattern))
+        assert subtractions
+        assert searched-subtractions == set(detector_patterns(df))
+
+def test_pattern_matcher_gives_the_same_results_as_the_dataframe(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        matcher = PatternMatcher(df)
+        assert all_cases(matcher) == find_cases(df)
+        for detector in function_to_use.values():
+            assert detector(matcher) == detector(df.copy()), detector.__name__
+
+def test_window_rows_keeps_what_intersect_usage_keeps():
+    rng = np.random.RandomState(0)
+    for trial in range(200):
+        starts = np.cumsum(rng.randint(0,5,30)).astype(float)
+        durations = np.append(np.diff(starts),10.0)
+        if trial % 2:
+            order = rng.permutation(30)
+            starts,durations = starts[order],durations[order]
+        case = (float(rng.randint(0,80)),float(rng.randint(1,40)))
+        rows = window_rows(starts,durations,case)
+        coords = list(zip(starts,durations))
+        for i,coord in enumerate(coords):
+            if not rows[i]:
+                assert intersect_usage([coord],[case]) == []
+
+def test_case_windows_give_the_same_results_as_the_whole_session(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        session = SessionContext(df)
+        for detector in PER_CASE_DETECTORS:
+            assert detector(session) == detector(df.copy()), detector.__name__
+        for case,coords in session.all_cases().items():
+            window = session.case_window(case)
+            assert isinstance(window,CaseWindow)
+            assert session.case_window(case) is window
+            assert window.case_window(case) is window
+            assert window.all_cases() == {case: coords}
+            assert set(window.df.index) <= set(df.index)
+            assert len(window.df) <= len(df)
+
+def test_session_context_only_scans_case_patterns_in_their_window(prepared):
+    session = SessionContext(prepared)
+    session.scan()
+    assert set(session.hits['Cleaned method 1']) == set(p for c,p in session_patterns(prepared) if c == 'Cleaned method 1')
+    case = list(session.all_cases())[0]
+    window = session.case_window(case)
+    window.scan()
+    expected = set(p for c,p in case_patterns(prepared,','.join(case)) if c == 'Cleaned method 1')
+    assert expected == set(window.hits['Cleaned method 1'])
+    assert not expected & set(session.hits['Cleaned method 1'])
+
+def test_pattern_matcher_hits_match_str_contains(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        df = df.copy()
+        df.loc[df.index[:3],'Cleaned method 1'] = np.nan
+        matcher = PatternMatcher(df)
+        patterns = detector_patterns(df)
+        matcher.scan()
+        assert matcher.scans == len(set(column for column,pattern in patterns))
+        for column,pattern in patterns:
+            expected = df[column].str.contains(pattern,na=False).values
+            assert (matcher.hit(column,pattern) == expected).all(), pattern
+            assert matcher.usage(column,pattern) == action_usage(df,column,pattern)
+        assert matcher.scans == len(set(column for column,pattern in patterns))
+
+def test_pattern_matcher_scans_new_patterns_when_asked(prepared):
+    matcher = PatternMatcher(prepared,[('Selection','submit')])
+    assert matcher.hit('Selection','delete').sum() == prepared['Selection'].str.contains('delete',na=False).sum()
+    matrix = matcher.hit_matrix('Selection')
+    assert list(matrix.columns) == ['submit','delete']
+    assert list(matrix.index) == list(prepared.index)
+
+def test_session_context_finds_cases_once(prepared, monkeypatch):
+    import session_utils
+    found = []
+    def counting_find_cases(df):
+        found.append(df)
+        return find_cases(df)
+    monkeypatch.setattr(session_utils,'find_cases',counting_find_cases)
+    session = SessionContext(prepared)
+    assert all_cases(session) == find_cases(prepared)
+    assert all_cases(session) == all_cases(prepared)
+    assert len(found) == 1
+    #callers get a copy and can't change the cases kept by the session
+    all_cases(session).clear()
+    assert all_cases(session) == find_cases(prepared)
+
+def test_session_context_parses_each_case_once(prepared):
+    session = SessionContext(prepared)
+    for case in session.all_cases():
+        sides = case_sides(session,case)
+        assert sides == case_sides(prepared,case)
+        assert case_sides(session,case) is sides
+        assert session.case_window(case).case_sides(case) is sides
+
+def test_session_context_result_runs_a_detector_once(prepared):
+    session = SessionContext(prepared)
+    first = session.result(count_all_usage)
+    first.append((0,0))
+    second = session.result(count_all_usage)
+    assert second == count_all_usage(prepared.copy())
+    assert session.recomputed == ['count_all_usage']
+    assert session.reused == {'count_all_usage': 1}
+
+def test_schedule_detectors_puts_dependencies_first():
+    ordered = schedule_detectors([other_usage,count_all_usage])
+    assert ordered[-2:] == [other_usage,count_all_usage]
+    assert len(ordered) == len(set(ordered))
+    for dependency in DETECTOR_DEPENDENCIES[other_usage]:
+        assert ordered.index(dependency) < ordered.index(other_usage)
+    assert schedule_detectors([]) == []
+
+def test_schedule_detectors_refuses_loops():
+    with pytest.raises(ValueError):
+        schedule_detectors([count_all_usage],{count_all_usage: [range_usage], range_usage: [count_all_usage]})
+
+def test_run_detectors_runs_each_detector_once(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        session = SessionContext(df)
+        found = run_detectors(session,function_to_use)
+        assert sorted(session.recomputed) == sorted(set(session.recomputed))
+        for action,detector in function_to_use.items():
+            assert found[action] == detector(df.copy()), action
+    assert run_detectors(prepared,function_to_use) == found
+
+def test_subtraction_operands_are_what_regex_distance_matches():
+    assert subtraction_operands('st1 11 - 23') == set([('11','2'),('11','23'),('1','2'),('1','23')])
+    assert subtraction_operands('st1 9 - 5 - 1') == set([('9','5'),('5','1')])
+    assert subtraction_operands('st1 Sum all') == set()
+    for method in ['st1 11 - 23','st1 9 - 5 - 1','st1 Count all - 3 st2 12 - Step1']:
+        for v1 in range(0,25):
+            for v2 in range(0,25):
+                matched = re.search(regex_distance(v1,v2),method) is not None
+                assert matched == ((str(v1),str(v2)) in subtraction_operands(method)), (method,v1,v2)
+
+def test_subtraction_usage_matches_action_usage(generated_log, prepared):
+    for df in generated_sessions(generated_log)+[prepared]:
+        session = SessionContext(df)
+        for column in ['Cleaned method 1','Cleaned method 2']:
+            for v1 in range(0,12):
+                for v2 in range(0,12):
+                    expected = action_usage(df,column,regex_distance(v1,v2))
+                    assert subtraction_usage(session,column,v1,v2) == expected, (column,v1,v2)
+                    assert subtraction_usage(df,column,v1,v2) == expected
+    #values that aren't plain numbers are scanned for
+    assert session.subtraction_usage('Cleaned method 1','x',1) is None
+    assert subtraction_usage(session,'Cleaned method 1',r'\d',1) == action_usage(prepared,'Cleaned method 1',regex_distance(r'\d',1))
+
+def test_parse_method_examples():
+    assert tokenize_method('st1 Count choose... 2 3 x Step1 X foo') == [('step','1'),('function','Count'),('selection','choose...'),
+        ('value','2'),('value','3'),('operator','x'),('reference','1'),('empty','X'),('other','foo')]
+    assert parse_method('st1 Count choose... 2 3 x Sum all') == (MethodStep(1,(MethodTerm('Count','choose...',(2,3),None),
+                                                                                MethodTerm('Sum','all',(),None)),('x',)),)
+    assert parse_method('st1 Average all + 5 st2 Step1 / X') == (
+        MethodStep(1,(MethodTerm('Average','all',(),None),MethodTerm(None,None,(5,),None)),('+',)),
+        MethodStep(2,(MethodTerm(None,None,(),1),MethodTerm(None,None,(),None)),('/',)))
+    #an X after choose... is a value that wasn't picked yet
+    assert parse_method('st1 Count choose... 1 X') == (MethodStep(1,(MethodTerm('Count','choose...',(1,),None),),()),)
+    assert parse_method('') == ()
+
+def test_parse_methods_keeps_the_index_and_parses_each_method_once(prepared, monkeypatch):
+    import session_utils
+    methods = prepared['Cleaned method 1']
+    parsed = parse_methods(methods)
+    assert list(parsed.columns) == METHOD_COLUMNS
+    assert parsed.index.equals(methods.index)
+    for method,row in zip(methods,parsed.itertuples(index=False)):
+        steps = parse_method(method) if isinstance(method,str) else ()
+        assert row.parsed == steps
+        assert row.steps == len(steps)
+        assert row.values == tuple(value for step in steps for term in step.terms for value in term.values)
+    calls = []
+    def counting_parse_method(method):
+        calls.append(method)
+        return parse_method(method)
+    monkeypatch.setattr(session_utils,'parse_method',counting_parse_method)
+    session = SessionContext(prepared)
+    assert session.parsed('Cleaned method 1').equals(parsed)
+    assert session.parsed('Cleaned method 1') is session.parsed('Cleaned method 1')
+    assert len(calls) == methods.dropna().nunique()
+    assert parse_methods(pd.Series([],dtype=object)).empty
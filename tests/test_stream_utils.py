@@ -0,0 +1,76 @@
+import numpy as np
+from conftest import SESSION_ID
+from utils import prepare_session, all_cases, action_usage, merge_usage, ONE_HOUR
+from session_utils import run_detectors
+from stream_utils import StreamingSession, StreamingLog, _wrap
+from viz_utils import function_to_use, column_to_use
+
+PREPARED_COLUMNS = ['Time_seconds','Duration','Cleaned method 1','Cleaned method 2','cases']
+
+def batch_intervals(df):
+    intervals = run_detectors(df,function_to_use)
+    for action,column in column_to_use.items():
+        intervals[action] = action_usage(df,column,action)
+    return intervals
+
+def check_session(streamed, batch):
+    assert streamed.frame()[PREPARED_COLUMNS].reset_index(drop=True).equals(batch[PREPARED_COLUMNS].reset_index(drop=True))
+    assert streamed.all_cases() == all_cases(batch)
+    intervals = streamed.intervals()
+    for action,coords in batch_intervals(batch).items():
+        #intervals of neighbouring cases come in two pieces, so they are compared once merged
+        assert merge_usage(intervals[action],[]) == merge_usage(sorted(coords),[]), action
+
+def test_streaming_session_matches_prepare_session(raw):
+    streamed = StreamingSession(SESSION_ID)
+    rows = raw[raw['Session Id'] == SESSION_ID]
+    kept = streamed.extend(rows)
+    assert kept == (rows['Outcome'] == 'CORRECT').sum()
+    check_session(streamed,prepare_session(raw,SESSION_ID))
+
+def test_streaming_session_one_row_at_a_time(generated_log):
+    sessionid = generated_log['Session Id'].iloc[0]
+    streamed = StreamingSession(sessionid)
+    rows = generated_log[generated_log['Session Id'] == sessionid]
+    for index,row in rows.iterrows():
+        streamed.append(row.to_dict())
+    check_session(streamed,prepare_session(generated_log,sessionid))
+
+def test_streaming_log_dispatches_rows_to_their_session(generated_log):
+    log = StreamingLog()
+    assert log.extend(generated_log) == (generated_log['Outcome'] == 'CORRECT').sum()
+    assert set(log.sessions) == set(generated_log['Session Id'].unique())
+    for sessionid,streamed in log.sessions.items():
+        check_session(streamed,prepare_session(generated_log,sessionid))
+
+def test_streaming_session_without_rows():
+    streamed = StreamingSession('empty')
+    assert not streamed.append({'Outcome': 'INCORRECT'})
+    assert streamed.all_cases() == {}
+    assert streamed.intervals() == dict((action,[]) for action in list(function_to_use)+list(column_to_use))
+
+def test_wrap_adds_an_hour_when_the_clock_went_past_it():
+    assert _wrap(np.timedelta64(-60,'s')) == ONE_HOUR-np.timedelta64(60,'s')
+    assert _wrap(np.timedelta64(60,'s')) == np.timedelta64(60,'s')
+
+def test_streaming_session_runs_detectors_once_per_case(generated_log, monkeypatch):
+    sessionid = generated_log['Session Id'].iloc[0]
+    rows = generated_log[generated_log['Session Id'] == sessionid].copy()
+    #the first rows are logged outside of any case
+    rows.loc[rows.index[:20],['CF(new1)','CF(new2)']] = np.nan
+    streamed = StreamingSession(sessionid)
+    detected = []
+    detect = streamed._detect
+    def counting_detect(start, stop):
+        detected.append((start,stop))
+        return detect(start,stop)
+    monkeypatch.setattr(streamed,'_detect',counting_detect)
+    streamed.extend(rows)
+    cases = streamed.frame()['cases']
+    changes = sum(1 for case,other in zip(cases[1:],cases[:-1]) if not (case == other or (case != case and other != other)))
+    assert len(detected) == changes
+    assert detected[0][0] == 0 and detected[0][1] > 1
+    first = streamed.intervals()
+    assert streamed.intervals() == first
+    assert len(detected) == changes+1
+    check_session(streamed,prepare_session(rows,sessionid))
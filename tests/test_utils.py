@@ -0,0 +1,209 @@
+import datetime
+import re
+import pandas as pd
+from pandas.testing import assert_frame_equal
+from conftest import SESSION_ID
+from utils import intersect_usage, merge_usage, other_usage, combo_central_tendency_usage, \
+    split_sessions, prepare_session, prepare_all_sessions, fix_time, fix_times, calculate_duration, calculate_durations, \
+    MethodNormalizer, clean_method, opt_combos3, opt_combos2, symbol_combos3, symbol_combos2, functions_combos2, \
+    get_key_ideas, get_key_ideas_batch, KEY_IDEAS_COLUMNS, compact_session, memory_report, COMPACT_COLUMNS, action_usage
+from bench_utils import load_methods
+from session_utils import interval_table
+from viz_utils import function_to_use, column_to_use
+
+def test_merge_usage_example():
+    x = [(0,1),(2,3),(10,3)]
+    y = [(0,2),(3,1),(9,2),(12,2)]
+    assert merge_usage(x,y) == [(0,2),(2,3),(9,5)]
+
+def test_merge_usage_keeps_intervals_that_end_last():
+    #x, y, what merge_usage gave when it shortened the interval before the last one, what it gives now
+    changed = [([(0,10),(4,2)],[(2,3)],[(0,6)],[(0,10)]),
+               ([(0,5),(3,20)],[(10,2)],[(0,12)],[(0,23)]),
+               ([(0,30),(40,30)],[(45,10),(50,5)],[(0,30),(40,15)],[(0,30),(40,30)])]
+    for x,y,before,after in changed:
+        assert merge_usage(x,y) == after
+        #only the last interval changed, and only by getting longer
+        assert after[:-1] == before[:-1]
+        assert after[-1][0] == before[-1][0] and after[-1][1] > before[-1][1]
+    #when the last coordinates end last nothing changed
+    assert merge_usage([(0,100)],[(10,95)]) == [(0,105)]
+    assert merge_usage([(0,100)],[(10,5)]) == [(0,100)]
+
+def test_intersect_usage_example():
+    x = [(0,1),(2,3),(10,3)]
+    y = [(0,2),(3,1),(9,2),(12,2)]
+    assert intersect_usage(x,y) == [(0,1),(3,1),(10,1),(12,1)]
+
+def test_intersect_usage_leaves_its_arguments_alone():
+    x = [(10,3),(0,1),(2,3)]
+    y = [(12,2),(0,2),(3,1),(9,2)]
+    intersect_usage(x,y)
+    assert x == [(10,3),(0,1),(2,3)]
+    assert y == [(12,2),(0,2),(3,1),(9,2)]
+
+def test_other_usage_on_sample_session(prepared):
+    #combo_central_tendency_usage used to intersect the leftovers of lists emptied by earlier calls,
+    #which found (825.0, 8.0) here. Every pair of central tendency methods is now intersected in full.
+    assert combo_central_tendency_usage(prepared) == [(795.0,38.0)]
+    assert other_usage(prepared) == [(795.0,38.0)]
+
+def test_split_sessions_keeps_the_rows_of_each_session_in_order(generated_log):
+    shuffled = generated_log.sample(frac=1,random_state=0).sort_index(kind='mergesort')
+    sessions = split_sessions(shuffled)
+    assert list(sessions) == list(shuffled['Session Id'].unique())
+    for sessionid,rows in sessions.items():
+        assert list(rows.index) == list(shuffled.index[shuffled['Session Id'] == sessionid])
+
+def test_prepare_all_sessions_matches_prepare_session(generated_log, raw):
+    both = pd.concat([generated_log,raw],ignore_index=True)
+    sessions = prepare_all_sessions(both)
+    assert sorted(sessions) == sorted(both['Session Id'].unique())
+    for sessionid,df in sessions.items():
+        assert_frame_equal(df,prepare_session(both,sessionid))
+    some = prepare_all_sessions(both,[SESSION_ID])
+    assert list(some) == [SESSION_ID]
+
+def clock(seconds):
+    return datetime.time(0,(seconds%3600)//60,seconds%60)
+
+def row_by_row(times):
+    #what prepare_session did before fix_times and calculate_durations
+    df = pd.DataFrame({'Time': times})
+    df['Timeshifted'] = df['Time'].shift(-1)
+    seconds = [fix_time(times[0],t) for t in times]
+    durations = list(df.apply(calculate_duration,axis=1))
+    return seconds,durations
+
+def test_vectorized_times_match_the_row_functions():
+    #starts at 58:20 and goes past the hour
+    times = [clock(s) for s in [3500,3510,3511,3599,3600,3605,3700,4000,4000,5000]]
+    seconds,durations = row_by_row(times)
+    assert list(fix_times(pd.Series(times))) == seconds
+    assert list(calculate_durations(pd.Series(times))) == durations
+    assert seconds[-1] == 1500
+    assert durations[-1] == 10
+
+def test_vectorized_times_read_strings_and_sessions(raw):
+    times = [datetime.datetime.strptime(t,'%H:%M:%S').time() for t in raw['Time']]
+    seconds,durations = row_by_row(times)
+    assert list(fix_times(raw['Time'])) == seconds
+    assert list(calculate_durations(raw['Time'])) == durations
+    both = pd.concat([raw['Time'],raw['Time'].iloc[:5]],ignore_index=True)
+    sessions = ['a']*len(raw)+['b']*5
+    assert list(fix_times(both,sessions)) == seconds+seconds[:5]
+    assert list(calculate_durations(both,sessions)) == durations+durations[:4]+[10]
+
+def original_clean_method(method):
+    #clean_method before MethodNormalizer
+    method = method.replace("}","").replace("{","").replace("Use","")
+    method = re.sub(' +',' ',method)
+    for table in [opt_combos3,opt_combos2,symbol_combos3,symbol_combos2,functions_combos2]:
+        for combo,replacement in table.items():
+            method = method.replace(combo,replacement)
+    return method
+
+def test_method_normalizer_matches_the_original_cleaning():
+    methods = load_methods()+['{Use st1} x - + {st2}','none all choose... x x','Average Sum  Count Median']
+    normalizer = MethodNormalizer()
+    for method in methods:
+        assert normalizer.clean(method) == original_clean_method(method)
+    assert clean_method(methods[0]) == original_clean_method(methods[0])
+
+def test_method_normalizer_cleans_each_method_once():
+    normalizer = MethodNormalizer()
+    methods = pd.Series(['{st1 x x}','st1 5','{st1 x x}','{st1 x x}'],index=[3,5,7,9])
+    cleaned = normalizer.clean_series(methods)
+    assert list(cleaned.index) == [3,5,7,9]
+    assert list(cleaned) == ['st1 x','st1 5','st1 x','st1 x']
+    stats = normalizer.stats()
+    assert (stats['misses'],stats['hits'],stats['distinct']) == (2,2,2)
+    normalizer.clean('st1 5')
+    assert normalizer.stats()['hits'] == 3
+
+def original_key_ideas(df):
+    #get_key_ideas before get_key_ideas_batch, only changed to run on newer pandas (no applymap, missing cases skipped)
+    df = df.copy()
+    df['Cleaned joined methods'] = df['Cleaned method 1'].map(str) + ' | ' + df['Cleaned method 2']
+    df['Selection_unsided'] = [s.replace('1','').replace('2','') for s in list(df['Selection'].map(str))]
+    df['Selection_unsided'] = df['Selection_unsided'].loc[df['Selection_unsided'].shift() != df['Selection_unsided']]
+    df['Cleaned joined methods'] = df['Cleaned joined methods'].loc[df['Cleaned joined methods'].shift() != df['Cleaned joined methods']]
+    df['Selection_unsided_shifted'] = df['Selection_unsided'].shift(-1)
+    columns = ['Selection_unsided_shifted','Time_seconds','cases','Cleaned joined methods']
+    submitted_ideas = df[df['Selection_unsided_shifted'].str.contains('submit',na=False)][columns]
+    deleted_ideas = df[df['Selection_unsided_shifted'].str.contains('delete',na=False)][columns]
+    ideas = pd.concat([deleted_ideas,submitted_ideas])
+    ideas = ideas[ideas['Cleaned joined methods'].str.contains("st1 | st1", regex=False) == False]
+    ideas = ideas.replace(',',' | ',regex=True)
+    raw_cases = [case for case in set(df['cases']) if isinstance(case,str)]
+    df_cases = pd.DataFrame({'Selection_unsided_shifted': ['get new case']*len(raw_cases),
+                             'Time_seconds': [df['Time_seconds'][df['cases'] == case].iloc[0] for case in raw_cases],
+                             'cases': ['-']*len(raw_cases),
+                             'Cleaned joined methods': ['-']*len(raw_cases)})
+    ideas = pd.concat([ideas, df_cases])
+    ideas['timestamp'] = ['{0}:{1}'.format(int(t/60),int(t-int(t/60)*60)) for t in ideas['Time_seconds']]
+    ideas = ideas.rename(columns = {'Selection_unsided_shifted':'action','Cleaned joined methods':'tried methods'})
+    return ideas[['action','timestamp','cases','tried methods']]
+
+def rows_of(ideas):
+    return sorted(tuple(str(value) for value in row) for row in ideas.itertuples(index=False))
+
+def test_key_ideas_match_the_original(generated_log, prepared):
+    sessions = prepare_all_sessions(generated_log)
+    for df in list(sessions.values())+[prepared]:
+        before = df.copy()
+        ideas = get_key_ideas(df)
+        assert_frame_equal(df,before)
+        assert list(ideas.columns) == KEY_IDEAS_COLUMNS
+        assert rows_of(ideas) == rows_of(original_key_ideas(df))
+        #sorted by time, with a case starting before what is tried in it
+        seconds = [int(m)*60+int(s) for m,s in ideas['timestamp'].str.split(':')]
+        assert seconds == sorted(seconds)
+
+def test_key_ideas_batch_stacks_the_sessions(generated_log):
+    sessions = prepare_all_sessions(generated_log)
+    order = sorted(sessions)
+    batch = get_key_ideas_batch([(s,sessions[s]) for s in order],pseudonyms=dict((s,'p'+s) for s in order))
+    assert list(batch.columns) == ['session','pseudonym']+KEY_IDEAS_COLUMNS
+    assert list(batch['session'].drop_duplicates()) == [s for s in order if len(get_key_ideas(sessions[s]))]
+    for sessionid in order:
+        rows = batch[batch['session'] == sessionid]
+        assert (rows['pseudonym'] == 'p'+sessionid).all()
+        assert_frame_equal(rows[KEY_IDEAS_COLUMNS].reset_index(drop=True),get_key_ideas(sessions[sessionid]))
+    assert_frame_equal(get_key_ideas_batch(sessions),get_key_ideas_batch([(s,sessions[s]) for s in sessions]))
+    assert list(get_key_ideas_batch([]).columns) == ['session']+KEY_IDEAS_COLUMNS
+
+def test_compact_sessions_give_the_same_results(generated_log, prepared):
+    sessions = prepare_all_sessions(generated_log)
+    sessions['sample'] = prepared
+    for df in sessions.values():
+        compact = compact_session(df)
+        assert set(compact.columns) <= set(COMPACT_COLUMNS)
+        for action,detector in function_to_use.items():
+            assert detector(compact.copy()) == detector(df.copy()), action
+        for action,column in column_to_use.items():
+            assert action_usage(compact,column,action) == action_usage(df,column,action), action
+        assert_frame_equal(get_key_ideas(compact),get_key_ideas(df))
+
+def test_memory_report_shows_the_compact_sessions_are_smaller(generated_log):
+    sessions = prepare_all_sessions(generated_log)
+    compact = dict((s,compact_session(df)) for s,df in sessions.items())
+    full,small = memory_report(sessions),memory_report(compact)
+    assert list(full['name']) == list(sessions)+['total']
+    assert full['rows'].iloc[-1] == sum(len(df) for df in sessions.values())
+    assert small['megabytes'].iloc[-1] < full['megabytes'].iloc[-1]
+    assert abs(full['megabytes'].iloc[:-1].sum()-full['megabytes'].iloc[-1]) < 1e-9
+    assert list(memory_report([])['rows']) == [0]
+
+def test_interval_table_on_compact_sessions(generated_log):
+    log = generated_log.copy()
+    log['condition1'] = log['Session Id'].map(dict((s,'group '+str(i%2)) for i,s in enumerate(log['Session Id'].unique())))
+    full = prepare_all_sessions(log)
+    compact = prepare_all_sessions(log,compact=True)
+    for df in compact.values():
+        assert 'Problem Name' in df.columns and 'condition1' in df.columns
+    expected = interval_table(full,function_to_use,column_to_use)
+    table = interval_table(compact,function_to_use,column_to_use)
+    assert len(table) and set(table['activity']) == set(['trampoline'])
+    assert set(table['condition']) == set(['group 0','group 1'])
+    assert_frame_equal(table,expected)
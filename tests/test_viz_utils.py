@@ -0,0 +1,75 @@
+import re
+import matplotlib.pyplot as plt
+from conftest import SESSION_ID
+from utils import prepare_session
+from bench_utils import generate_session
+from utils import split_sessions
+from viz_utils import plot, render_sessions_pdf, render_timelines, to_plot, colors, column_to_use, function_to_use, \
+    _render_page, _pdf_objects, PDF_REFERENCE
+
+def test_plot_draws_a_session(prepared):
+    plot(prepared,to_plot,colors,column_to_use,function_to_use,for_export=True)
+    ax = plt.gca()
+    assert len(ax.get_yticks()) == len(to_plot)
+    assert ax.get_yticks()[0] == 5
+    plt.close('all')
+
+def test_render_sessions_pdf_writes_a_page(raw, tmpdir):
+    path = str(tmpdir.join('timelines.pdf'))
+    pages = render_sessions_pdf(raw,[SESSION_ID],path,titles=['Trampoline'],processes=1)
+    assert pages == 1
+    with open(path,'rb') as f:
+        assert f.read(5) == b'%PDF-'
+
+def test_render_sessions_pdf_with_workers(raw, tmpdir):
+    path = str(tmpdir.join('timelines.pdf'))
+    assert render_sessions_pdf(raw,[SESSION_ID,SESSION_ID],path,titles=['First','Second'],processes=2) == 2
+    with open(path,'rb') as f:
+        data = f.read()
+    objects,root,info = _pdf_objects(data)
+    assert info is None
+    #every object is where the cross-reference table says it is
+    start = int(data[data.rindex(b'startxref')+len(b'startxref'):].split()[0])
+    entries = data[start:].split(b'trailer')[0].splitlines()[3:]
+    assert len(entries) == len(objects)
+    for number,entry in enumerate(entries,1):
+        assert data[int(entry[:10]):].startswith(('{0} 0 obj'.format(number)).encode('ascii'))
+    pages = re.search(br'/Pages (\d+) 0 R',objects[root]).group(1)
+    assert b'/Count 2' in objects[int(pages)]
+    kids = [int(kid) for kid in PDF_REFERENCE.findall(re.search(br'/Kids \[(.*?)\]',objects[int(pages)]).group(1))]
+    #each page is the one page pdf drawn by a worker, only renumbered
+    rows = split_sessions(raw)[SESSION_ID]
+    for kid,title in zip(kids,['First','Second']):
+        assert b'/Type /Page' in objects[kid]
+        assert re.search(br'/Parent (\d+) 0 R',objects[kid]).group(1) == pages
+        contents = int(re.search(br'/Contents (\d+) 0 R',objects[kid]).group(1))
+        page,page_root,page_info = _pdf_objects(_render_page((rows,title,to_plot,colors,column_to_use,function_to_use)))
+        page_kid = [number for number,body in page.items() if b'/Type /Page\n' in body or b'/Type /Page ' in body][0]
+        page_contents = int(re.search(br'/Contents (\d+) 0 R',page[page_kid]).group(1))
+        assert objects[contents].partition(b'stream\n')[2] == page[page_contents].partition(b'stream\n')[2]
+    for body in objects.values():
+        for reference in PDF_REFERENCE.findall(body.partition(b'stream\n')[0]):
+            assert int(reference) in objects
+
+def test_render_sessions_pdf_without_sessions(raw, tmpdir):
+    path = str(tmpdir.join('empty.pdf'))
+    assert render_sessions_pdf(raw,[],path,processes=1) == 0
+    with open(path,'rb') as f:
+        objects,root,info = _pdf_objects(f.read())
+    assert sorted(objects) == [1,2]
+
+def test_render_timelines_both_renderers(prepared, tmpdir):
+    for fast in [True,False]:
+        path = str(tmpdir.join('timelines-{0}.pdf'.format(fast)))
+        stats = render_timelines([(SESSION_ID,prepared)],path,fast=fast)
+        assert list(stats['renderer']) == ['template' if fast else 'plot']
+        assert stats['artists'][0] > 0
+        assert stats['peak_memory_mb'][0] > 0
+
+def test_render_timelines_measures_memory_per_session():
+    big = prepare_session(generate_session('big',rows=3000,cases=10),'big')
+    small = prepare_session(generate_session('small',rows=60,cases=1),'small')
+    stats = render_timelines([('big',big),('small',small)])
+    #a high-water mark of the whole process would never go down
+    assert stats['peak_memory_mb'][1] < stats['peak_memory_mb'][0]
+    assert render_timelines([('small',small)],measure_memory=False)['peak_memory_mb'].isnull().all()
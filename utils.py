@@ -1,8 +1,31 @@
 from datetime import datetime, timedelta, date
 from pandas import notnull
+from collections import namedtuple
 import itertools
 import re
+import numpy as np
 import pandas as pd
+from interval_utils import IntervalSet
+
+try:
+    STRING_TYPES = (basestring,)
+except NameError:
+    STRING_TYPES = (str,)
+
+# The columns of the raw iLab export that prepare_session and the detectors actually read.
+PIPELINE_COLUMNS = ['Session Id',
+                    'Time',
+                    'Outcome',
+                    'Selection',
+                    'Method_Recognized_1_Copied',
+                    'Method_Recognized_2_Copied',
+                    'CF(new1)',
+                    'CF(new2)',
+                    'Feedback Text']
+
+# The columns of the raw export interval_table reads: the ones the pipeline reads,
+# and the ones it takes the activity and condition from by default.
+INTERVAL_SOURCE_COLUMNS = PIPELINE_COLUMNS+['Problem Name','condition1']
 
 def fix_time(time_start,current_time):
     """This function fixes the timestamps used by converting them to seconds, starting at zero.
@@ -43,6 +66,79 @@ def calculate_duration(row):
         duration = 10 #last action lasts zero seconds but we need to put a dummy variable here.
     return duration
 
+ONE_HOUR = np.timedelta64(3600*10**6,'us')
+
+def times_to_timedelta(times):
+    '''Converts logged times of day into a timedelta64 array so they can be handled as whole columns.
+
+    Args:
+        times (Pandas series): Times of day, either as datetime.time objects (what read_excel gives us),
+                                strings like '00:14:47' (what read_csv gives us) or timedelta64 values.
+
+    Returns:
+        A numpy timedelta64[us] array with the time elapsed since midnight, NaT for missing times.
+    '''
+    times = pd.Series(times)
+    if times.dtype.kind == 'm':
+        deltas = times
+    elif times.dtype.kind == 'M':
+        deltas = times - times.dt.normalize()
+    else:
+        deltas = pd.to_timedelta(times.map(str, na_action='ignore'))
+    return deltas.values.astype('timedelta64[us]')
+
+def timedelta_to_seconds(deltas):
+    '''Converts timedelta64 values to seconds, exactly like timedelta.total_seconds() does.'''
+    #dividing by one microsecond gives exact integers, and dividing those by 10**6 is what timedelta.total_seconds() does
+    return (deltas / np.timedelta64(1,'us')) / 10**6
+
+def fix_times(times, sessions=None):
+    '''Vectorized version of fix_time. Converts a whole column of timestamps to seconds, starting at zero,
+    adding an hour when the clock wrapped around since the first action.
+
+    Args:
+        times (Pandas series): The Time column, see times_to_timedelta for the accepted formats.
+        sessions (Pandas series): Optional session ids of each row so many sessions can be converted at once.
+                                  Each session then starts at zero on its own first action.
+
+    Returns:
+        A numpy array of seconds, equal to what fix_time gives row by row.
+    '''
+    deltas = times_to_timedelta(times)
+    if len(deltas) == 0:
+        return np.array([], dtype=float)
+    if sessions is None:
+        time_start = deltas[0]
+    else:
+        time_start = pd.Series(deltas).groupby(np.asarray(sessions), sort=False).transform('first').values
+    fixed = deltas - time_start
+    fixed = np.where(fixed < np.timedelta64(0,'us'), fixed + ONE_HOUR, fixed)
+    return timedelta_to_seconds(fixed)
+
+def calculate_durations(times, sessions=None):
+    '''Vectorized version of calculate_duration. Gets the duration of every action
+    given the difference in time between the current and next timestamp.
+
+    Args:
+        times (Pandas series): The Time column, see times_to_timedelta for the accepted formats.
+        sessions (Pandas series): Optional session ids of each row so the next timestamp is only looked up within the same session.
+
+    Returns:
+        A numpy array of durations in seconds, equal to what calculate_duration gives row by row.
+    '''
+    deltas = pd.Series(times_to_timedelta(times))
+    if sessions is None:
+        shifted = deltas.shift(-1)
+    else:
+        shifted = deltas.groupby(np.asarray(sessions), sort=False).shift(-1)
+    shifted = shifted.values.astype('timedelta64[us]')
+    duration = shifted - deltas.values.astype('timedelta64[us]')
+    duration = np.where(duration < np.timedelta64(0,'us'), duration + ONE_HOUR, duration)
+    duration = timedelta_to_seconds(duration)
+    #last action lasts zero seconds but we need to put a dummy variable here.
+    duration[pd.isnull(shifted)] = 10
+    return duration
+
 opt_combos3 = {'none choose... all':'all',
           'none all choose...':'choose...',
           'all choose... none':'none',
@@ -87,57 +183,216 @@ functions_combos2 = {"Average Average":"Average",
                         "Count Median":"Median",
                         "Median Median":"Median"}
 
+class MethodNormalizer(object):
+    '''Cleans up method strings with the rewrite tables above.
+    There are only about a thousand distinct methods in the whole export, so every distinct
+    method is cleaned once and the result is reused for all the rows that logged it.
+
+    The rewrites have to be applied one after the other since a replacement can create
+    a new combo for a later table (ex: 'x - +' -> '+' can leave a '+ +' behind).
+    All combos are compiled into a single pattern first so that methods without any combo,
+    which are most of them, are cleaned in one scan.
+
+    Args:
+        tables (list): The rewrite dictionaries in the order they are applied.
+    '''
+    def __init__(self, tables=None):
+        if tables is None:
+            tables = [opt_combos3, opt_combos2, symbol_combos3, symbol_combos2, functions_combos2]
+        self.rewrites = [(combo,replacement) for table in tables for combo,replacement in table.items()]
+        self.combos = re.compile('|'.join(re.escape(combo) for combo,replacement in self.rewrites))
+        self.spaces = re.compile(' +')
+        self.clear()
+
+    def clear(self):
+        '''Forgets all cleaned methods and resets the hit counts.'''
+        self.cleaned = {}
+        self.hits = 0
+        self.misses = 0
+
+    def rewrite(self, method):
+        '''Cleans a single method without looking at the cache.'''
+        method = method.replace("}","").replace("{","").replace("Use","")
+        method = self.spaces.sub(' ',method) #remove extra spaces
+        if self.combos.search(method) is None:
+            return method
+        for combo,replacement in self.rewrites:
+            method = method.replace(combo,replacement)
+        return method
+
+    def clean(self, method):
+        '''Cleans a single method, reusing the result if this method was seen before.'''
+        try:
+            cleaned = self.cleaned[method]
+            self.hits += 1
+        except KeyError:
+            cleaned = self.rewrite(method)
+            self.cleaned[method] = cleaned
+            self.misses += 1
+        return cleaned
+
+    def clean_series(self, methods):
+        '''Cleans a whole column of methods, cleaning each distinct method only once.
+
+        Args:
+            methods (Pandas series): The raw methods, ex: the Method_Recognized_1_Copied column.
+
+        Returns:
+            A Pandas series with the cleaned methods, with the same index as methods.
+        '''
+        cleaned = dict((method, self.clean(method)) for method in pd.unique(methods))
+        self.hits += len(methods) - len(cleaned) #rows that repeat a method we just cleaned
+        return methods.map(cleaned)
+
+    def stats(self):
+        '''Reports how often the cache was used.
+
+        Returns:
+            A dictionary with the number of lookups, hits, misses, the hit rate and the number of distinct methods cached.
+        '''
+        lookups = self.hits + self.misses
+        return {'lookups': lookups,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': float(self.hits)/lookups if lookups else 0.0,
+                'distinct': len(self.cleaned)}
+
+METHOD_NORMALIZER = MethodNormalizer()
+
 def clean_method(method):
-    method = method.replace("}","").replace("{","").replace("Use","")
-    method = re.sub(' +',' ',method) #remove extra spaces
-    for combo,replacement in opt_combos3.items():
-        method = method.replace(combo,replacement)
-    for combo,replacement in opt_combos2.items():
-        method = method.replace(combo,replacement)
-    for combo,replacement in symbol_combos3.items():
-        method = method.replace(combo,replacement)
-    for combo,replacement in symbol_combos2.items():
-        method = method.replace(combo,replacement)
-    for combo,replacement in functions_combos2.items():
-        method = method.replace(combo,replacement)
-    return method
+    return METHOD_NORMALIZER.clean(method)
     
 def clean_coords(coords_brocken_up):
     #since the coordinates all subsequent in time, we want to merge them to clean them up.
     #For example:
     # coords_brocken_up = [(0,2),(2,5),(7,2)]
     # coords -> [(0,9)]
-    while True:
-        coords = merge_usage(coords_brocken_up,coords_brocken_up)
-        if coords == coords_brocken_up:
-            return coords
-        else:
-            coords_brocken_up = coords
+    return IntervalSet.from_coords(coords_brocken_up).to_coords()
 
 
 #Using the example used for sketch.
 def prepare_session(df,sessionid):
     new_df = df[df['Session Id'] == sessionid]
-    
+    return prepare_session_rows(new_df)
+
+def prepare_session_rows(new_df):
+    '''Cleans up the rows of a single session so they can be used by the detectors.
+    This is the work done by prepare_session once the rows of the session have been selected.
+
+    Args:
+        new_df (Pandas dataframe): All the logged rows of one session, in the order they were logged.
+
+    Returns:
+        The prepared dataframe with the Cleaned method, cases, Time_seconds and Duration columns.
+    '''
 #     Next we filter out all actions with "INCORRECT" outcomes
     before = new_df.shape[0]
     new_df = new_df[new_df['Outcome'] == 'CORRECT']
     # print "After removin 'incorrect' actions, we are left with {0} rows out of {1}".format(new_df.shape[0],before)
     
 #     We also clean up the methods removing annoying characters like "{"
-    new_df['Cleaned method 1'] = new_df[['Method_Recognized_1_Copied']].applymap(lambda method:clean_method(method))
-    new_df['Cleaned method 2'] = new_df[['Method_Recognized_2_Copied']].applymap(lambda method:clean_method(method))
+    new_df['Cleaned method 1'] = METHOD_NORMALIZER.clean_series(new_df['Method_Recognized_1_Copied'])
+    new_df['Cleaned method 2'] = METHOD_NORMALIZER.clean_series(new_df['Method_Recognized_2_Copied'])
 
 #     We create a column with the data for the contrasting cases
     new_df['cases'] = new_df['CF(new1)'].str.replace('"','') +','+ new_df['CF(new2)'].str.replace('"','')
     
 #     Next we fix the time logs and convert them to seconds. We also recalculate the time between actions now that we have gotten rid of incorrect actions.
-    time_start = list(new_df['Time'])[0]
-    new_df['Time_seconds'] = new_df[['Time']].applymap(lambda current_time: fix_time(time_start,current_time))
+    new_df['Time_seconds'] = fix_times(new_df['Time'])
     new_df['Timeshifted'] = new_df[['Time']].shift(-1)
-    new_df['Duration'] = new_df[['Time','Timeshifted']].apply(calculate_duration, axis=1)
+    new_df['Duration'] = calculate_durations(new_df['Time'])
     return new_df
 
+def split_sessions(df):
+    '''Splits the export into its sessions in a single pass instead of scanning the whole dataframe for every session.
+
+    Args:
+        df (Pandas dataframe): The raw export with all sessions.
+
+    Returns:
+        A dictionary where the keys are session ids and the values are the rows of that session in their original order.
+    '''
+    return dict((sessionid, rows) for sessionid, rows in df.groupby('Session Id', sort=False))
+
+def prepare_all_sessions(df, sessionids=None, compact=False):
+    '''Prepares many sessions at once. The export is split once by session id
+    so each session costs only its own rows rather than a scan of the whole export.
+
+    Args:
+        df (Pandas dataframe): The raw export with all sessions.
+        sessionids (list): The sessions to prepare. Defaults to every session in the export.
+        compact (bool): Only keep the columns the pipeline and interval_table read (INTERVAL_SOURCE_COLUMNS)
+                        and store them with compact dtypes (see compact_session).
+
+    Returns:
+        A dictionary where the keys are session ids and the values are the same dataframes prepare_session would return.
+    '''
+    if compact:
+        #drop the unused export columns before splitting so they are never copied into the sessions
+        df = df[[column for column in INTERVAL_SOURCE_COLUMNS if column in df.columns]]
+    sessions = split_sessions(df)
+    if sessionids is None:
+        sessionids = list(sessions.keys())
+    if compact:
+        return dict((sessionid, compact_session(prepare_session_rows(sessions[sessionid]))) for sessionid in sessionids)
+    return dict((sessionid, prepare_session_rows(sessions[sessionid])) for sessionid in sessionids)
+
+# The columns of a prepared session that the detectors, plots and key ideas read.
+SESSION_COLUMNS = ['Session Id',
+                   'Outcome',
+                   'Selection',
+                   'Feedback Text',
+                   'Cleaned method 1',
+                   'Cleaned method 2',
+                   'cases',
+                   'Time_seconds',
+                   'Duration']
+
+# The columns kept in compact sessions: the ones above, and the activity and condition interval_table reads.
+COMPACT_COLUMNS = SESSION_COLUMNS+['Problem Name','condition1']
+
+# Columns with few distinct values, stored as categories in compact sessions.
+CATEGORY_COLUMNS = ['Session Id','Outcome','Selection','Feedback Text','Cleaned method 1','Cleaned method 2','cases',
+                    'Problem Name','condition1']
+
+def compact_session(df, columns=COMPACT_COLUMNS):
+    '''Shrinks a prepared session so many of them fit in memory at once.
+    Only the columns the pipeline and interval_table read are kept (COMPACT_COLUMNS), the string columns become categories
+    and the times in seconds are stored as float32 (exact for whole seconds up to about 190 days).
+
+    Args:
+        df (Pandas dataframe): A prepared session, as given by prepare_session.
+        columns (list): The columns to keep.
+
+    Returns:
+        A new compact dataframe, the detectors, get_key_ideas and interval_table give the same results on it.
+    '''
+    compact = df[[column for column in columns if column in df.columns]].copy()
+    for column in compact.columns:
+        if column in CATEGORY_COLUMNS:
+            compact[column] = compact[column].astype('category')
+        elif column in ['Time_seconds','Duration']:
+            compact[column] = compact[column].astype(np.float32)
+    return compact
+
+def memory_report(frames):
+    '''Measures how much memory a set of dataframes takes, strings included.
+
+    Args:
+        frames (dict or list): Dataframes, as a dictionary of name -> dataframe (ex: prepare_all_sessions(df_all)) or a list of (name, dataframe).
+
+    Returns:
+        A dataframe with the rows, columns and megabytes of each dataframe, with a last 'total' row.
+    '''
+    if isinstance(frames, dict):
+        frames = list(frames.items())
+    report = pd.DataFrame([(name, df.shape[0], df.shape[1], df.memory_usage(index=True, deep=True).sum()/1e6)
+                           for name,df in frames],
+                          columns=['name','rows','columns','megabytes'])
+    total = pd.DataFrame([('total', report['rows'].sum(), report['columns'].max() if len(report) else 0, report['megabytes'].sum())],
+                         columns=report.columns)
+    return pd.concat([report,total],ignore_index=True)
+
 
 def action_usage(df,column,action):
     '''Given an action or method, we detect its use using a particular column
@@ -153,7 +408,10 @@ def action_usage(df,column,action):
     Returns:
         A list of tuples with start times of the action and it's duration [(start1,duration1),(start2,duration2),...]
     '''
-    return zip(df[df[column].str.contains(action,na=False)]['Time_seconds'],df[df[column].str.contains(action,na=False)]['Duration'])
+    if not isinstance(df, pd.DataFrame):
+        #a session object (ex: a PatternMatcher) that already scanned the column for us
+        return df.usage(column,action)
+    return list(zip(df[df[column].str.contains(action,na=False)]['Time_seconds'],df[df[column].str.contains(action,na=False)]['Duration']))
 
 def action_usage_exact(df,column,action):
     '''Given an action or method, we detect its exact use (no combined action or method) using a particular column
@@ -169,7 +427,7 @@ def action_usage_exact(df,column,action):
     Returns:
         A list of tuples with start times of the action and it's duration [(start1,duration1),(start2,duration2),...]
     '''
-    return zip(df[df[column].str.match(action,as_indexer=True)]['Time_seconds'],df[df[column].str.match(action,as_indexer=True)]['Duration'])
+    return list(zip(df[df[column].str.match(action,na=False)]['Time_seconds'],df[df[column].str.match(action,na=False)]['Duration']))
 
 def merge_usage(x,y):
     '''
@@ -202,20 +460,23 @@ def merge_usage(x,y):
     
     
     #for pairs of coordinates, we check if we can merged them
-    for i,(s1,d1) in enumerate(x):
+    #when they are merged we skip the next coordinates instead of removing them from the list
+    i = 0
+    while i < len(x):
+        s1,d1 = x[i]
         if i != len(x)-1: 
             s2,d2 = x[i+1] #get next coordinates
 #             print s1,d1,s2,d2
             if s1 == s2: #if same start times, find max duration
                 merged.append((s1,max(d1,d2)))
-                x.remove((s2,d2))
+                i += 1
             elif s1+d1 >= s2+d2: #if one coordinate bounds the other
                 merged.append((s1,d1)) #we add that coordinate
-                x.remove((s2,d2)) #and remove the other
+                i += 1 #and skip the other
             elif s1+d1 >= s2: # if they overlap
                 new_duration = d2 + s2-s1 #we calculate a new duration
                 merged.append((s1,new_duration)) #add the new coordinate with earliest start time
-                x.remove((s2,d2)) #and remove the other
+                i += 1 #and skip the other
             else:
                 merged.append((s1,d1))
         else:
@@ -223,10 +484,12 @@ def merge_usage(x,y):
             # so we try to merge them with the previous coordinates
             if s1 <= merged[-1][0]+merged[-1][1]:
                 new_start = merged[-1][0]
-                new_duration = d1 + s1 - merged[-1][0]
+                #the last coordinates may end before the previous ones (ex: (0,10) then (4,2)), never shorten them
+                new_duration = max(d1 + s1, merged[-1][0]+merged[-1][1]) - merged[-1][0]
                 merged[-1] = (new_start,new_duration) #extend the duration of the last coordinate
             else: #if it fails, then there is no overlap and we merge them
                 merged.append((s1,d1))
+        i += 1
     return merged
 
 def intersect_usage(x,y):
@@ -247,44 +510,60 @@ def intersect_usage(x,y):
         then intersect_usage(x,y) -> [(0, 1), (3, 1), (10, 1), (12, 1)] #0,3,10,12
 
     '''
-    x.sort() #sort them by start time
-    y.sort()
+    x = sorted(x) #sort them by start time, without changing the lists we were given
+    y = sorted(y)
     intersect = []
     
     #for pairs of coordinates, we check if we can capture intersect
-    while len(x) > 0 and len(y) > 0:
-        (sx,dx) = x[0]
-        (sy,dy) = y[0]
+    #i and j point to the earliest coordinates of x and y we haven't used up yet
+    i = j = 0
+    while i < len(x) and j < len(y):
+        (sx,dx) = x[i]
+        (sy,dy) = y[j]
 
         if sx == sy: #if same start times, find min duration
             intersect.append((sx,min(dx,dy)))
             if dx<dy:
-                x.pop(0)
+                i += 1
             else:
-                y.pop(0)             
+                j += 1             
         elif sx < sy and sx+dx > sy: # if they overlap
             if sx+dx >= sy+dy: #if one coordinate bounds the other
                 intersect.append((sy,dy)) #we add that inner coordinate
-                y.pop(0) #and remove it
+                j += 1 #and remove it
             else: #if no bounding, then just overlap
                 intersect.append((sy,dx - (sy-sx))) #add the new coordinate with latest start time
-                x.pop(0) #and remove the earliest one
+                i += 1 #and remove the earliest one
         elif sy < sx and sy+dy > sx: # if they overlap (opposite scenario)
             if sy+dy >= sx+dx: #if one coordinate bounds the other (opposite scenario)
                 intersect.append((sx,dx)) #we add that inner coordinate
-                x.pop(0) #and remove it
+                i += 1 #and remove it
             else:
                 intersect.append((sx,dy - (sx-sy))) #add the new coordinate with latest start time
-                y.pop(0) #and remove the earliest one
+                j += 1 #and remove the earliest one
         else:
             #there was no intersect so we remove the earliest coordinate
             if sx < sy:
-                x.pop(0)
+                i += 1
             else:
-                y.pop(0)
+                j += 1
 
     return intersect
 
+def session_frame(df):
+    '''Gives the prepared dataframe of a session, whether we were given the dataframe
+    itself or a session object wrapping it (ex: a PatternMatcher).'''
+    if isinstance(df, pd.DataFrame):
+        return df
+    return df.df
+
+def raw_cases(df):
+    '''The distinct cases of a session as logged, ex: '1 3 5 7 9,3 4 5 6 7'. Rows outside of any case have none and are left out.'''
+    return [raw_case for raw_case in set(session_frame(df)['cases']) if isinstance(raw_case,STRING_TYPES)]
+
+# The method columns of the left and right side of a case
+CASE_METHOD_COLUMNS = ['Cleaned method 1','Cleaned method 2']
+
 def merge_method_usage(df, pattern):
 	# For merging whenever an action is used in either the right or leftset of the case
     m1 = action_usage(df,'Cleaned method 1',pattern)
@@ -292,6 +571,13 @@ def merge_method_usage(df, pattern):
     return merge_usage(m1,m2)
 
 def all_cases(df):
+    '''Same as find_cases, but when given a SessionContext the cases it already found are reused.'''
+    if not isinstance(df, pd.DataFrame):
+        #a session object (ex: a SessionContext), see session_utils.PatternMatcher
+        return df.all_cases()
+    return find_cases(df)
+
+def find_cases(df):
     '''Given a dataframe with students' activity, we extract all
     the contrasting cases they were given as well as starting time and
     length of time for which they were working on that case.
@@ -307,8 +593,7 @@ def all_cases(df):
     coordinates = {}
     
     #get all possible cases
-    raw_cases = list(set(df['cases']))
-    for raw_case in raw_cases:
+    for raw_case in raw_cases(df):
         #clean them up:
         case = tuple(raw_case.split(','))
         #we get time coordinates the way we always do
@@ -321,6 +606,56 @@ def all_cases(df):
             raise ValueError('This case seems to be used more than once: '+case)
     return coordinates
 
+CaseSide = namedtuple('CaseSide', ['values','numbers','ints','gaps','low','high'])
+
+def case_side(case_values):
+    '''Parses the values of one side of a contrasting case into what the detectors need.
+
+    Args:
+        case_values (str): The values of one side of the case, ex: '1 3 5 7 9'.
+
+    Returns:
+        A CaseSide with:
+            values: the values as strings, in the order given
+            numbers: the values as integer strings, sorted
+            ints: the set of values as integers
+            gaps: the set of integers missing between the lowest and highest values
+            low, high: the lowest and highest values as strings (compared as strings, like the detectors always did)
+    '''
+    values = case_values.split(" ")
+    numbers = sorted([str(int(x)) for x in values])
+    ints = frozenset([int(x) for x in values])
+    low,high = min(values),max(values)
+    gaps = frozenset(range( int(low) , int(high) )) - ints
+    return CaseSide(values,numbers,ints,gaps,low,high)
+
+def case_sides(df, case):
+    '''Gives the left and right CaseSide of a case, reusing them when df is a SessionContext.
+
+    Args:
+        df (Pandas dataframe): The dataframe (or session object) the case comes from.
+        case (tuple): The case in the format ('1 2 3 6','2 3 6 7').
+
+    Returns:
+        (left, right) CaseSide tuples.
+    '''
+    if not isinstance(df, pd.DataFrame):
+        return df.case_sides(case)
+    return case_side(case[0]),case_side(case[1])
+
+def case_window(df, case):
+    '''Gives what the per-case detectors should search in for one case.
+    A SessionContext gives back a view of only the rows logged during the case, so the patterns of a case
+    are never matched against the rest of the session. A dataframe is given back as is.
+
+    Args:
+        df (Pandas dataframe): The dataframe (or session object) of the session.
+        case (tuple): The case, ex: ('1 3 5 7 9','3 4 5 6 7').
+    '''
+    if not isinstance(df, pd.DataFrame):
+        return df.case_window(case)
+    return df
+
 REGEX_SINGLE_VALUE_FIRST = "st\d \d(?:$|(?:\sst)|(?:\s[\-\+x\/]\s[A-Z]))"
 # matches:
 # st1 5
@@ -331,12 +666,17 @@ REGEX_SINGLE_VALUE_SECOND = "st\d [A-Z][\sa-z]+ [\-\+x\/] \d(?:$|(?:\s?st))"
 # st1 Average all + 5 st
 # st2 Count all - 5
 
+def single_value_patterns():
+    '''The (column, pattern) pairs single_value_usage searches for.'''
+    #a single value at the start of the first method was never counted, so it isn't searched for
+    return [('Cleaned method 2',REGEX_SINGLE_VALUE_FIRST),
+            ('Cleaned method 1',REGEX_SINGLE_VALUE_SECOND),
+            ('Cleaned method 2',REGEX_SINGLE_VALUE_SECOND)]
+
 def single_value_usage(df):
     usage= []
-    method1 = action_usage(df,'Cleaned method 1',REGEX_SINGLE_VALUE_FIRST)
-    usage.extend(action_usage(df,'Cleaned method 2',REGEX_SINGLE_VALUE_FIRST))
-    usage.extend(action_usage(df,'Cleaned method 1',REGEX_SINGLE_VALUE_SECOND))
-    usage.extend(action_usage(df,'Cleaned method 2',REGEX_SINGLE_VALUE_SECOND))
+    for column,pattern in single_value_patterns():
+        usage.extend(action_usage(df,column,pattern))
     return clean_coords(usage)
 
 REGEX_AVERAGE = "(?:Average all)|(?:Average choose\.\.\.(?:\s[(?:{{0}})])+)"
@@ -346,6 +686,9 @@ REGEX_MEDIAN = "(?:Median all)|(?:Median choose\.\.\.(?:\s[(?:{{0}})])+)"
 # Average all
 # Sum  choose... x y z 			#where x,y,z are numbers from the case
 
+def central_tendency_patterns(side):
+    '''The average, sum and median patterns searched for in the method column of one side of a case (a CaseSide).'''
+    return [regex.format('|'.join(side.numbers)) for regex in [REGEX_AVERAGE,REGEX_SUM,REGEX_MEDIAN]]
 
 def central_tendency_usage(df):
     usage = []
@@ -354,21 +697,16 @@ def central_tendency_usage(df):
         start = coords[0]
         end = coords[1]
         
-        lcase = [str(int(x)) for x in case[0].split(" ")]
-        rcase = [str(int(x)) for x in case[1].split(" ")]
-        lcase.sort()
-        rcase.sort()
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
 
 
-        average = action_usage(df, 'Cleaned method 1' ,REGEX_AVERAGE.format('|'.join(lcase)))
-        sumall = action_usage(df, 'Cleaned method 1' ,REGEX_SUM.format('|'.join(lcase)))
-        median = action_usage(df, 'Cleaned method 1' ,REGEX_MEDIAN.format('|'.join(lcase)))
+        average,sumall,median = [action_usage(window, 'Cleaned method 1' ,pattern) for pattern in central_tendency_patterns(left)]
         merging = merge_usage(average,sumall)
         cent1 = merge_usage(merging, median)
 
-        average = action_usage(df, 'Cleaned method 2' ,REGEX_AVERAGE.format('|'.join(rcase)))
-        sumall = action_usage(df, 'Cleaned method 2' ,REGEX_SUM.format('|'.join(rcase)))
-        median = action_usage(df, 'Cleaned method 2' ,REGEX_MEDIAN.format('|'.join(rcase)))
+        average,sumall,median = [action_usage(window, 'Cleaned method 2' ,pattern) for pattern in central_tendency_patterns(right)]
         merging = merge_usage(average,sumall)
         cent2 = merge_usage(merging, median)
 
@@ -389,6 +727,12 @@ def regex_count_gaps(gapvalues):
 # Count choose... x y z 
 # Count x y z
 
+def count_gaps_patterns(side):
+    '''The pattern searched for in the method column of one side of a case (a CaseSide): counting the values missing from it.'''
+    if len(side.gaps)>0:
+        return [regex_count_gaps([str(x) for x in side.gaps])]
+    return ["Count none"]
+
 def count_gaps_usage(df):
     usage = []
     cases = all_cases(df)
@@ -396,27 +740,14 @@ def count_gaps_usage(df):
         start = coords[0]
         end = coords[1]
         
-        lcase = case[0].split(" ")
-        rcase = case[1].split(" ")
-        lcase.sort()
-        rcase.sort()
-        
-        #get gap values for the regex
-        gapvalues_left = set(range( int(min(lcase)) , int(max(lcase)) )) - set([int(x) for x in lcase]) 
-        gapvalues_right = set(range( int(min(rcase)) , int(max(rcase)) )) - set([int(x) for x in rcase]) 
-
-        #get all times that the range is used somewhere the method
-        if len(gapvalues_left)>0:
-            re_left = regex_count_gaps([str(x) for x in gapvalues_left])
-            range1 = action_usage(df,'Cleaned method 1',re_left)
-        else:
-            range1 = action_usage(df,'Cleaned method 1',"Count none")
-            
-        if len(gapvalues_right)>0:
-            re_right = regex_count_gaps([str(x) for x in gapvalues_right])
-            range2 = action_usage(df,'Cleaned method 2',re_right)
-        else:
-            range2 = action_usage(df,'Cleaned method 2',"Count none")     
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
+
+
+        #get all times that the gap values are counted somewhere the method
+        range1 = action_usage(window,'Cleaned method 1',count_gaps_patterns(left)[0])
+        range2 = action_usage(window,'Cleaned method 2',count_gaps_patterns(right)[0])
 
         # and keep only the times that fall within the current case
         range1_for_case = intersect_usage(range1,[coords])
@@ -428,10 +759,13 @@ def count_gaps_usage(df):
     usage.sort()
     return usage
 
+def evaluation_steps_patterns():
+    '''The (column, pattern) pairs evaluation_steps_usage searches for.'''
+    # return [("Selection","submit"),...]
+    return [("Selection","evaluation"),("Selection","checkIntuition")]
+
 def evaluation_steps_usage(df):
-    # submit_usage = action_usage(df,"Selection","submit")
-    evaluation_usage = action_usage(df,"Selection","evaluation")
-    checkIntuition_usage = action_usage(df,"Selection","checkIntuition")
+    evaluation_usage,checkIntuition_usage = [action_usage(df,column,pattern) for column,pattern in evaluation_steps_patterns()]
     
     ##do some merging
     merged = merge_usage(evaluation_usage, checkIntuition_usage)
@@ -499,12 +833,15 @@ def range_usage(df):
         start = coords[0]
         end = coords[1]
         #find min and maxes of cases for the regex
-        lmin,lmax = min(case[0].split(" ")),max(case[0].split(" "))
-        rmin,rmax = min(case[1].split(" ")),max(case[1].split(" "))
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
+        lmin,lmax = left.low,left.high
+        rmin,rmax = right.low,right.high
         
         #get all times that the range is used
-        range1 = action_usage(df,'Cleaned method 1',regex_range(lmin,lmax))
-        range2 = action_usage(df,'Cleaned method 2',regex_range(rmin,rmax))
+        range1 = subtraction_usage(window,'Cleaned method 1',lmax,lmin)
+        range2 = subtraction_usage(window,'Cleaned method 2',rmax,rmin)
         
         #keep only the times that fall within the current case
         range1_for_case = intersect_usage(range1,[coords])
@@ -522,6 +859,24 @@ def regex_distance(v1,v2):
 # matches:
 # x - y 		# where z and y are case numbers
 
+def subtraction_usage(df,column,v1,v2):
+    '''Same as action_usage(df,column,regex_distance(v1,v2)): when a method subtracts v2 from v1.
+    When df is a SessionContext the rows are looked up in its index of subtractions instead of scanning the column.
+
+    Args:
+        df (Pandas dataframe): The dataframe (or session object) to search in.
+        column (str): The method column to search in.
+        v1, v2: The two values of the subtraction, ex: 7 and 1 for '7 - 1'.
+
+    Returns:
+        A list of tuples with start times of the action and it's duration [(start1,duration1),(start2,duration2),...]
+    '''
+    if not isinstance(df, pd.DataFrame):
+        usage = df.subtraction_usage(column,v1,v2)
+        if usage is not None:
+            return usage
+    return action_usage(df,column,regex_distance(v1,v2))
+
 def distance_usage(df):
     usage = []
     cases = all_cases(df)
@@ -529,10 +884,11 @@ def distance_usage(df):
         start = coords[0]
         end = coords[1]
         
-        lcase = case[0].split(" ")
-        rcase = case[1].split(" ")
-        left_values = set([int(x) for x in lcase])
-        right_values = set([int(x) for x in rcase])
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
+        left_values = left.ints
+        right_values = right.ints
 
         distance1 = []
         distance2 = []
@@ -546,8 +902,8 @@ def distance_usage(df):
             if (v2 == lmax and v1== lmin): #this is range so we ignore
                 continue
             else:
-                distance1 = merge_usage(distance1,action_usage(df,'Cleaned method 1',regex_distance(v1,v2)))
-                distance1 = merge_usage(distance1,action_usage(df,'Cleaned method 1',regex_distance(v2,v1)))
+                distance1 = merge_usage(distance1,subtraction_usage(window,'Cleaned method 1',v1,v2))
+                distance1 = merge_usage(distance1,subtraction_usage(window,'Cleaned method 1',v2,v1))
                 
         for v1,v2 in list(itertools.combinations(right_values, 2)):
             if (v1 == rmax and v2== rmin):
@@ -555,8 +911,8 @@ def distance_usage(df):
             if (v2 == rmax and v1== rmin):
                 continue
             else:
-                distance2 = merge_usage(distance2,action_usage(df,'Cleaned method 2',regex_distance(v1,v2)))
-                distance2 = merge_usage(distance2,action_usage(df,'Cleaned method 2',regex_distance(v2,v1)))
+                distance2 = merge_usage(distance2,subtraction_usage(window,'Cleaned method 2',v1,v2))
+                distance2 = merge_usage(distance2,subtraction_usage(window,'Cleaned method 2',v2,v1))
 
         # and keep only the times that fall within the current case
         distance1_for_case = intersect_usage(distance1,[coords])
@@ -579,10 +935,14 @@ build_actions = ["add\d",
                 "Selection",
                 "step\d\_\d"]
 
+def build_patterns():
+    '''The (column, pattern) pairs build_events searches for.'''
+    return [('Selection',re_build) for re_build in build_actions]
+
 def build_events(df):
     usage = []
-    for re_build in build_actions:
-        building = action_usage(df,'Selection',re_build)
+    for column,re_build in build_patterns():
+        building = action_usage(df,column,re_build)
         usage.extend(building)
     #since these are actions - not episodes, we give them all a duration of 2 seconds
     usage = [(x,2) for x,y in usage]
@@ -595,6 +955,11 @@ def regex_all_numbers(case_numbers):
     return ''.join(["(?=.*"+x+")" for x in case_numbers])
 
 REGEX_COUNT_ALL = "Count (?:all)|(?:choose\.\.\.{0})"
+
+def count_all_patterns(side):
+    '''The pattern searched for in the method column of one side of a case (a CaseSide): counting all of its values.'''
+    return [REGEX_COUNT_ALL.format(regex_all_numbers(side.numbers))]
+
 def count_all_usage(df):
     usage = []
     cases = all_cases(df)
@@ -602,13 +967,12 @@ def count_all_usage(df):
         start = coords[0]
         end = coords[1]
         
-        lcase = [str(int(x)) for x in case[0].split(" ")]
-        rcase = [str(int(x)) for x in case[1].split(" ")]
-        lcase.sort()
-        rcase.sort()
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
         
-        count_left = action_usage(df, 'Cleaned method 1' ,REGEX_COUNT_ALL.format(regex_all_numbers(lcase)))
-        count_right = action_usage(df, 'Cleaned method 2' ,REGEX_COUNT_ALL.format(regex_all_numbers(rcase)))
+        count_left = action_usage(window, 'Cleaned method 1' ,count_all_patterns(left)[0])
+        count_right = action_usage(window, 'Cleaned method 2' ,count_all_patterns(right)[0])
 
         count_case_left = intersect_usage(count_left,[coords])
         count_case_right = intersect_usage(count_right,[coords])
@@ -616,11 +980,22 @@ def count_all_usage(df):
         usage.extend(clean_coords(merge_usage(count_case_right,count_case_left)))
     return usage
 
+REGEX_MULTIPLICATION = '[a-zA-Z0-9(?: all)(?: choose)\.]+ x [a-zA-Z0-9(?: all)(?: choose)\.]+'
+REGEX_ADDITION = '[a-zA-Z0-9(?: all)(?: choose)\.]+ \+ [a-zA-Z0-9(?: all)(?: choose)\.]+'
+
+def multiplication_patterns():
+    '''The (column, pattern) pairs multiplication_usage searches for.'''
+    return [(column,REGEX_MULTIPLICATION) for column in CASE_METHOD_COLUMNS]
+
+def addition_patterns():
+    '''The (column, pattern) pairs addition_usage searches for.'''
+    return [(column,REGEX_ADDITION) for column in CASE_METHOD_COLUMNS]
+
 def multiplication_usage(df):
-    return merge_method_usage(df,'[a-zA-Z0-9(?: all)(?: choose)\.]+ x [a-zA-Z0-9(?: all)(?: choose)\.]+')
+    return merge_usage(*[action_usage(df,column,pattern) for column,pattern in multiplication_patterns()])
 
 def addition_usage(df):
-    return merge_method_usage(df,'[a-zA-Z0-9(?: all)(?: choose)\.]+ \+ [a-zA-Z0-9(?: all)(?: choose)\.]+')
+    return merge_usage(*[action_usage(df,column,pattern) for column,pattern in addition_patterns()])
 
 # matches:
 # Count choose... 2 3 x Sum all
@@ -634,23 +1009,18 @@ def combo_central_tendency_usage(df):
         start = coords[0]
         end = coords[1]
         
-        lcase = [str(int(x)) for x in case[0].split(" ")]
-        rcase = [str(int(x)) for x in case[1].split(" ")]
-        lcase.sort()
-        rcase.sort()
+        left,right = case_sides(df,case)
+        #only the rows logged during this case need to be searched
+        window = case_window(df,case)
 
-        average = action_usage(df, 'Cleaned method 1' ,REGEX_AVERAGE.format('|'.join(lcase)))
-        sumall = action_usage(df, 'Cleaned method 1' ,REGEX_SUM.format('|'.join(lcase)))
-        median = action_usage(df, 'Cleaned method 1' ,REGEX_MEDIAN.format('|'.join(lcase)))
+        average,sumall,median = [action_usage(window, 'Cleaned method 1' ,pattern) for pattern in central_tendency_patterns(left)]
 
         combo_cent1 = []
         # find any intersections of a combo of central tendency methods
         for c1,c2 in list(itertools.combinations([average,sumall,median], 2)):
             combo_cent1.extend(intersect_usage(c1,c2))
 
-        average = action_usage(df, 'Cleaned method 2' ,REGEX_AVERAGE.format('|'.join(rcase)))
-        sumall = action_usage(df, 'Cleaned method 2' ,REGEX_SUM.format('|'.join(rcase)))
-        median = action_usage(df, 'Cleaned method 2' ,REGEX_MEDIAN.format('|'.join(rcase)))
+        average,sumall,median = [action_usage(window, 'Cleaned method 2' ,pattern) for pattern in central_tendency_patterns(right)]
 
         combo_cent2 = []
         # find any intersections of a combo of central tendency methods
@@ -668,63 +1038,191 @@ def combo_central_tendency_usage(df):
     return usage
 
 def other_usage(df):
-    mult = multiplication_usage(df)
+    mult = detector_result(df,multiplication_usage)
     # add = addition_usage(df)
-    combo_cent = combo_central_tendency_usage(df)
+    combo_cent = detector_result(df,combo_central_tendency_usage)
     
     usage = merge_usage(mult,combo_cent)
     # usage.extend(add)
     
+    #each method is only run once (or taken from the session if it already ran) instead of once per pair
     all_methods = [single_value_usage,central_tendency_usage,range_usage,distance_usage,count_gaps_usage]
-    for m1,m2 in list(itertools.combinations(all_methods, 2)):
-        usage.extend(intersect_usage(m1(df),m2(df)))       
+    all_usages = [detector_result(df,method) for method in all_methods]
+    for u1,u2 in list(itertools.combinations(all_usages, 2)):
+        usage.extend(intersect_usage(u1,u2))       
     
     return usage
 
-def get_key_ideas(df):
-    
-    def format_time(t):
-        mins = int(t/60)
-        secs = int(t-mins*60)
-        return '{0}:{1}'.format(mins,secs)
+# The detectors each detector uses the results of. They are run first and their results passed on.
+DETECTOR_DEPENDENCIES = {other_usage: [multiplication_usage,
+                                       combo_central_tendency_usage,
+                                       single_value_usage,
+                                       central_tendency_usage,
+                                       range_usage,
+                                       distance_usage,
+                                       count_gaps_usage]}
+
+# The patterns each detector searches for, built by the function the detector calls itself so they are only written once.
+# 'session' functions give the (column, pattern) pairs searched in the whole session, 'case' functions are given
+# one side of a case (a CaseSide) and give the patterns searched in the method column of that side.
+# range_usage and distance_usage look their subtractions up in an index instead (see subtraction_usage).
+DETECTOR_PATTERNS = {single_value_usage: ('session',single_value_patterns),
+                     evaluation_steps_usage: ('session',evaluation_steps_patterns),
+                     build_events: ('session',build_patterns),
+                     multiplication_usage: ('session',multiplication_patterns),
+                     addition_usage: ('session',addition_patterns),
+                     central_tendency_usage: ('case',central_tendency_patterns),
+                     combo_central_tendency_usage: ('case',central_tendency_patterns),
+                     count_gaps_usage: ('case',count_gaps_patterns),
+                     count_all_usage: ('case',count_all_patterns)}
+
+def detector_result(df, detector):
+    '''Runs a detector on a session. When df is a SessionContext, the detector is only
+    run the first time and its result is reused afterwards.
+
+    Args:
+        df (Pandas dataframe): The dataframe (or session object) to run the detector on.
+        detector (function): A detector, ex: range_usage.
+
+    Returns:
+        The list of time coordinates found by the detector.
+    '''
+    if not isinstance(df, pd.DataFrame):
+        return df.result(detector)
+    return detector(df)
+
+def detector_patterns(df):
+    '''Lists every pattern the detectors will look for in a session, so they can all be scanned for at once.
+    These are the patterns DETECTOR_PATTERNS gives for each detector, including the ones that depend on the cases.
+
+    Args:
+        df (Pandas dataframe): The prepared dataframe of the session (or a session object wrapping it).
+
+    Returns:
+        A list of (column, pattern) pairs.
+    '''
+    patterns = session_patterns(df)
+    for raw_case in raw_cases(df):
+        patterns.extend(case_patterns(df,raw_case))
+    return patterns
+
+def session_patterns(df):
+    '''The patterns of detector_patterns that don't depend on the cases, and the 'cases' pattern of each case.'''
+    patterns = []
+    for detector,(scope,build) in DETECTOR_PATTERNS.items():
+        if scope == 'session':
+            patterns.extend(build())
+    #find_cases looks each case up
+    for raw_case in raw_cases(df):
+        patterns.append(('cases',raw_case))
+    return patterns
+
+def case_patterns(df, raw_case):
+    '''The patterns of detector_patterns that the per-case detectors build for one case, ex: '1 3 5 7 9,3 4 5 6 7'.'''
+    patterns = []
+    sides = case_sides(df,tuple(raw_case.split(',')))
+    builds = []
+    for detector,(scope,build) in DETECTOR_PATTERNS.items():
+        #some detectors search for the same patterns (ex: central tendency), they are only given once
+        if scope == 'case' and build not in builds:
+            builds.append(build)
+            for column,side in zip(CASE_METHOD_COLUMNS,sides):
+                patterns.extend((column,pattern) for pattern in build(side))
+    return patterns
+
+KEY_IDEAS_COLUMNS = ['action','timestamp','cases','tried methods']
+
+def format_timestamps(seconds):
+    '''Formats a column of times in seconds as minutes and seconds, ex: 125.0 -> '2:5'.'''
+    seconds = pd.Series(seconds)
+    mins = (seconds/60).astype(int)
+    secs = (seconds-mins*60).astype(int)
+    return mins.astype(str)+':'+secs.astype(str)
+
+def _unrepeated(column, sessions):
+    #remove all consecutive duplicates within each session
+    # ie. delete delete delete -> delete NaN NaN
+    return column.where(column.groupby(sessions,sort=False).shift() != column)
+
+def get_key_ideas_batch(sessions, pseudonyms=None):
+    '''Finds the methods students tried (right before deleting or submitting them) in many sessions at once,
+    and puts them in a single table, session after session. This is the table get_key_ideas gives for one session.
+    The sessions are stacked once and processed together, and the dataframes we are given are not changed.
+
+    Args:
+        sessions (dict or list): The prepared dataframe of each session, as a dictionary of
+                                 session id -> dataframe (ex: prepare_all_sessions(df_all)) or a list of (session id, dataframe).
+        pseudonyms (dict): Optional pseudonym of each session id, added as a 'pseudonym' column.
+
+    Returns:
+        A dataframe with the columns session, (pseudonym,) action, timestamp, cases and tried methods.
+    '''
+    if isinstance(sessions, dict):
+        sessions = list(sessions.items())
+    columns = ['Selection','Cleaned method 1','Cleaned method 2','cases','Time_seconds']
+    frames = []
+    for order,(sessionid,df) in enumerate(sessions):
+        frame = pd.DataFrame(dict((column,np.asarray(df[column],dtype=object)) for column in columns),columns=columns)
+        frame['session'] = sessionid
+        frame['order'] = order
+        frames.append(frame)
+    output = ['session']+(['pseudonym'] if pseudonyms is not None else [])+KEY_IDEAS_COLUMNS
+    if not frames:
+        return pd.DataFrame(columns=output)
+    df = pd.concat(frames,ignore_index=True)
+    df['Time_seconds'] = df['Time_seconds'].astype(float)
+    order = df['order']
 
     #merge method from right and left side
-    df['Cleaned joined methods'] = df['Cleaned method 1'].map(str) + ' | ' + df['Cleaned method 2']
+    methods = df['Cleaned method 1'].astype(str) + ' | ' + df['Cleaned method 2']
     #edit actions so weither they are from the right side or left doesn't matter
     # ie. delete1 and delete2 -> delete
-    df['Selection_unsided'] = [s.replace('1','').replace('2','') for s in list(df['Selection'].map(str))]
-    #remove all consecutive duplicate actions
-    # ie. delete delete delete -> delete NaN NaN
-    df['Selection_unsided'] = df['Selection_unsided'].loc[df['Selection_unsided'].shift() != df['Selection_unsided']]
-    #remove all consecutive duplicate methods
-    df['Cleaned joined methods'] = df['Cleaned joined methods'].loc[df['Cleaned joined methods'].shift() != df['Cleaned joined methods']]
+    actions = df['Selection'].astype(str).str.replace('1','',regex=False).str.replace('2','',regex=False)
+    #remove all consecutive duplicate actions and methods
+    actions = _unrepeated(actions,order)
+    methods = _unrepeated(methods,order)
     #shift the Selection (or student action) so that we can find their methods BEFORE they delete or submit.
-    df['Selection_unsided_shifted'] = df['Selection_unsided'].shift(-1)
+    actions = actions.groupby(order,sort=False).shift(-1)
 
     #Now we can find all submitted ideas on first submit and first delete
-    # we don't need to make it as a "set" anymore!
-    #     submitted_ideas = set(df[df['Selection'].str.contains('submit',na=False)]['Cleaned joined methods'])
-    #     deleted_all_ideas = set(df[df['Selection'].str.contains('deleteAll',na=False)]['Cleaned joined methods'])
-    submitted_ideas = df[df['Selection_unsided_shifted'].str.contains('submit',na=False)][['Selection_unsided_shifted','Time_seconds','cases','Cleaned joined methods']]
-    deleted_ideas = df[df['Selection_unsided_shifted'].str.contains('delete',na=False)][['Selection_unsided_shifted','Time_seconds','cases','Cleaned joined methods']]
-    ideas = pd.concat([deleted_ideas,submitted_ideas])
+    deleted = actions.str.contains('delete',na=False)
+    submitted = actions.str.contains('submit',na=False)
     #remove empty methods
-    ideas = ideas[ideas['Cleaned joined methods'].str.contains("st1 | st1", regex=False) == False]
-    ideas.replace(',',' | ',regex=True, inplace=True)
-
-    #Let's add rows to separate cases:
-    raw_cases = list(set(df['cases']))
-    num_cases = len(raw_cases)
-    df_cases = pd.DataFrame()
-    df_cases['Selection_unsided_shifted'] = ['get new case']*num_cases
-    df_cases['Time_seconds'] = [action_usage(df,'cases',case)[0][0] for case in raw_cases]
-    df_cases['cases'] = ['-']*num_cases
-    df_cases['Cleaned joined methods'] = ['-']*num_cases
-    ideas = pd.concat([ideas, df_cases])
+    tried = (deleted | submitted) & (methods.str.contains("st1 | st1", regex=False) == False)
+    ideas = pd.DataFrame({'order': order[tried],
+                          'kind': np.where(deleted[tried],0,1),
+                          'action': actions[tried].str.replace(',',' | ',regex=False),
+                          'Time_seconds': df['Time_seconds'][tried],
+                          'cases': df['cases'][tried].astype(object).str.replace(',',' | ',regex=False),
+                          'tried methods': methods[tried].str.replace(',',' | ',regex=False)})
+
+    #Let's add rows to separate cases, at the first time each case shows up:
+    firsts = df[df['cases'].notnull()].drop_duplicates(['order','cases'])
+    new_cases = pd.DataFrame({'order': firsts['order'],
+                              'kind': 2,
+                              'action': 'get new case',
+                              'Time_seconds': firsts['Time_seconds'],
+                              'cases': '-',
+                              'tried methods': '-'})
+    ideas = pd.concat([ideas,new_cases],ignore_index=True)
 
     #sort by time and clean format the time in minutes and seconds
-    ideas.sort_values(by='Time_seconds',inplace=True)
-    ideas['timestamp'] = ideas[['Time_seconds']].applymap(lambda t: format_time(t))
+    ideas = ideas.sort_values(by=['order','Time_seconds','kind'],kind='mergesort')
+    ideas['timestamp'] = format_timestamps(ideas['Time_seconds']).values
+    ideas['session'] = [sessions[i][0] for i in ideas['order']]
+    if pseudonyms is not None:
+        ideas['pseudonym'] = ideas['session'].map(pseudonyms)
     ideas.reset_index(drop=True, inplace=True)
-    ideas.rename(columns = {'Selection_unsided_shifted':'action','Cleaned joined methods':'tried methods'}, inplace = True)
-    return ideas[['action','timestamp','cases','tried methods']]
\ No newline at end of file
+    return ideas[output]
+
+def get_key_ideas(df):
+    '''Finds the methods a student tried (right before deleting or submitting them) in one session,
+    with a row marking the start of each case.
+
+    Args:
+        df (Pandas dataframe): The prepared dataframe of the session. It is not changed.
+
+    Returns:
+        A dataframe with the columns action, timestamp, cases and tried methods.
+    '''
+    return get_key_ideas_batch([(None,df)])[KEY_IDEAS_COLUMNS]
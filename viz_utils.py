@@ -1,6 +1,17 @@
 from utils import *
+from session_utils import SessionContext
+from multiprocessing import Pool
+import io
+import re
+import time
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.collections import PolyCollection
 import seaborn as sns
+try:
+    import tracemalloc
+except ImportError: #only there since Python 3.4
+    tracemalloc = None
 
 colors = {"Cases":"white",
          "Now try working on this new example":"#252525",
@@ -42,18 +53,42 @@ function_to_use = {"Cases":case_usage,
 
 to_plot = ["Cases","intuition",'Single value','Central tendency',"Count all","Count gaps",'Range',"Other distance","Other","Build","delete","deleteAll","submit","evaluation steps"]
 
-def plot(df,to_plot,colors, column_to_use, function_to_use, for_export=True):
-    fig = plt.figure(figsize=(18,9))
-    ax = plt.subplot()
-    spacing =10
-    pos = 0
+def timeline_data(df, to_plot=to_plot, column_to_use=column_to_use, function_to_use=function_to_use, spacing=10):
+    '''Computes everything drawn on the timeline of a session, without drawing it.
+
+    Args:
+        df (Pandas dataframe): The prepared dataframe of the session (or a SessionContext).
+        to_plot, column_to_use, function_to_use: Same as for plot.
+        spacing (int): Height of each row of the timeline.
+
+    Returns:
+        A dictionary with:
+            actions: the rows of the timeline from bottom to top
+            spacing: the height of each row
+            rows: a list of (action, y position, time coordinates) for each row
+            case_points: a list of (x values, y values) for the dots showing the values of each side of each case
+            case_row: the y position of the Cases row, None if it isn't plotted
+            solutions: a list of (time, 'left method | right method') for each correct solution
+            new_cases: the time coordinates of the bars marking a new case
+            max_time: the end of the last thing plotted
+    '''
+    if isinstance(df, SessionContext):
+        session = df
+    else:
+        #scan the session once for every pattern the detectors and the plotted actions need
+        session = SessionContext(df)
+        session.register([(column,action) for action,column in column_to_use.items()])
+        session.scan()
+    df = session.df
     max_time = 0
     actions = list(reversed(to_plot))
-    black = '#252525'
+    rows = []
+    case_points = []
+    case_pos = None
     for i,action in enumerate(actions):
+        pos = i*spacing
         if action == "Cases":
-            cases = all_cases(df)
-            for case,coords in all_cases(df).items():
+            for case,coords in all_cases(session).items():
                 left = [float(x) for x in case[0].split(" ")]
                 right = [float(x) for x in case[1].split(" ")]
                 ymax = max(max(left),max(right))
@@ -62,44 +97,354 @@ def plot(df,to_plot,colors, column_to_use, function_to_use, for_export=True):
                 Yl = [(l-ymin+1)/(ymax-ymin+1)*(spacing-2.5)+1+pos for l in left]
                 Xr = [coords[0]+30+20]*len(right)
                 Yr = [(r-ymin+1)/(ymax-ymin+1)*(spacing-2.5)+1+pos for r in right]
-                ax.plot(Xl,Yl,'.',color="darkgrey",markersize=10)
-                ax.plot(Xr,Yr,'.',color="darkgrey",markersize=10)
-                case_pos = pos
+                case_points.append((Xl,Yl))
+                case_points.append((Xr,Yr))
+            case_pos = pos
         if action in column_to_use.keys():
-            action_use = action_usage(df,column_to_use[action],action)
+            action_use = action_usage(session,column_to_use[action],action)
         else:
-            action_use = function_to_use[action](df)
+            action_use = session.result(function_to_use[action])
         if action_use:
             max_time = max(max_time,sum(action_use[-1]))
-            ax.broken_barh(action_use,(pos,spacing),facecolors=colors[action],alpha=1,linewidth=0)
-        pos += spacing
+        rows.append((action,pos,action_use))
 
-    coords = zip(df[df['Feedback Text'].str.contains("Good. Click Done to continue.",na=False)]['Time_seconds'],df[df['Feedback Text'].str.contains("Good. Click Done to continue.",na=False)]['Duration'])
-    solutions_left = df[df['Feedback Text'].str.contains("Good. Click Done to continue.",na=False)]['Cleaned method 1']
-    solutions_right = df[df['Feedback Text'].str.contains("Good. Click Done to continue.",na=False)]['Cleaned method 2']
-    solutions = [sl+' | '+sr for sl,sr in zip (solutions_left,solutions_right)]
+    solved = session.hit('Feedback Text',"Good. Click Done to continue.")
+    solutions = [(t,sl+' | '+sr) for t,sl,sr in zip(df['Time_seconds'][solved],df['Cleaned method 1'][solved],df['Cleaned method 2'][solved])]
 
-    for s,coord in zip (solutions,coords):
-        ax.text(coord[0]-5,case_pos+spacing/2,s,horizontalalignment='right',fontsize=14)
+    #Add new case bar
+    new_case = "Now try working on this new example"
+    action_use = action_usage(session,column_to_use[new_case],new_case)
+    new_cases = []
+    if action_use:
+        max_time = max(max_time,sum(action_use[-1]))
+        new_cases = [(x-10,10) for (x,y) in action_use]+[(-10,10)]
+
+    return {'actions':actions,
+            'spacing':spacing,
+            'rows':rows,
+            'case_points':case_points,
+            'case_row':case_pos,
+            'solutions':solutions,
+            'new_cases':new_cases,
+            'max_time':max_time}
+
+def plot(df,to_plot,colors, column_to_use, function_to_use, for_export=True):
+    data = timeline_data(df,to_plot,column_to_use,function_to_use)
+    fig = plt.figure(figsize=(18,9))
+    ax = plt.subplot()
+    spacing = data['spacing']
+    max_time = data['max_time']
+    actions = data['actions']
+    black = '#252525'
+    for X,Y in data['case_points']:
+        ax.plot(X,Y,'.',color="darkgrey",markersize=10)
+    for action,pos,action_use in data['rows']:
+        if action_use:
+            ax.broken_barh(action_use,(pos,spacing),facecolors=colors[action],alpha=1,linewidth=0)
+
+    case_pos = data['case_row']
+    for t,s in data['solutions']:
+        ax.text(t-5,case_pos+spacing//2,s,horizontalalignment='right',fontsize=14)
 
 #     #Add horizontal bar
 #     ax.broken_barh([(0,ax.get_xlim()[1])],((len(actions))*spacing,spacing),facecolors='white',alpha=1,linewidth=0)
 
     #Add new case bar
-    new_case = "Now try working on this new example"
-    action_use = action_usage(df,column_to_use[new_case],new_case)
-    case_use = [(x-10,10) for (x,y) in action_use]+[(-10,10)]
-    if action_use:
-        max_time = max(max_time,sum(action_use[-1]))
-        ax.broken_barh(case_use,(0,(len(actions))*spacing),facecolors="white",alpha=1,linewidth=0)
+    if data['new_cases']:
+        ax.broken_barh(data['new_cases'],(0,(len(actions))*spacing),facecolors="white",alpha=1,linewidth=0)
 
     #Add labels
     ax.set_xlabel('minutes in activity',fontsize=13)
     ax.set_xticks(range(0,int(max_time),60))
-    ax.set_xticklabels([str(x/60)+''if x in range(0,int(max_time),60*5) else "" for x in range(0,int(max_time),60)],fontsize=13)
-    ax.set_yticks(range(spacing/2,len(actions)*spacing,spacing))
+    ax.set_xticklabels([str(x//60)+''if x in range(0,int(max_time),60*5) else "" for x in range(0,int(max_time),60)],fontsize=13)
+    ax.set_yticks(range(spacing//2,len(actions)*spacing,spacing))
     ax.set_yticklabels([a.capitalize() for a in actions],fontsize=15)
     ax.grid(True)
     if for_export:
     	return plt
-    plt.show()
\ No newline at end of file
+    plt.show()
+
+def _init_render_worker():
+    #workers never show anything, they only draw pages to send back
+    plt.switch_backend('Agg')
+
+def _render_page(task):
+    rows,title,to_plot,colors,column_to_use,function_to_use = task
+    df = prepare_session_rows(rows)
+    plot(df,to_plot,colors, column_to_use, function_to_use,for_export=True)
+    plt.title(title,fontsize=25)
+    plt.tight_layout()
+    fig = plt.gcf()
+    #the page is drawn here, in the worker, and sent back as a one page pdf so it stays a vector drawing
+    page = io.BytesIO()
+    fig.savefig(page,format='pdf')
+    plt.close(fig)
+    return page.getvalue()
+
+# A reference to another object of a pdf, ex: '12 0 R'.
+PDF_REFERENCE = re.compile(br'(\d+) 0 R(?![A-Za-z0-9])')
+
+def _pdf_objects(data):
+    '''Reads the objects of a pdf written by matplotlib's pdf backend, through its cross-reference table.
+
+    Args:
+        data (bytes): The pdf.
+
+    Returns:
+        (objects, root, info) where objects gives the body of each object by number (without 'N 0 obj' and 'endobj'),
+        and root and info are the numbers of the catalog and of the document information.
+    '''
+    start = int(re.search(br'startxref\s+(\d+)',data[data.rindex(b'startxref'):]).group(1))
+    table = re.match(br'xref\s+0 (\d+)\s+',data[start:])
+    offsets = {}
+    for number in range(int(table.group(1))):
+        entry = data[start+table.end()+20*number:start+table.end()+20*(number+1)]
+        if entry[17:18] == b'n':
+            offsets[number] = int(entry[:10])
+    #objects follow each other, so each one ends where the next one (or the table) starts
+    ends = sorted(offsets.values())+[start]
+    objects = {}
+    for number,offset in offsets.items():
+        body = data[offset:ends[ends.index(offset)+1]]
+        body = body[body.index(b'obj')+3:body.rindex(b'endobj')]
+        objects[number] = body.strip(b'\n')
+    trailer = data[start:]
+    root = int(re.search(br'/Root (\d+) 0 R',trailer).group(1))
+    info = re.search(br'/Info (\d+) 0 R',trailer)
+    return objects,root,int(info.group(1)) if info else None
+
+def _write_pdf_pages(pages, f):
+    '''Puts one page pdfs (as written by matplotlib's pdf backend) one after the other into a single pdf.
+    Each page is written as soon as it is given, its objects are only renumbered, never drawn again.
+
+    Args:
+        pages (iterable): The pdf of each page, as bytes.
+        f (file): Where to write the pdf, opened in binary mode.
+
+    Returns:
+        The number of pages written.
+    '''
+    #the catalog is object 1 and the tree of all pages object 2, they are written last
+    offsets = {}
+    kids = []
+    position = [0]
+    def write(data):
+        f.write(data)
+        position[0] += len(data)
+    def write_object(number, body):
+        offsets[number] = position[0]
+        write(('%d 0 obj\n' % number).encode('ascii')+body+b'\nendobj\n')
+    write(b'%PDF-1.4\n%\xac\xdc \xab\xba\n')
+    for page in pages:
+        objects,root,info = _pdf_objects(page)
+        tree = int(re.search(br'/Pages (\d+) 0 R',objects[root]).group(1))
+        #the catalog, page tree and information of each page are replaced by the ones of the whole pdf
+        numbers = {tree: 2}
+        for number in sorted(objects):
+            if number not in (root,tree,info):
+                numbers[number] = len(offsets)+len(numbers)+2
+        def renumber(match):
+            return ('%d 0 R' % numbers[int(match.group(1))]).encode('ascii')
+        for number in sorted(objects):
+            if number in (root,tree,info):
+                continue
+            #only the dictionary of an object can hold references, not the (binary) stream after it
+            head,separator,stream = objects[number].partition(b'stream\n')
+            write_object(numbers[number], PDF_REFERENCE.sub(renumber,head)+separator+stream)
+        kids.extend(numbers[int(kid)] for kid in PDF_REFERENCE.findall(re.search(br'/Kids \[(.*?)\]',objects[tree],re.S).group(1)))
+    write_object(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+    write_object(2, ('<< /Type /Pages /Kids [ %s ] /Count %d >>' % (' '.join('%d 0 R' % kid for kid in kids),len(kids))).encode('ascii'))
+    table = position[0]
+    size = len(offsets)+1
+    write(('xref\n0 %d\n' % size).encode('ascii')+b'0000000000 65535 f \n')
+    for number in range(1,size):
+        write(('%010d 00000 n \n' % offsets[number]).encode('ascii'))
+    write(('trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (size,table)).encode('ascii'))
+    return len(kids)
+
+def render_sessions_pdf(df_all, sessions, path, titles=None, processes=None,
+                        to_plot=to_plot, colors=colors, column_to_use=column_to_use, function_to_use=function_to_use):
+    '''Draws the timeline of many sessions into a single pdf, one page per session.
+    Sessions are prepared and drawn in parallel by a pool of worker processes, each page into a pdf of its own,
+    and the pages are only put together here, in the order of the sessions given (see _write_pdf_pages).
+
+    Args:
+        df_all (Pandas dataframe): The raw export with all sessions.
+        sessions (list): The session ids to draw, in the order of the pages.
+        path (str): Where to write the pdf, ex: 'viz_all_pairs_activities.pdf'.
+        titles (list): The title of each page. Defaults to the session id.
+        processes (int): Number of worker processes. Defaults to the number of cpus, use 1 to draw everything in this process.
+        to_plot, colors, column_to_use, function_to_use: Same as for plot.
+
+    Returns:
+        The number of pages written.
+    '''
+    if titles is None:
+        titles = list(sessions)
+    rows = split_sessions(df_all)
+    tasks = ((rows[session],title,to_plot,colors,column_to_use,function_to_use) for session,title in zip(sessions,titles))
+
+    if processes == 1:
+        results = (_render_page(task) for task in tasks)
+        pool = None
+    else:
+        pool = Pool(processes,initializer=_init_render_worker)
+        results = pool.imap(_render_page,tasks)
+    try:
+        with open(path,'wb') as f:
+            return _write_pdf_pages(results,f)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+def _bar_vertices(coords, y, height):
+    #the corners of the rectangle of each time coordinate, like broken_barh draws them
+    return [[(start,y),(start,y+height),(start+duration,y+height),(start+duration,y)] for start,duration in coords]
+
+class TimelineTemplate(object):
+    '''A styled timeline figure that is drawn once and reused for every session.
+    All the bars of a session go into a single collection, the new case bars into another one,
+    and all the case dots into a single line, so a page has a handful of artists however long the session is.
+    Only those artists, the labels of the solutions, the x axis and the title change from one session to the next.
+
+    Args:
+        to_plot (list): The rows of the timeline, same as for plot.
+        colors (dict): The color of each row, same as for plot.
+        spacing (int): Height of each row of the timeline.
+        figsize (tuple): Size of the figure.
+    '''
+    def __init__(self, to_plot=to_plot, colors=colors, spacing=10, figsize=(18,9)):
+        self.colors = colors
+        self.spacing = spacing
+        self.actions = list(reversed(to_plot))
+        self.fig = plt.figure(figsize=figsize)
+        self.ax = self.fig.add_subplot(111)
+        self.ax.set_xlabel('minutes in activity',fontsize=13)
+        self.ax.set_yticks([spacing/2.0+i*spacing for i in range(len(self.actions))])
+        self.ax.set_yticklabels([a.capitalize() for a in self.actions],fontsize=15)
+        self.ax.set_ylim(0,len(self.actions)*spacing)
+        self.ax.grid(True)
+        self.title = self.ax.set_title('',fontsize=25)
+        self.artists = []
+
+    def draw(self, data, title=''):
+        '''Draws the timeline of a session, as given by timeline_data, in place of the previous one.
+
+        Returns:
+            The figure, ready to be saved.
+        '''
+        for artist in self.artists:
+            artist.remove()
+        self.artists = []
+        ax = self.ax
+        spacing = data['spacing']
+        height = len(data['actions'])*spacing
+
+        vertices = []
+        facecolors = []
+        for action,pos,action_use in data['rows']:
+            vertices.extend(_bar_vertices(action_use,pos,spacing))
+            facecolors.extend([self.colors[action]]*len(action_use))
+        bars = PolyCollection(vertices,facecolors=facecolors,linewidths=0)
+        new_cases = PolyCollection(_bar_vertices(data['new_cases'],0,height),facecolors="white",linewidths=0)
+        self.artists.extend([ax.add_collection(bars),ax.add_collection(new_cases)])
+
+        X = [x for xs,ys in data['case_points'] for x in xs]
+        Y = [y for xs,ys in data['case_points'] for y in ys]
+        self.artists.extend(ax.plot(X,Y,'.',color="darkgrey",markersize=10))
+        for t,s in data['solutions']:
+            self.artists.append(ax.text(t-5,data['case_row']+spacing/2.0,s,horizontalalignment='right',fontsize=14))
+
+        max_time = data['max_time']
+        margin = 0.05*(max_time+10)
+        ax.set_xlim(-10-margin,max_time+margin)
+        ax.set_ylim(0,height)
+        ax.set_xticks(range(0,int(max_time),60))
+        ax.set_xticklabels([str(x//60)+''if x in range(0,int(max_time),60*5) else "" for x in range(0,int(max_time),60)],fontsize=13)
+        self.title.set_text(title)
+        return self.fig
+
+def _artist_count(fig):
+    return sum(len(ax.collections)+len(ax.lines)+len(ax.texts) for ax in fig.axes)
+
+def _start_memory():
+    #forget the peak of the previous session and remember what was already allocated before this one
+    if tracemalloc is None or not tracemalloc.is_tracing():
+        return None
+    if hasattr(tracemalloc,'reset_peak'):
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.clear_traces()
+    return tracemalloc.get_traced_memory()[0]
+
+def _peak_memory_mb(baseline):
+    #the most memory allocated at once since _start_memory, on top of what was there before
+    if baseline is None:
+        return float('nan')
+    return max(tracemalloc.get_traced_memory()[1]-baseline,0)/1e6
+
+def render_timelines(sessions, path=None, titles=None, fast=True, measure_memory=True,
+                     to_plot=to_plot, colors=colors, column_to_use=column_to_use, function_to_use=function_to_use):
+    '''Draws the timelines of prepared sessions one after the other, optionally into a pdf,
+    and measures how long each one takes and how much memory is used.
+
+    Args:
+        sessions (list): (session id, prepared dataframe) pairs, ex: prepare_all_sessions(df_all).items().
+        path (str): Where to write the pdf. If None, the pages are only drawn.
+        titles (list): The title of each page. Defaults to the session id.
+        fast (bool): Use a TimelineTemplate. Otherwise each session is drawn with plot, to compare against.
+        measure_memory (bool): Trace the memory allocated for each session with tracemalloc.
+                               Tracing slows everything down a bit, the same for both renderers.
+        to_plot, colors, column_to_use, function_to_use: Same as for plot.
+
+    Returns:
+        A dataframe with one row per session: the renderer used, the number of artists drawn,
+        the seconds spent finding what to draw and drawing it, and the most memory allocated at once
+        while doing so in MB (NaN when not measured).
+    '''
+    sessions = list(sessions)
+    tracing = measure_memory and tracemalloc is not None and not tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.start()
+    if titles is None:
+        titles = [session for session,df in sessions]
+    pdf = PdfPages(path) if path is not None else None
+    template = TimelineTemplate(to_plot,colors) if fast else None
+    stats = []
+    try:
+        for (sessionid,df),title in zip(sessions,titles):
+            baseline = _start_memory() if measure_memory else None
+            start = time.time()
+            session = SessionContext(df)
+            session.register([(column,action) for action,column in column_to_use.items()])
+            data = timeline_data(session,to_plot,column_to_use,function_to_use)
+            computed = time.time()
+            if fast:
+                fig = template.draw(data,title)
+            else:
+                #the session already holds all the results, so plot only draws
+                plot(session,to_plot,colors,column_to_use,function_to_use,for_export=True)
+                plt.title(title,fontsize=25)
+                fig = plt.gcf()
+            if pdf is not None:
+                pdf.savefig(fig)
+            else:
+                fig.canvas.draw()
+            drawn = time.time()
+            stats.append({'session': sessionid,
+                          'renderer': 'template' if fast else 'plot',
+                          'artists': _artist_count(fig),
+                          'compute_seconds': computed-start,
+                          'draw_seconds': drawn-computed,
+                          'peak_memory_mb': _peak_memory_mb(baseline)})
+            if not fast:
+                plt.close(fig)
+    finally:
+        if pdf is not None:
+            pdf.close()
+        if template is not None:
+            plt.close(template.fig)
+        if tracing:
+            tracemalloc.stop()
+    return pd.DataFrame(stats,columns=['session','renderer','artists','compute_seconds','draw_seconds','peak_memory_mb'])